@@ -187,6 +187,8 @@ DEFAULT_FROM_EMAIL = 'sanjeevsriramsg@gmail.com'
 TWILIO_ACCOUNT_SID = ''  # Set this in production
 TWILIO_AUTH_TOKEN = ''   # Set this in production
 TWILIO_WHATSAPP_FROM = 'whatsapp:+14155238886'  # Twilio Sandbox number (or your approved number)
+TWILIO_API_BASE_URL = 'https://api.twilio.com'  # Point at a local stand-in for tests and benchmarks
+TWILIO_STATUS_CALLBACK_URL = ''  # Public URL of /api/notifications/twilio-status/ ('' = the host the message was queued from)
 
 # Invoice settings
 INVOICE_SETTINGS = {
@@ -208,4 +210,52 @@ INVOICE_SETTINGS = {
     # Invoice prefixes
     'TOPMATE_INVOICE_PREFIX': 'TM-INV',
     'USER_INVOICE_PREFIX': 'USER',
+
+    # Bulk upload
+    'BULK_UPLOAD_MAX_SIZE': 5 * 1024 * 1024,  # Largest accepted CSV in bytes (None = no limit)
+    'BULK_UPLOAD_BATCH_SIZE': 200,  # Rows created before their PDFs are rendered and sent
+
+    # Background bulk uploads (python manage.py run_bulk_upload_worker)
+    'BULK_UPLOAD_POLL_INTERVAL': 2,  # Seconds the worker sleeps when no job is queued
+    'BULK_UPLOAD_STALE_AFTER': 900,  # Seconds without progress before a running job is failed
+    'BULK_UPLOAD_RESULTS_PAGE_SIZE': 100,  # Row results per page of /bulk-upload-jobs/<id>/results/
+
+    # Invoice email delivery (bulk uploads and /invoices/<id>/send_email/)
+    'EMAIL_CHUNK_SIZE': 50,  # Messages sent over one SMTP connection before it is reopened
+
+    # Notification outbox (python manage.py run_notification_worker)
+    'NOTIFICATION_RATE_LIMITS': {'email': 10, 'whatsapp': 1},  # Messages per second per channel (0 = unlimited)
+    'NOTIFICATION_MAX_ATTEMPTS': 6,  # Tries before a message is dead-lettered
+    'NOTIFICATION_RETRY_BACKOFF': 30,  # Seconds before the first retry, doubled after every failure
+    'NOTIFICATION_RETRY_BACKOFF_MAX': 3600,  # Longest wait between retries
+    'NOTIFICATION_BATCH_SIZE': 50,  # Messages claimed by the worker per round
+    'NOTIFICATION_POLL_INTERVAL': 1,  # Seconds the worker sleeps when nothing is due
+    'NOTIFICATION_STALE_AFTER': 300,  # Seconds before a 'sending' message is assumed dead and re-queued
+    'WHATSAPP_CONCURRENCY': 8,  # WhatsApp messages sent to Twilio at once (still paced by NOTIFICATION_RATE_LIMITS)
+    'WHATSAPP_TIMEOUT': 10,  # Seconds to wait for each Twilio API call
+
+    # Twilio status callbacks (POST /api/notifications/twilio-status/)
+    'STATUS_CALLBACK_BATCH_SIZE': 500,  # Buffered delivery updates written in one bulk_update
+    'STATUS_CALLBACK_FLUSH_INTERVAL': 0.5,  # Seconds an update waits in the buffer at most
+    'STATUS_CALLBACK_ACK_TIMEOUT': 10,  # Seconds a callback waits for its batch before Twilio is told to retry
+    'STATUS_CALLBACK_UNMATCHED_TTL': 300,  # Seconds an update for a not yet recorded SID is kept for retries
+
+    # Bulk upload PDF rendering
+    'PDF_WORKERS': 1,  # Worker processes for bulk PDF rendering (1 = render serially)
+    'PDF_CACHE_SIZE': 32,  # Recently emailed PDFs kept in memory per process (0 = off)
+    'MERGED_PDF_MAX_INVOICES': 500,  # Invoices accepted by /api/invoices/merged-pdf/ per request (None = no limit)
+
+    # Background PDF rendering (python manage.py run_pdf_worker)
+    'PDF_QUEUE_BATCH_SIZE': 20,  # Invoices claimed by the worker per round
+    'PDF_QUEUE_POLL_INTERVAL': 1,  # Seconds the worker sleeps when nothing is pending
+    'PDF_RENDER_STALE_AFTER': 600,  # Seconds before a 'rendering' job is assumed dead and re-queued
+    'PDF_RETRY_AFTER': 2,  # Retry-After (seconds) sent with 202 while a PDF is being rendered
+
+    # wkhtmltopdf (pdfkit) renderer pool - used only when the binary is installed
+    'WKHTMLTOPDF_PATH': '',  # Empty = look up wkhtmltopdf on PATH
+    'WKHTMLTOPDF_WORKERS': 2,  # Warm wkhtmltopdf processes per server process
+    'WKHTMLTOPDF_TIMEOUT': 30,  # Seconds before a stuck render is abandoned
+
+    # Performance benchmarks (python manage.py run_benchmarks --baseline ...)
+    'BENCHMARK_REGRESSION_THRESHOLD': 20,  # Percent a metric may grow before the run fails
 }
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import BusinessProfile, InvoiceNumberSequence, Invoice, InvoiceItem
+from .models import BusinessProfile, InvoiceNumberSequence, Invoice, InvoiceItem, BulkUploadJob, NotificationOutbox
 
 
 class InvoiceItemInline(admin.TabularInline):
@@ -43,9 +43,12 @@ class InvoiceAdmin(admin.ModelAdmin):
         'invoice_number', 'invoice_type', 'buyer_name',
         'total', 'invoice_date', 'is_draft', 'created_at'
     ]
-    list_filter = ['invoice_type', 'is_draft', 'is_interstate', 'invoice_date', 'created_at']
+    list_filter = ['invoice_type', 'is_draft', 'is_interstate', 'pdf_status', 'invoice_date', 'created_at']
     search_fields = ['invoice_number', 'buyer_name', 'seller_name', 'user_id']
-    readonly_fields = ['created_at', 'updated_at', 'invoice_number']
+    readonly_fields = [
+        'created_at', 'updated_at', 'invoice_number', 'pdf_hash', 'pdf_engine',
+        'pdf_status', 'pdf_queued_at', 'pdf_started_at', 'pdf_finished_at', 'pdf_error',
+    ]
     date_hierarchy = 'invoice_date'
     inlines = [InvoiceItemInline]
 
@@ -65,7 +68,11 @@ class InvoiceAdmin(admin.ModelAdmin):
             'fields': ('subtotal', 'cgst', 'sgst', 'igst', 'total', 'is_interstate')
         }),
         ('Additional Information', {
-            'fields': ('notes', 'payment_terms', 'pdf_url', 'pdf_file'),
+            'fields': ('notes', 'payment_terms', 'pdf_url', 'pdf_file', 'pdf_hash', 'pdf_engine'),
+            'classes': ('collapse',)
+        }),
+        ('PDF Rendering', {
+            'fields': ('pdf_status', 'pdf_queued_at', 'pdf_started_at', 'pdf_finished_at', 'pdf_error'),
             'classes': ('collapse',)
         }),
         ('Metadata', {
@@ -86,3 +93,27 @@ class InvoiceItemAdmin(admin.ModelAdmin):
     list_filter = ['invoice__invoice_type', 'created_at']
     search_fields = ['invoice__invoice_number', 'description', 'hsn_sac']
     readonly_fields = ['amount', 'created_at']
+
+
+@admin.register(BulkUploadJob)
+class BulkUploadJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user_id', 'invoice_type', 'status', 'rows_processed', 'successful', 'failed', 'created_at']
+    list_filter = ['status', 'invoice_type', 'created_at']
+    search_fields = ['user_id', 'batch_id']
+    readonly_fields = [
+        'batch_id', 'error', 'total_rows', 'rows_processed', 'successful', 'failed',
+        'already_created', 'last_committed_row', 'emails_queued', 'whatsapp_queued', 'created_at', 'started_at', 'finished_at', 'updated_at'
+    ]
+
+
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = [
+        'id', 'invoice', 'channel', 'recipient', 'status', 'provider_status', 'attempts', 'next_attempt_at', 'delivered_at'
+    ]
+    list_filter = ['status', 'provider_status', 'channel', 'created_at']
+    search_fields = ['recipient', 'invoice__invoice_number', 'provider_message_id']
+    readonly_fields = [
+        'invoice', 'attempts', 'last_error', 'provider_message_id', 'provider_status', 'provider_error_code',
+        'provider_status_at', 'created_at', 'started_at', 'delivered_at', 'updated_at'
+    ]
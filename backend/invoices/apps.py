@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class InvoicesConfig(AppConfig):
     name = 'invoices'
+
+    def ready(self):
+        # Probe for wkhtmltopdf once at startup rather than on every render
+        from .renderers import get_wkhtmltopdf_path
+        get_wkhtmltopdf_path()
@@ -0,0 +1,634 @@
+"""
+Performance benchmarks for invoice PDF rendering and bulk processing
+Run with: python manage.py run_benchmarks [name ...]
+
+Every benchmark creates its own synthetic invoices inside a transaction that
+is rolled back afterwards, so it can run against any database.
+
+Results can be saved as a JSON baseline and later runs compared against it
+(see compare_to_baseline); a metric that grows by more than the threshold
+percentage counts as a regression.
+"""
+import csv
+import io
+import json
+import math
+import socketserver
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from django.db import transaction
+from .models import Invoice
+from .testing import BENCH_SELLER_DETAILS, make_bulk_csv, make_invoices, scratch_media
+
+
+@contextmanager
+def rollback_data():
+    """Run a block inside a transaction that is always rolled back"""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+@contextmanager
+def count_queries():
+    """
+    Count SQL statements run inside the block
+    Yields a one-item list holding the running count (unlike
+    CaptureQueriesContext this is not capped by the debug query log).
+    """
+    from django.db import connection
+
+    count = [0]
+
+    def counter(execute, sql, params, many, context):
+        count[0] += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(counter):
+        yield count
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def latency_summary(seconds):
+    """p50/p95/max of a list of timings, in milliseconds"""
+    return {
+        'p50_ms': round(percentile(seconds, 50) * 1000, 2),
+        'p95_ms': round(percentile(seconds, 95) * 1000, 2),
+        'max_ms': round(max(seconds) * 1000, 2),
+    }
+
+
+def measure(fn, *args, **kwargs):
+    """
+    Run fn once, recording wall time and peak traced memory
+    Returns:
+        tuple: (fn result, seconds, peak bytes)
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def bench_merged_pdf(sizes=(10, 100, 1000)):
+    """Merged multi-invoice PDF vs rendering N separate PDFs"""
+    from .services import render_invoice_pdf, render_merged_invoice_pdf
+
+    results = []
+    for size in sizes:
+        with rollback_data():
+            invoices = make_invoices(size)
+            queryset = Invoice.objects.filter(user_id='benchmark').prefetch_related('items').order_by('id')
+
+            # Warm up imports and font metrics so neither side pays for them
+            render_invoice_pdf(invoices[0])
+
+            merged, merged_seconds, merged_peak = measure(
+                render_merged_invoice_pdf, queryset.iterator(chunk_size=200)
+            )
+            # Concatenating the separate documents would only add to this
+            separate, separate_seconds, separate_peak = measure(
+                lambda: [render_invoice_pdf(invoice) for invoice in queryset.iterator(chunk_size=200)]
+            )
+
+        results.append({
+            'invoices': size,
+            'merged_seconds': round(merged_seconds, 4),
+            'merged_bytes': len(merged),
+            'merged_peak_bytes': merged_peak,
+            'separate_seconds': round(separate_seconds, 4),
+            'separate_bytes': sum(len(pdf) for pdf in separate),
+            'separate_peak_bytes': separate_peak,
+        })
+    return results
+
+
+def bench_item_counts(sizes=(10, 100, 1000, 10000)):
+    """Single-invoice render time, memory and size as the item count grows"""
+    from .services import render_invoice_pdf
+
+    results = []
+    for size in sizes:
+        with rollback_data():
+            invoice = make_invoices(1, item_count=size, prefix=f'ITEMS{size}')[0]
+            render_invoice_pdf(make_invoices(1, prefix=f'WARM{size}')[0])
+
+            pdf, seconds, peak = measure(render_invoice_pdf, invoice)
+
+        results.append({
+            'items': size,
+            'seconds': round(seconds, 4),
+            'ms_per_item': round(seconds * 1000 / size, 4),
+            'peak_bytes': peak,
+            'bytes': len(pdf),
+            'pages': pdf.count(b'/Type /Page\n'),
+        })
+    return results
+
+
+def bench_static_layer(sizes=(10, 100, 1000)):
+    """Static page layers drawn inline on every page vs reused form XObjects"""
+    from reportlab.pdfgen import canvas
+    from .services import PAGE_WIDTH, PAGE_HEIGHT, STATIC_FORMS, _ensure_static_forms
+
+    def inline(pages):
+        p = canvas.Canvas(None, pagesize=(PAGE_WIDTH, PAGE_HEIGHT), pageCompression=1)
+        for _ in range(pages):
+            for draw in STATIC_FORMS.values():
+                draw(p)
+            p.showPage()
+        return p.getpdfdata()
+
+    def forms(pages):
+        p = canvas.Canvas(None, pagesize=(PAGE_WIDTH, PAGE_HEIGHT), pageCompression=1)
+        _ensure_static_forms(p)
+        for _ in range(pages):
+            for name in STATIC_FORMS:
+                p.doForm(name)
+            p.showPage()
+        return p.getpdfdata()
+
+    results = []
+    for size in sizes:
+        inline_pdf, inline_seconds, _ = measure(inline, size)
+        forms_pdf, forms_seconds, _ = measure(forms, size)
+        results.append({
+            'pages': size,
+            'inline_seconds': round(inline_seconds, 4),
+            'inline_bytes': len(inline_pdf),
+            'forms_seconds': round(forms_seconds, 4),
+            'forms_bytes': len(forms_pdf),
+        })
+    return results
+
+
+def bench_render(sizes=(1, 10, 100), repeats=5):
+    """
+    Single-invoice render through each generate_invoice_pdf backend
+    Varies item count, address length and intrastate/interstate taxes.
+    Backends that are not installed are reported as skipped.
+    """
+    from .renderers import ENGINE_WKHTMLTOPDF, ENGINE_REPORTLAB, get_wkhtmltopdf_pool
+    from .services import _render_invoice_html, _render_reportlab
+
+    pool = get_wkhtmltopdf_pool()
+    engines = {ENGINE_REPORTLAB: _render_reportlab}
+    if pool is not None:
+        engines[ENGINE_WKHTMLTOPDF] = lambda invoice: pool.render(_render_invoice_html(invoice))
+
+    results = []
+    if pool is None:
+        results.append({'engine': ENGINE_WKHTMLTOPDF, 'skipped': 'wkhtmltopdf not installed'})
+
+    for engine, render in engines.items():
+        for size in sizes:
+            for address_length in (40, 200):
+                for interstate in (False, True):
+                    with rollback_data():
+                        invoice = make_invoices(
+                            1,
+                            item_count=size,
+                            interstate=interstate,
+                            address_length=address_length,
+                            prefix=f'RENDER{size}',
+                        )[0]
+                        render(invoice)  # Warm-up
+
+                        timings = []
+                        for _ in range(repeats):
+                            start = time.perf_counter()
+                            render(invoice)
+                            timings.append(time.perf_counter() - start)
+                        # Traced separately: tracemalloc slows the timed runs down
+                        pdf, _, peak = measure(render, invoice)
+
+                    results.append({
+                        'engine': engine,
+                        'items': size,
+                        'address_length': address_length,
+                        'interstate': interstate,
+                        **latency_summary(timings),
+                        'peak_bytes': peak,
+                        'bytes': len(pdf),
+                    })
+    return results
+
+
+def bench_bulk_upload(sizes=(100, 1000, 10000)):
+    """BulkInvoiceProcessor.process over generated CSVs, PDFs included"""
+    from .bulk_upload_service import BulkInvoiceProcessor
+
+    results = []
+    for size in sizes:
+        with scratch_media(), rollback_data():
+            processor = BulkInvoiceProcessor(
+                csv_file=make_bulk_csv(size),
+                user_id='benchmark',
+                invoice_type='user',
+                seller_details=BENCH_SELLER_DETAILS,
+                # Pool workers run in other processes and cannot see rows
+                # inside the rolled-back transaction
+                pdf_workers=1,
+            )
+            summary, seconds, peak = measure(processor.process)
+
+        results.append({
+            'rows': size,
+            'successful': summary['successful'],
+            'seconds': round(seconds, 4),
+            'ms_per_row': round(seconds * 1000 / size, 2),
+            'peak_bytes': peak,
+        })
+    return results
+
+
+def bench_bulk_insert(sizes=(100, 1000, 5000)):
+    """Bulk upload database writes: bulk_create batches vs one savepoint per row"""
+    from .bulk_upload_service import BulkInvoiceProcessor
+
+    results = []
+    for size in sizes:
+        row = {'rows': size}
+        for mode, bulk_insert in (('row_by_row', False), ('bulk', True)):
+            with rollback_data():
+                # Drafts skip PDF rendering, leaving only the database work
+                processor = BulkInvoiceProcessor(
+                    csv_file=make_bulk_csv(size, item_count=3),
+                    user_id='benchmark',
+                    invoice_type='user',
+                    seller_details=BENCH_SELLER_DETAILS,
+                    create_as_draft=True,
+                    bulk_insert=bulk_insert,
+                )
+                with count_queries() as queries:
+                    start = time.perf_counter()
+                    processor.process()
+                    seconds = time.perf_counter() - start
+
+            row[f'{mode}_queries'] = queries[0]
+            row[f'{mode}_seconds'] = round(seconds, 4)
+        results.append(row)
+    return results
+
+
+def bench_row_validation(sizes=(1000, 100000)):
+    """CSV row validation: BulkInvoiceCSVRowSerializer vs the validate_csv_row fast path"""
+    from .bulk_upload_serializers import BulkInvoiceCSVRowSerializer, validate_csv_row
+
+    results = []
+    for size in sizes:
+        rows = [
+            {k.strip().lower(): v.strip() for k, v in row.items()}
+            for row in csv.DictReader(io.TextIOWrapper(make_bulk_csv(size, item_count=3), encoding='utf-8'))
+        ]
+        # Every tenth row fails, in a field check or the cross-field check
+        for n in range(0, size, 10):
+            rows[n]['pincode' if n % 20 else 'quantities'] = '0'
+
+        start = time.perf_counter()
+        for row in rows:
+            BulkInvoiceCSVRowSerializer(data=row).is_valid()
+        serializer_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for row in rows:
+            validate_csv_row(row)
+        fast_seconds = time.perf_counter() - start
+
+        results.append({
+            'rows': size,
+            'serializer_seconds': round(serializer_seconds, 4),
+            'fast_seconds': round(fast_seconds, 4),
+            'speedup': round(serializer_seconds / fast_seconds, 1),
+        })
+    return results
+
+
+class _SMTPStandInHandler(socketserver.StreamRequestHandler):
+    """Accepts every command and message, like a relay that never bounces"""
+
+    def reply(self, line):
+        # Network round trip to the real server
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost ESMTP benchmark')
+        for line in iter(self.rfile.readline, b''):
+            command = line[:4].upper()
+            if command == b'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                for data_line in iter(self.rfile.readline, b''):
+                    if data_line.rstrip(b'\r\n') == b'.':
+                        break
+                with self.server.lock:
+                    self.server.messages += 1
+                self.reply('250 OK')
+            elif command == b'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+@contextmanager
+def local_smtp_server(latency=0.0):
+    """
+    Run an SMTP stand-in on a free local port
+    Args:
+        latency: seconds added before every reply, standing in for the
+            round trip to a remote server
+    Yields:
+        server: has connections and messages counters; connect to
+            server.server_address
+    """
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), _SMTPStandInHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.connections = 0
+    server.messages = 0
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def bench_email_delivery(sizes=(10, 100, 1000), latency=0.002):
+    """Invoice emails to a local SMTP stand-in: a connection per message vs InvoiceMailer"""
+    from django.core.mail import EmailMessage, get_connection
+    from .mailer import InvoiceMailer
+
+    # Roughly the size of a rendered single-page invoice
+    attachment = b'%PDF-1.4 ' + b'0' * 4096
+
+    results = []
+    for size in sizes:
+        row = {'messages': size}
+        with local_smtp_server(latency) as server:
+            connection_kwargs = {
+                'backend': 'django.core.mail.backends.smtp.EmailBackend',
+                'host': server.server_address[0],
+                'port': server.server_address[1],
+                'username': '',
+                'password': '',
+                'use_tls': False,
+                'use_ssl': False,
+            }
+            messages = []
+            for n in range(size):
+                message = EmailMessage(f'Invoice BENCH-{n:06d}', 'Please find attached your invoice.',
+                                       'seller@example.com', [f'buyer{n}@example.com'])
+                message.attach(f'BENCH-{n:06d}.pdf', attachment, 'application/pdf')
+                messages.append(message)
+
+            start = time.perf_counter()
+            for message in messages:
+                # What EmailMessage.send() does without a shared connection
+                get_connection(fail_silently=False, **connection_kwargs).send_messages([message])
+            per_message_seconds = time.perf_counter() - start
+            per_message_connections = server.connections
+            per_message_delivered = server.messages
+
+            start = time.perf_counter()
+            with InvoiceMailer(**connection_kwargs) as mailer:
+                errors = mailer.send(messages)
+            mailer_seconds = time.perf_counter() - start
+
+        row.update({
+            # Counted by the stand-in, for the InvoiceMailer run
+            'delivered': server.messages - per_message_delivered,
+            'failed': sum(1 for error in errors if error is not None),
+            'per_message_connections': per_message_connections,
+            'per_message_seconds': round(per_message_seconds, 4),
+            'per_message_per_second': round(size / per_message_seconds, 1),
+            'mailer_connections': mailer.connections_opened,
+            'mailer_seconds': round(mailer_seconds, 4),
+            'mailer_per_second': round(size / mailer_seconds, 1),
+            'speedup': round(per_message_seconds / mailer_seconds, 1),
+        })
+        results.append(row)
+    return results
+
+
+class _TwilioStandInHandler(BaseHTTPRequestHandler):
+    """Answers Messages.json posts like Twilio, rejecting the numbers in server.invalid_numbers"""
+
+    # Keep-alive, so pooled clients reuse their connections
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode('utf-8'))
+        # Network round trip to the real API
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        to = form.get('To', [''])[0]
+        if not self.path.endswith('/Messages.json'):
+            status, payload = 404, {'code': 20404, 'message': 'Not found', 'status': 404}
+        elif to in self.server.invalid_numbers:
+            status, payload = 400, {'code': 21211, 'message': f"Invalid 'To' Phone Number: {to}", 'status': 400}
+        else:
+            with self.server.lock:
+                self.server.messages.append(form)
+                sid = f'SM{len(self.server.messages):032x}'
+            status, payload = 201, {'sid': sid, 'to': to, 'status': 'queued'}
+
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@contextmanager
+def local_twilio_server(latency=0.0, invalid_numbers=()):
+    """
+    Run a Twilio Messages API stand-in on a free local port
+    Args:
+        latency: seconds added before every reply, standing in for the
+            round trip to Twilio
+        invalid_numbers: 'To' addresses answered with error 21211
+    Yields:
+        server: has a connections counter, the received messages (form
+            dicts) and base_url to use as TWILIO_API_BASE_URL
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _TwilioStandInHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.invalid_numbers = set(invalid_numbers)
+    server.connections = 0
+    server.messages = []
+    server.lock = threading.Lock()
+    server.base_url = 'http://%s:%s' % server.server_address
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def bench_whatsapp_delivery(sizes=(10, 100, 1000), latency=0.02, concurrency=8):
+    """WhatsApp messages to a local Twilio stand-in: a client per message vs WhatsAppDispatcher"""
+    from .whatsapp import WhatsAppDispatcher, WhatsAppMessage
+
+    credentials = {'account_sid': 'ACbenchmark', 'auth_token': 'benchmark', 'from_': 'whatsapp:+14155238886'}
+
+    results = []
+    for size in sizes:
+        messages = [
+            WhatsAppMessage(f'whatsapp:+9198{n:08d}', f'Invoice BENCH-{n:06d} is ready',
+                            f'https://example.com/media/invoices/BENCH-{n:06d}.pdf')
+            for n in range(size)
+        ]
+        with local_twilio_server(latency) as server:
+            start = time.perf_counter()
+            for message in messages:
+                # What building a twilio.rest.Client per message costs: a
+                # fresh session (and connection) for every send, one at a time
+                with WhatsAppDispatcher(concurrency=1, base_url=server.base_url, **credentials) as single:
+                    single.send_one(message)
+            sequential_seconds = time.perf_counter() - start
+            sequential_connections = server.connections
+
+            start = time.perf_counter()
+            with WhatsAppDispatcher(concurrency=concurrency, base_url=server.base_url, **credentials) as dispatcher:
+                sids = dispatcher.send(messages)
+            dispatcher_seconds = time.perf_counter() - start
+
+        results.append({
+            'messages': size,
+            'concurrency': concurrency,
+            'failed': sum(1 for sid in sids if isinstance(sid, Exception)),
+            'sequential_connections': sequential_connections,
+            'sequential_seconds': round(sequential_seconds, 4),
+            'sequential_per_second': round(size / sequential_seconds, 1),
+            'dispatcher_connections': server.connections - sequential_connections,
+            'dispatcher_seconds': round(dispatcher_seconds, 4),
+            'dispatcher_per_second': round(size / dispatcher_seconds, 1),
+            'speedup': round(sequential_seconds / dispatcher_seconds, 1),
+        })
+    return results
+
+
+BENCHMARKS = {
+    'merged_pdf': bench_merged_pdf,
+    'item_counts': bench_item_counts,
+    'static_layer': bench_static_layer,
+    'render': bench_render,
+    'bulk_upload': bench_bulk_upload,
+    'bulk_insert': bench_bulk_insert,
+    'row_validation': bench_row_validation,
+    'email_delivery': bench_email_delivery,
+    'whatsapp_delivery': bench_whatsapp_delivery,
+}
+
+# Fields identifying a result row, used to match runs against a baseline
+BENCHMARK_KEYS = {
+    'merged_pdf': ('invoices',),
+    'item_counts': ('items',),
+    'static_layer': ('pages',),
+    'render': ('engine', 'items', 'address_length', 'interstate'),
+    'bulk_upload': ('rows',),
+    'bulk_insert': ('rows',),
+    'row_validation': ('rows',),
+    'email_delivery': ('messages',),
+    'whatsapp_delivery': ('messages', 'concurrency'),
+}
+
+# Metrics of the code paths in use that fail a run when they grow. The
+# reference paths they are measured against (serializer_seconds,
+# row_by_row_seconds, separate_seconds, inline_seconds, ...) are reported
+# but not gated, and max_ms is left out: a single slow repeat is too noisy.
+REGRESSION_METRICS = {
+    'merged_pdf': ('merged_seconds', 'merged_bytes', 'merged_peak_bytes'),
+    'item_counts': ('seconds', 'peak_bytes', 'bytes'),
+    'static_layer': ('forms_seconds', 'forms_bytes'),
+    'render': ('p50_ms', 'p95_ms', 'peak_bytes', 'bytes'),
+    'bulk_upload': ('seconds', 'peak_bytes'),
+    'bulk_insert': ('bulk_seconds', 'bulk_queries'),
+    'row_validation': ('fast_seconds',),
+    'email_delivery': ('mailer_seconds',),
+    'whatsapp_delivery': ('dispatcher_seconds',),
+}
+
+
+def compare_to_baseline(results, baseline, threshold):
+    """
+    Compare benchmark results against a saved baseline
+    Args:
+        results: {benchmark name: [result rows]} from this run
+        baseline: the same structure from an earlier run
+        threshold: allowed growth of any gated metric (REGRESSION_METRICS), in percent
+    Returns:
+        list: one dict per metric that grew by more than the threshold
+    """
+    regressions = []
+    for name, rows in results.items():
+        keys = BENCHMARK_KEYS.get(name)
+        if not keys or name not in baseline:
+            continue
+
+        baseline_rows = {
+            tuple(row.get(key) for key in keys): row
+            for row in baseline[name]
+            if 'skipped' not in row
+        }
+
+        for row in rows:
+            case = tuple(row.get(key) for key in keys)
+            previous = baseline_rows.get(case)
+            if previous is None:
+                continue
+
+            for metric in REGRESSION_METRICS.get(name, ()):
+                value = row.get(metric)
+                old = previous.get(metric)
+                if not isinstance(value, (int, float)):
+                    continue
+                if not isinstance(old, (int, float)) or not old:
+                    continue
+
+                change = (value - old) * 100 / old
+                if change > threshold:
+                    regressions.append({
+                        'benchmark': name,
+                        'case': dict(zip(keys, case)),
+                        'metric': metric,
+                        'baseline': old,
+                        'current': value,
+                        'change_percent': round(change, 1),
+                    })
+    return regressions
@@ -0,0 +1,262 @@
+"""
+Background bulk uploads (CSV, XLSX or JSON Lines) backed by the bulk_upload_jobs table
+The upload endpoint stores the CSV and returns a job straight away. A worker
+process (python manage.py run_bulk_upload_worker) claims queued jobs with a
+conditional UPDATE and runs BulkInvoiceProcessor, writing progress counters
+and per-row results after every batch so clients can poll instead of
+holding the request open.
+
+Each batch also moves the job's checkpoint (last_committed_row). A job whose
+worker died is put back in the queue and resumes after that row; rows of the
+interrupted batch that did reach the database are recognised by their
+fingerprint and reported as already created instead of being duplicated.
+"""
+import os
+import time
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import BulkUploadJob, BulkUploadJobResult
+from .row_sources import detect_format
+
+
+def count_csv_rows(csv_file, header=True):
+    """
+    Estimate the data rows in an upload by counting line breaks
+    Quoted fields with embedded newlines make this an over-estimate; the
+    exact count is recorded when the job completes.
+    Args:
+        header: whether the first line holds column names (False for JSON Lines)
+    """
+    lines = 0
+    last = b''
+    for chunk in csv_file.chunks():
+        lines += chunk.count(b'\n')
+        last = chunk[-1:]
+    if last and last != b'\n':
+        lines += 1
+    csv_file.seek(0)
+    return max(0, lines - 1 if header else lines)
+
+
+def estimate_upload_rows(upload):
+    """Row estimate for a queued upload, None for XLSX (known once the job completes)"""
+    file_format = detect_format(upload.name) or 'csv'
+    if file_format == 'xlsx':
+        return None
+    return count_csv_rows(upload, header=file_format == 'csv')
+
+
+def queue_bulk_upload(csv_file, user_id, invoice_type, seller_details, create_as_draft=False,
+                      send_email=False, send_whatsapp=False, gst_rate=18.00, base_url=None):
+    """
+    Store an uploaded CSV and queue it for the bulk upload worker
+    Args:
+        csv_file: uploaded CSV, XLSX or JSON Lines file (read once to estimate the row count)
+        base_url: scheme and host used for links the worker sends out
+    Returns:
+        BulkUploadJob: the queued job
+    """
+    job = BulkUploadJob(
+        user_id=user_id,
+        invoice_type=invoice_type,
+        total_rows=estimate_upload_rows(csv_file),
+        options={
+            'seller_details': seller_details,
+            'create_as_draft': create_as_draft,
+            'send_email': send_email,
+            'send_whatsapp': send_whatsapp,
+            # Kept as a string so the Decimal survives the JSON round trip
+            'gst_rate': str(gst_rate),
+            'base_url': base_url,
+        },
+    )
+    # The stored name keeps the extension the worker detects the format from
+    extension = os.path.splitext(csv_file.name)[1].lower() or '.csv'
+    job.csv_file.save(f'{user_id}{extension}', csv_file, save=False)
+    job.save()
+    return job
+
+
+def claim_next_job():
+    """
+    Claim the oldest queued job for this worker
+    The queued -> running move is a conditional UPDATE, so two workers
+    polling at once never run the same upload.
+    """
+    candidates = (
+        BulkUploadJob.objects.filter(status=BulkUploadJob.STATUS_QUEUED)
+        .order_by('created_at', 'id')
+        .values_list('id', flat=True)[:5]
+    )
+
+    for job_id in candidates:
+        now = timezone.now()
+        updated = BulkUploadJob.objects.filter(pk=job_id, status=BulkUploadJob.STATUS_QUEUED).update(
+            status=BulkUploadJob.STATUS_RUNNING,
+            started_at=now,
+            updated_at=now,
+        )
+        if updated:
+            return BulkUploadJob.objects.get(pk=job_id)
+
+    return None
+
+
+def requeue_stale_jobs(timeout=None):
+    """Put back running jobs whose worker stopped reporting progress, to resume from their checkpoint"""
+    if timeout is None:
+        timeout = settings.INVOICE_SETTINGS.get('BULK_UPLOAD_STALE_AFTER', 900)
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    return BulkUploadJob.objects.filter(
+        status=BulkUploadJob.STATUS_RUNNING,
+        updated_at__lt=cutoff,
+    ).update(status=BulkUploadJob.STATUS_QUEUED)
+
+
+def resume_job(job):
+    """
+    Queue a failed job again; it continues after its last committed row
+    Returns:
+        bool: False if the job was not in the failed state
+    """
+    updated = BulkUploadJob.objects.filter(pk=job.pk, status=BulkUploadJob.STATUS_FAILED).update(
+        status=BulkUploadJob.STATUS_QUEUED,
+        error='',
+        finished_at=None,
+        updated_at=timezone.now(),
+    )
+    job.refresh_from_db()
+    return bool(updated)
+
+
+def run_bulk_upload_job(job):
+    """
+    Process a claimed job, recording progress and results after every batch
+    Returns:
+        BulkUploadJob: the job with its final status
+    """
+    from .bulk_upload_service import BulkInvoiceProcessor
+
+    options = job.options
+    processor = None
+
+    def record_batch(last_row, successes, failures, skipped):
+        results = []
+        for success in successes + skipped:
+            success['download_url'] = processor.absolute_url(
+                f"/api/invoices/{success['invoice_id']}/download_pdf/"
+            )
+            results.append(BulkUploadJobResult(job=job, row=success['row'], success=True, data=success))
+        for failure in failures:
+            results.append(BulkUploadJobResult(job=job, row=failure['row'], success=False, data=failure))
+
+        # Results and the checkpoint commit together, so a resumed job
+        # never records a row twice
+        with transaction.atomic():
+            BulkUploadJobResult.objects.bulk_create(results)
+            BulkUploadJob.objects.filter(pk=job.pk).update(
+                rows_processed=processor.rows_processed,
+                last_committed_row=last_row,
+                successful=F('successful') + len(successes),
+                failed=F('failed') + len(failures),
+                already_created=F('already_created') + len(skipped),
+                emails_queued=F('emails_queued') + sum(1 for s in successes if s['email_queued']),
+                whatsapp_queued=F('whatsapp_queued') + sum(1 for s in successes if s['whatsapp_queued']),
+                updated_at=timezone.now(),
+            )
+
+    try:
+        with job.csv_file.open('rb') as csv_file:
+            processor = BulkInvoiceProcessor(
+                csv_file=csv_file,
+                user_id=job.user_id,
+                invoice_type=job.invoice_type,
+                seller_details=options.get('seller_details') or {},
+                create_as_draft=options.get('create_as_draft', False),
+                send_email=options.get('send_email', False),
+                send_whatsapp=options.get('send_whatsapp', False),
+                gst_rate=Decimal(options.get('gst_rate', '18.00')),
+                base_url=options.get('base_url'),
+                on_batch=record_batch,
+                # Results live in bulk_upload_job_results, not in worker memory
+                keep_results=False,
+                batch_id=job.batch_id or None,
+                start_after_row=job.last_committed_row,
+            )
+            BulkUploadJob.objects.filter(pk=job.pk).update(batch_id=processor.batch_id)
+            # save_failure_report names the report after the batch
+            job.batch_id = processor.batch_id
+            result = processor.process()
+
+        BulkUploadJob.objects.filter(pk=job.pk).update(
+            status=BulkUploadJob.STATUS_COMPLETED,
+            total_rows=result['total_rows'],
+            failure_report=save_failure_report(job),
+            finished_at=timezone.now(),
+            updated_at=timezone.now(),
+        )
+    except Exception as e:
+        print(f"Bulk upload job {job.pk} failed: {e}")
+        BulkUploadJob.objects.filter(pk=job.pk).update(
+            status=BulkUploadJob.STATUS_FAILED,
+            error=str(e),
+            finished_at=timezone.now(),
+            updated_at=timezone.now(),
+        )
+
+    job.refresh_from_db()
+    return job
+
+
+def save_failure_report(job):
+    """
+    Write a job's failing rows to a CSV report
+    Built from the recorded results rather than the processor, so rows that
+    failed before a resume are included. Rows are streamed from the database
+    into a temporary file, never held in memory together.
+    Returns:
+        str: storage name of the report ('' if no row failed)
+    """
+    from .bulk_upload_service import CSV_COLUMNS, FailureReport
+
+    report = None
+    try:
+        for failure in job.results.filter(success=False).values_list('data', flat=True).iterator():
+            if report is None:
+                # An unreadable row has no data to take the columns from
+                report = FailureReport(list(failure['data']) or CSV_COLUMNS)
+            report.add(failure['data'], failure['errors'])
+    except Exception:
+        if report is not None:
+            report.close()
+        raise
+
+    if report is None:
+        return ''
+    return report.save(f'bulk_uploads/failures/{job.batch_id}.csv')
+
+
+def run_bulk_upload_worker(poll_interval=None, once=False):
+    """
+    Run queued bulk uploads until interrupted
+    Args:
+        poll_interval: seconds to sleep when no job is queued
+        once: run every queued job once and return instead of polling
+    """
+    if poll_interval is None:
+        poll_interval = settings.INVOICE_SETTINGS.get('BULK_UPLOAD_POLL_INTERVAL', 2)
+
+    while True:
+        close_old_connections()
+        requeue_stale_jobs()
+        job = claim_next_job()
+        if job is not None:
+            run_bulk_upload_job(job)
+            continue
+        if once:
+            return
+        time.sleep(poll_interval)
@@ -1,9 +1,100 @@
 """
-Serializers for bulk invoice upload via CSV
+Serializers for bulk invoice upload via CSV, XLSX or JSON Lines
 """
 from rest_framework import serializers
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.fields import get_error_detail
+from rest_framework.settings import api_settings
+from rest_framework.validators import ProhibitSurrogateCharactersValidator
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.validators import EmailValidator, ProhibitNullCharactersValidator
+from django.utils import timezone
+from django.template.defaultfilters import filesizeformat
 from decimal import Decimal
 import re
+from .models import BulkUploadJob, NotificationOutbox
+from .row_sources import detect_format
+
+
+GSTIN_PATTERN = re.compile(r'^[0-9]{2}[A-Z]{5}[0-9]{4}[A-Z]{1}[1-9A-Z]{1}Z[0-9A-Z]{1}$')
+
+# Columns holding one value per product: comma-packed strings in CSV/XLSX,
+# and optionally native arrays in JSON Lines
+PRODUCT_COLUMNS = ('product_descriptions', 'hsn_sac_codes', 'quantities', 'total_values')
+
+
+def clean_pincode(value):
+    """Validate pincode format"""
+    if not value or len(value) != 6 or not value.isdigit():
+        raise serializers.ValidationError("Pincode must be 6 digits")
+    return value
+
+
+def clean_gstin(value):
+    """Validate GSTIN format"""
+    if not value:
+        return None
+    if len(value) != 15:
+        raise serializers.ValidationError("GSTIN must be 15 characters")
+
+    if not GSTIN_PATTERN.match(value):
+        raise serializers.ValidationError("Invalid GSTIN format")
+    return value.upper()
+
+
+def split_product_column(value):
+    """Items of a product column: a list is taken as is, a string is split on commas"""
+    items = value if isinstance(value, list) else value.split(',')
+    return [item.strip() for item in items if item.strip()]
+
+
+def parse_product_columns(data):
+    """
+    Cross-field validation: ensure all product arrays have same length
+    Adds the parsed arrays to `data` as _parsed_descriptions, _parsed_hsn_codes,
+    _parsed_quantities and _parsed_values.
+    """
+    # Parse comma-separated fields (or take native arrays as they are)
+    descriptions = split_product_column(data['product_descriptions'])
+    hsn_codes = split_product_column(data['hsn_sac_codes'])
+    quantities = split_product_column(data['quantities'])
+    values = split_product_column(data['total_values'])
+
+    # Validate at least one product
+    if not descriptions:
+        raise serializers.ValidationError("At least one product is required")
+
+    # Validate array lengths match
+    lengths = [len(descriptions), len(hsn_codes), len(quantities), len(values)]
+    if len(set(lengths)) != 1:
+        raise serializers.ValidationError(
+            f"Product fields must have same count. Got: {lengths[0]} descriptions, "
+            f"{lengths[1]} HSN codes, {lengths[2]} quantities, {lengths[3]} values"
+        )
+
+    # Validate and convert numeric fields
+    try:
+        quantities_decimal = [Decimal(q) for q in quantities]
+        if any(q <= 0 for q in quantities_decimal):
+            raise serializers.ValidationError("All quantities must be greater than 0")
+    except (ValueError, Exception) as e:
+        raise serializers.ValidationError(f"Invalid quantity values: {e}")
+
+    try:
+        values_decimal = [Decimal(v) for v in values]
+        if any(v <= 0 for v in values_decimal):
+            raise serializers.ValidationError("All values must be greater than 0")
+    except (ValueError, Exception) as e:
+        raise serializers.ValidationError(f"Invalid total values: {e}")
+
+    # Store parsed arrays for downstream processing
+    data['_parsed_descriptions'] = descriptions
+    data['_parsed_hsn_codes'] = hsn_codes
+    data['_parsed_quantities'] = quantities_decimal
+    data['_parsed_values'] = values_decimal
+
+    return data
 
 
 class BulkInvoiceCSVRowSerializer(serializers.Serializer):
@@ -23,64 +114,133 @@ class BulkInvoiceCSVRowSerializer(serializers.Serializer):
 
     def validate_pincode(self, value):
         """Validate pincode format"""
-        if not value or len(value) != 6 or not value.isdigit():
-            raise serializers.ValidationError("Pincode must be 6 digits")
-        return value
+        return clean_pincode(value)
 
     def validate_gstin(self, value):
         """Validate GSTIN format"""
-        if not value:
-            return None
-        if len(value) != 15:
-            raise serializers.ValidationError("GSTIN must be 15 characters")
-
-        pattern = r'^[0-9]{2}[A-Z]{5}[0-9]{4}[A-Z]{1}[1-9A-Z]{1}Z[0-9A-Z]{1}$'
-        if not re.match(pattern, value):
-            raise serializers.ValidationError("Invalid GSTIN format")
-        return value.upper()
+        return clean_gstin(value)
 
     def validate(self, data):
         """Cross-field validation: ensure all product arrays have same length"""
-        # Parse comma-separated fields
-        descriptions = [d.strip() for d in data['product_descriptions'].split(',') if d.strip()]
-        hsn_codes = [h.strip() for h in data['hsn_sac_codes'].split(',') if h.strip()]
-        quantities = [q.strip() for q in data['quantities'].split(',') if q.strip()]
-        values = [v.strip() for v in data['total_values'].split(',') if v.strip()]
-
-        # Validate at least one product
-        if not descriptions:
-            raise serializers.ValidationError("At least one product is required")
-
-        # Validate array lengths match
-        lengths = [len(descriptions), len(hsn_codes), len(quantities), len(values)]
-        if len(set(lengths)) != 1:
-            raise serializers.ValidationError(
-                f"Product fields must have same count. Got: {lengths[0]} descriptions, "
-                f"{lengths[1]} HSN codes, {lengths[2]} quantities, {lengths[3]} values"
-            )
+        return parse_product_columns(data)
 
-        # Validate and convert numeric fields
-        try:
-            quantities_decimal = [Decimal(q) for q in quantities]
-            if any(q <= 0 for q in quantities_decimal):
-                raise serializers.ValidationError("All quantities must be greater than 0")
-        except (ValueError, Exception) as e:
-            raise serializers.ValidationError(f"Invalid quantity values: {e}")
 
+# Fast path for BulkInvoiceCSVRowSerializer
+# Validating a row through DRF builds a serializer and its fields and runs
+# each value through the generic field machinery. validate_csv_row applies
+# the same rules from a fixed schema with module-level validators, and builds
+# errors shaped exactly like serializer.errors, so bulk uploads report the
+# same messages either way (see BulkRowValidatorTests).
+
+# (field, required, allow_blank, max_length, field validator) in serializer declaration order
+CSV_ROW_SCHEMA = (
+    ('receiver_name', True, False, 255, None),
+    ('receiver_address', True, False, None, None),
+    ('pincode', True, False, 6, clean_pincode),
+    ('phone', False, True, 15, None),
+    ('email', False, True, None, EmailValidator(message=serializers.EmailField.default_error_messages['invalid'])),
+    ('gstin', False, True, 15, clean_gstin),
+    ('product_descriptions', True, False, None, None),
+    ('hsn_sac_codes', True, False, None, None),
+    ('quantities', True, False, None, None),
+    ('total_values', True, False, None, None),
+)
+
+_REQUIRED_ERROR = ErrorDetail(serializers.Field.default_error_messages['required'], code='required')
+_BLANK_ERROR = ErrorDetail(serializers.CharField.default_error_messages['blank'], code='blank')
+_MAX_LENGTH_ERRORS = {
+    max_length: ErrorDetail(
+        serializers.CharField.default_error_messages['max_length'].format(max_length=max_length),
+        code='max_length'
+    )
+    for _, _, _, max_length, _ in CSV_ROW_SCHEMA if max_length
+}
+# Null and surrogate characters are rare; one search decides whether the
+# (slower) DRF validators need to run for a value
+_PROHIBITED_CHARACTERS = re.compile('[\x00\ud800-\udfff]')
+_CHARACTER_VALIDATORS = (ProhibitNullCharactersValidator(), ProhibitSurrogateCharactersValidator())
+
+
+def _field_errors(value, max_length, validator):
+    """Run a field's validators in DRF's order, collecting every error"""
+    errors = []
+    if max_length and len(value) > max_length:
+        errors.append(_MAX_LENGTH_ERRORS[max_length])
+    if _PROHIBITED_CHARACTERS.search(value):
+        for character_validator in _CHARACTER_VALIDATORS:
+            try:
+                character_validator(value)
+            except serializers.ValidationError as exc:
+                errors.extend(exc.detail)
+            except DjangoValidationError as exc:
+                errors.extend(get_error_detail(exc))
+    if isinstance(validator, EmailValidator):
         try:
-            values_decimal = [Decimal(v) for v in values]
-            if any(v <= 0 for v in values_decimal):
-                raise serializers.ValidationError("All values must be greater than 0")
-        except (ValueError, Exception) as e:
-            raise serializers.ValidationError(f"Invalid total values: {e}")
-
-        # Store parsed arrays for downstream processing
-        data['_parsed_descriptions'] = descriptions
-        data['_parsed_hsn_codes'] = hsn_codes
-        data['_parsed_quantities'] = quantities_decimal
-        data['_parsed_values'] = values_decimal
+            validator(value)
+        except DjangoValidationError as exc:
+            errors.extend(get_error_detail(exc))
+    return errors
 
-        return data
+
+def validate_csv_row(row):
+    """
+    Validate one CSV row like BulkInvoiceCSVRowSerializer, without DRF fields
+    Args:
+        row: dict of column name -> string (product columns may also be
+            lists of strings)
+    Returns:
+        tuple: (validated_data, None) on success, (None, errors) otherwise,
+        where errors matches BulkInvoiceCSVRowSerializer(data=row).errors
+    """
+    validated = {}
+    errors = {}
+
+    for name, required, allow_blank, max_length, validator in CSV_ROW_SCHEMA:
+        if name not in row:
+            if required:
+                errors[name] = [_REQUIRED_ERROR]
+            continue
+
+        value = row[name]
+        if name in PRODUCT_COLUMNS and isinstance(value, list) and all(isinstance(item, str) for item in value):
+            # Already split (JSON Lines arrays); parse_product_columns checks the items
+            validated[name] = value
+            continue
+        if not isinstance(value, str):
+            # Nulls and non-string values are never produced by the CSV
+            # reader; leave their edge cases to the serializer
+            serializer = BulkInvoiceCSVRowSerializer(data=row)
+            if serializer.is_valid():
+                return dict(serializer.validated_data), None
+            return None, dict(serializer.errors)
+
+        value = value.strip()
+        if not value:
+            if not allow_blank:
+                errors[name] = [_BLANK_ERROR]
+                continue
+        else:
+            field_errors = _field_errors(value, max_length, validator)
+            if field_errors:
+                errors[name] = field_errors
+                continue
+
+        if validator is not None and not isinstance(validator, EmailValidator):
+            try:
+                value = validator(value)
+            except serializers.ValidationError as exc:
+                errors[name] = exc.detail
+                continue
+
+        validated[name] = value
+
+    if errors:
+        return None, errors
+
+    try:
+        return parse_product_columns(validated), None
+    except serializers.ValidationError as exc:
+        return None, {api_settings.NON_FIELD_ERRORS_KEY: exc.detail}
 
 
 class BulkInvoiceUploadSerializer(serializers.Serializer):
@@ -106,12 +266,24 @@ class BulkInvoiceUploadSerializer(serializers.Serializer):
     seller_phone = serializers.CharField(required=False, allow_blank=True)
     seller_email = serializers.EmailField(required=False, allow_blank=True)
 
+    # Run as a background job (202 + job ID) instead of inside the request
+    background = serializers.BooleanField(default=True)
+
+    # Only validate and price the rows, streaming one NDJSON line per row
+    dry_run = serializers.BooleanField(default=False)
+
+    # Process inside the request, streaming NDJSON row results instead of one JSON body
+    stream = serializers.BooleanField(default=False)
+
     def validate_csv_file(self, value):
-        """Validate CSV file"""
-        if not value.name.endswith('.csv'):
-            raise serializers.ValidationError("File must be a CSV")
-        if value.size > 5 * 1024 * 1024:  # 5MB limit
-            raise serializers.ValidationError("File size cannot exceed 5MB")
+        """Validate the upload: CSV, XLSX or JSON Lines"""
+        if detect_format(value.name) is None:
+            raise serializers.ValidationError("File must be a CSV, XLSX or JSON Lines (.jsonl) file")
+        max_size = settings.INVOICE_SETTINGS.get('BULK_UPLOAD_MAX_SIZE', 5 * 1024 * 1024)
+        if max_size and value.size > max_size:
+            raise serializers.ValidationError(
+                f"File size cannot exceed {filesizeformat(max_size)}"
+            )
         return value
 
     def validate(self, data):
@@ -135,3 +307,66 @@ class BulkInvoiceUploadSerializer(serializers.Serializer):
             )
 
         return data
+
+
+class BulkUploadJobSerializer(serializers.ModelSerializer):
+    """Progress of a background bulk upload"""
+    rows_per_second = serializers.SerializerMethodField()
+    eta_seconds = serializers.SerializerMethodField()
+    zip_download_url = serializers.SerializerMethodField()
+    failure_report_url = serializers.SerializerMethodField()
+    notifications = serializers.SerializerMethodField()
+
+    class Meta:
+        model = BulkUploadJob
+        fields = [
+            'id', 'user_id', 'invoice_type', 'status', 'error', 'batch_id',
+            'total_rows', 'rows_processed', 'successful', 'failed', 'already_created',
+            'last_committed_row', 'emails_queued', 'whatsapp_queued', 'notifications', 'rows_per_second',
+            'eta_seconds', 'zip_download_url', 'failure_report_url', 'created_at', 'started_at', 'finished_at', 'updated_at'
+        ]
+        read_only_fields = fields
+
+    def get_rows_per_second(self, obj):
+        """Throughput since the worker picked the job up"""
+        if not obj.started_at or not obj.rows_processed:
+            return None
+        elapsed = ((obj.finished_at or timezone.now()) - obj.started_at).total_seconds()
+        if elapsed <= 0:
+            return None
+        return round(obj.rows_processed / elapsed, 2)
+
+    def get_eta_seconds(self, obj):
+        """Seconds left at the current throughput (None until it can be estimated)"""
+        if obj.status == BulkUploadJob.STATUS_COMPLETED:
+            return 0
+        if obj.status != BulkUploadJob.STATUS_RUNNING or obj.total_rows is None:
+            return None
+        rate = self.get_rows_per_second(obj)
+        if not rate:
+            return None
+        return round(max(0, obj.total_rows - obj.rows_processed) / rate, 1)
+
+    def get_zip_download_url(self, obj):
+        """ZIP of the batch's PDFs, once the job has finished with PDFs to download"""
+        if (obj.status != BulkUploadJob.STATUS_COMPLETED or not obj.successful
+                or obj.options.get('create_as_draft')):
+            return None
+        path = f"/api/invoices/download-zip/?batch_id={obj.batch_id}"
+        request = self.context.get('request')
+        return request.build_absolute_uri(path) if request else path
+
+    def get_failure_report_url(self, obj):
+        """CSV of the failing rows, once the job has finished"""
+        if not obj.failure_report:
+            return None
+        request = self.context.get('request')
+        return request.build_absolute_uri(obj.failure_report.url) if request else obj.failure_report.url
+
+    def get_notifications(self, obj):
+        """Delivery state of the batch's queued emails/WhatsApp messages: {channel: {state: count}}"""
+        from .delivery_status import delivery_summary
+
+        if not (obj.emails_queued or obj.whatsapp_queued):
+            return {}
+        return delivery_summary(NotificationOutbox.objects.filter(invoice__bulk_batch_id=obj.batch_id))
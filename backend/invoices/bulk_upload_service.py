@@ -1,23 +1,132 @@
 """
-Business logic for processing bulk CSV uploads
+Business logic for processing bulk CSV, XLSX and JSON Lines uploads
 """
 import csv
+import hashlib
 import io
+import json
+import tempfile
+import uuid
 from decimal import Decimal
 from datetime import date
-from django.db import transaction
+from urllib.parse import urljoin
+from django.db import IntegrityError, transaction
+from django.db.models import Count
 from django.conf import settings
-from .models import Invoice, InvoiceItem, InvoiceNumberSequence
-from .services import generate_invoice_pdf
-from .bulk_upload_serializers import BulkInvoiceCSVRowSerializer
+from django.utils import timezone
+from django.core.files import File
+from django.core.files.storage import default_storage
+from .models import (
+    Invoice,
+    InvoiceItem,
+    InvoiceNumberSequence,
+    PDF_STATUS_FAILED,
+    PDF_STATUS_NONE,
+    PDF_STATUS_READY,
+    PDF_STATUS_RENDERING,
+)
+from .notifications import build_notifications, queue_notifications, whatsapp_configured
+from .pdf_workers import render_invoice_pdfs, get_pdf_workers
+from .bulk_upload_serializers import validate_csv_row
+from .row_sources import RowError, clean_row, open_row_source
+
+
+CSV_COLUMNS = (
+    'receiver_name', 'receiver_address', 'pincode', 'phone',
+    'email', 'gstin', 'product_descriptions', 'hsn_sac_codes',
+    'quantities', 'total_values'
+)
+
+# Seller details that appear on an invoice
+SELLER_FIELDS = (
+    'seller_name', 'seller_gstin', 'seller_address', 'seller_pincode',
+    'seller_state', 'seller_phone', 'seller_email'
+)
+
+
+def row_fingerprint(upload_key, row_data, occurrence=0):
+    """
+    Deterministic identity of a CSV row for one uploader and set of upload options
+    Args:
+        upload_key: JSON-serialisable uploader and upload options that shape
+            the invoice (see BulkInvoiceProcessor.upload_key)
+        row_data: cleaned row (lower-case keys, stripped values)
+        occurrence: how many identical rows came earlier in the same file, so
+            genuinely repeated rows still create one invoice each
+    Returns:
+        str: 64-character hex digest
+    """
+    content = json.dumps(
+        [upload_key, [row_data.get(column, '') for column in CSV_COLUMNS]],
+        separators=(',', ':'),
+        ensure_ascii=False
+    )
+    return repeat_fingerprint(hashlib.sha256(content.encode('utf-8')).hexdigest(), occurrence)
+
+
+def repeat_fingerprint(content_key, occurrence):
+    """Fingerprint of a repeated row from the first copy's (no need to serialise the row again)"""
+    if not occurrence:
+        return content_key
+    return hashlib.sha256(f'{content_key}:{occurrence}'.encode('ascii')).hexdigest()
+
+
+class FailureReport:
+    """
+    CSV of failing rows: the upload's columns plus an `errors` column
+    Rows go to a temporary file as they fail, so a large bad file never sits
+    in memory, and the finished report is stored as a media file.
+    """
+
+    def __init__(self, fieldnames):
+        self.fieldnames = [name for name in fieldnames if name != 'errors'] + ['errors']
+        self.file = tempfile.TemporaryFile()
+        self.text = io.TextIOWrapper(self.file, encoding='utf-8', newline='')
+        self.writer = csv.DictWriter(self.text, fieldnames=self.fieldnames, restval='', extrasaction='ignore')
+        self.writer.writeheader()
+        self.count = 0
+
+    def add(self, row_data, errors):
+        """Append one failing row (native product arrays are written comma-packed, as in a CSV upload)"""
+        row = {
+            name: ','.join(value) if isinstance(value, list) else value
+            for name, value in row_data.items()
+        }
+        row['errors'] = errors
+        self.writer.writerow(row)
+        self.count += 1
+
+    def save(self, name):
+        """
+        Store the report and discard the temporary file
+        Returns:
+            str: storage name of the report, None if no row failed
+        """
+        try:
+            if not self.count:
+                return None
+            self.text.flush()
+            self.file.seek(0)
+            return default_storage.save(name, File(self.file))
+        finally:
+            self.close()
+
+    def close(self):
+        """Discard the temporary file"""
+        self.text.close()
 
 
 class BulkInvoiceProcessor:
-    """Handles bulk invoice creation from CSV"""
+    """Handles bulk invoice creation from CSV, XLSX or JSON Lines"""
 
     def __init__(self, csv_file, user_id, invoice_type, seller_details, create_as_draft=False,
-                 send_email=False, send_whatsapp=False, gst_rate=18.00, request=None):
+                 send_email=False, send_whatsapp=False, gst_rate=18.00, request=None,
+                 pdf_workers=None, batch_size=None, bulk_insert=True, base_url=None,
+                 on_batch=None, keep_results=True, batch_id=None, start_after_row=0,
+                 failure_report=False, file_format=None):
         self.csv_file = csv_file
+        # 'csv', 'xlsx' or 'jsonl'; None detects it from the file name
+        self.file_format = file_format
         self.user_id = user_id
         self.invoice_type = invoice_type
         self.seller_details = seller_details
@@ -26,117 +135,687 @@ class BulkInvoiceProcessor:
         self.send_whatsapp = send_whatsapp
         self.gst_rate = gst_rate
         self.request = request
+        # Used for absolute links when there is no request (background jobs)
+        self.base_url = base_url
+        self.pdf_workers = get_pdf_workers(pdf_workers)
+        if batch_size is None:
+            batch_size = settings.INVOICE_SETTINGS.get('BULK_UPLOAD_BATCH_SIZE', 200)
+        self.batch_size = max(1, int(batch_size))
+        # Write each batch with bulk_create instead of one savepoint per row
+        self.bulk_insert = bulk_insert
+        # A resumed job passes its original batch so all its invoices share one ID
+        self.batch_id = batch_id or uuid.uuid4().hex
+        # Rows up to this row number were committed by an earlier run
+        self.start_after_row = start_after_row
+        # Called as on_batch(last_row, successes, failures, skipped) after every batch
+        self.on_batch = on_batch
+        # False drops each batch's results once on_batch has seen them
+        self.keep_results = keep_results
+        # Write failing rows to a CSV report instead of keeping them in the failure entries
+        self.failure_report = failure_report
+        self._report = None
+        self.failure_report_name = None
 
         self.successes = []
         self.failures = []
+        # Rows an earlier upload already turned into invoices
+        self.skipped = []
+        self.total_rows = 0
+        self.rows_processed = 0
+        self.successful = 0
+        self.failed = 0
+        self.already_created = 0
+
+        # (result, invoice) pairs created but not yet rendered/delivered
+        self._pending = []
+
+        self.upload_key = self._upload_key()
 
     def process(self):
-        """Main processing method with partial success support"""
-        # Read and parse CSV
-        csv_content = self.csv_file.read().decode('utf-8-sig')  # Handle BOM
-        csv_reader = csv.DictReader(io.StringIO(csv_content))
-
-        # Validate CSV headers
-        expected_headers = {
-            'receiver_name', 'receiver_address', 'pincode', 'phone',
-            'email', 'gstin', 'product_descriptions', 'hsn_sac_codes',
-            'quantities', 'total_values'
-        }
+        """
+        Main processing method with partial success support
+        The upload is decoded and parsed incrementally, and created invoices
+        are rendered/delivered every batch_size rows, so neither the file
+        contents nor more than one batch of invoices is held in memory.
+        """
+        source = self._open_source()
+        try:
+            self._check_headers(source)
+            self._start_failure_report(source)
+            return self._process_rows(source)
+        finally:
+            self._discard_failure_report()
+            source.close()
+
+    def dry_run(self):
+        """
+        Validate, resolve states and price every row without touching the database
+        Headers are checked straight away (raising ValueError like process());
+        the rows themselves are checked lazily as the result is iterated.
+        Returns:
+            iterator: one dict per row ({'row', 'valid', ...}), then {'summary': {...}}
+        """
+        source = self._open_source()
+        try:
+            self._check_headers(source)
+        except Exception:
+            source.close()
+            raise
+        return self._dry_run_rows(source)
+
+    def _dry_run_rows(self, source):
+        """Yield the dry-run result of each row, then a summary"""
+        valid = 0
+        invalid = 0
+        total_amount = Decimal('0.00')
+        try:
+            for row_number, row_data in self._read_rows(source):
+                try:
+                    validated_row = self._validate_row(row_data)
+                    # The pricing _build_invoice uses, without building model instances
+                    pricing = self._price_row(validated_row)
+                except Exception as e:
+                    invalid += 1
+                    yield {'row': row_number, 'valid': False, 'errors': str(e)}
+                    continue
+
+                valid += 1
+                total_amount += pricing['total']
+                yield {
+                    'row': row_number,
+                    'valid': True,
+                    'buyer_name': validated_row['receiver_name'],
+                    'buyer_state': pricing['buyer_state'],
+                    'is_interstate': pricing['is_interstate'],
+                    'items': len(pricing['lines']),
+                    'subtotal': float(pricing['subtotal']),
+                    'cgst': float(pricing['cgst']),
+                    'sgst': float(pricing['sgst']),
+                    'igst': float(pricing['igst']),
+                    'total': float(pricing['total']),
+                }
 
-        actual_headers = set(h.strip().lower() for h in csv_reader.fieldnames or [])
-        missing_headers = expected_headers - actual_headers
+            yield {'summary': {
+                'dry_run': True,
+                'total_rows': valid + invalid,
+                'valid': valid,
+                'invalid': invalid,
+                'total_amount': float(total_amount),
+            }}
+        finally:
+            source.close()
+
+    def _open_source(self):
+        """Open the upload as a row source (see row_sources)"""
+        return open_row_source(self.csv_file, self.file_format)
+
+    def _check_headers(self, source):
+        """Raise ValueError if the upload lacks any expected column"""
+        if source.fieldnames is None:
+            # JSON Lines has no header; missing keys fail row validation instead
+            return
+        actual_headers = set(h.strip().lower() for h in source.fieldnames if isinstance(h, str))
+        missing_headers = [h for h in CSV_COLUMNS if h not in actual_headers]
 
         if missing_headers:
             raise ValueError(f"Missing CSV columns: {', '.join(missing_headers)}")
 
-        # Process each row
-        row_number = 1
-        for row in csv_reader:
-            row_number += 1
-
+    def _read_rows(self, source):
+        """Yield (row_number, cleaned_row) for every data row"""
+        for row_number, row in source:
+            if isinstance(row, RowError):
+                # Unreadable row: fails on its own (see _process_chunk)
+                yield row_number, row
+                continue
             # Clean row data (strip whitespace from keys and values)
-            cleaned_row = {k.strip().lower(): v.strip() for k, v in row.items()}
+            yield row_number, clean_row(row)
+
+    def stream(self):
+        """
+        Process the upload, yielding each row's result as its batch completes
+        Per-row results are not kept on the processor in this mode, so memory
+        does not grow with the file. Headers are checked straight away
+        (raising ValueError like process()).
+        Returns:
+            iterator: one dict per row, tagged with 'outcome' (success, failure
+            or already_created) and in row order within each batch, then
+            {'summary': {...}} with the counts process() reports
+        """
+        self.keep_results = False
+        source = self._open_source()
+        try:
+            self._check_headers(source)
+        except Exception:
+            source.close()
+            raise
+        self._start_failure_report(source)
+        return self._stream_rows(source)
+
+    def _stream_rows(self, source):
+        """Yield the results of each batch, then a summary"""
+        try:
+            for successes, failures, skipped in self._iter_batches(source):
+                results = (
+                    [dict(result, outcome='success') for result in successes]
+                    + [dict(result, outcome='failure') for result in failures]
+                    + [dict(result, outcome='already_created') for result in skipped]
+                )
+                yield from sorted(results, key=lambda result: result['row'])
+
+            self._save_failure_report()
+            summary = self._summary()
+            for name in ('successes', 'failures', 'skipped'):
+                del summary[name]
+            yield {'summary': summary}
+        finally:
+            self._discard_failure_report()
+            source.close()
+
+    def _process_rows(self, source):
+        """Create invoices row by row in batches"""
+        for _ in self._iter_batches(source):
+            pass
+        self._save_failure_report()
+        return self._summary()
+
+    def _start_failure_report(self, source):
+        """Open the failure report, with the upload's (cleaned) column names"""
+        if self.failure_report:
+            fieldnames = source.fieldnames
+            if fieldnames is None:
+                fieldnames = CSV_COLUMNS
+            self._report = FailureReport([h.strip().lower() for h in fieldnames if isinstance(h, str) and h.strip()])
+
+    def _save_failure_report(self):
+        """Store the failure report, if any row failed"""
+        if self._report is not None:
+            report, self._report = self._report, None
+            self.failure_report_name = report.save(f'bulk_uploads/failures/{self.batch_id}.csv')
+
+    def _discard_failure_report(self):
+        """Drop an unsaved failure report (the upload was aborted)"""
+        if self._report is not None:
+            self._report.close()
+            self._report = None
+
+    def _summary(self):
+        """Counts (and any kept per-row results) of the rows processed so far"""
+        return {
+            'batch_id': self.batch_id,
+            'total_rows': self.total_rows,
+            'successful': self.successful,
+            'failed': self.failed,
+            'already_created': self.already_created,
+            'failure_report': self.failure_report_name,
+            'successes': self.successes,
+            'failures': self.failures,
+            'skipped': self.skipped
+        }
 
+    def _iter_batches(self, source):
+        """
+        Create invoices in batches of batch_size rows
+        Yields:
+            tuple: (successes, failures, skipped) of each batch once it is done
+        """
+        chunk = []
+        for row_number, cleaned_row in self._read_rows(source):
+            self.total_rows += 1
+            if row_number <= self.start_after_row:
+                # Committed by the run this one resumes
+                self.rows_processed += 1
+                continue
+
+            chunk.append((row_number, cleaned_row))
+            if len(chunk) >= self.batch_size:
+                yield self._process_chunk(self._fingerprint_chunk(chunk))
+                chunk = []
+
+        if chunk:
+            yield self._process_chunk(self._fingerprint_chunk(chunk))
+
+    def _fingerprint_chunk(self, chunk):
+        """
+        Fingerprint a batch of (row_number, row_data) pairs
+        A repeated row is numbered by the copies of it that this upload
+        (this batch ID, including the run a resumed job continues) created
+        from earlier rows, looked up for the whole batch, then by the copies
+        earlier in the batch. Only the batch's keys are held in memory.
+        Copies that were skipped as already created are not counted, so on a
+        re-upload a repeat in a later batch matches the first copy's invoice.
+        Returns:
+            list: (row_number, row_data, content key, fingerprint) tuples,
+            with no key or fingerprint for unreadable rows
+        """
+        keys = [
+            None if isinstance(row_data, RowError) else row_fingerprint(self.upload_key, row_data)
+            for _, row_data in chunk
+        ]
+        occurrences = dict(
+            Invoice.objects.filter(
+                bulk_batch_id=self.batch_id,
+                row_content_key__in={key for key in keys if key},
+                bulk_row__lt=chunk[0][0],
+            )
+            .values('row_content_key')
+            .annotate(created=Count('id'))
+            .values_list('row_content_key', 'created')
+        )
+
+        rows = []
+        for (row_number, row_data), content_key in zip(chunk, keys):
+            fingerprint = None
+            if content_key is not None:
+                occurrence = occurrences.get(content_key, 0)
+                occurrences[content_key] = occurrence + 1
+                fingerprint = repeat_fingerprint(content_key, occurrence)
+            rows.append((row_number, row_data, content_key, fingerprint))
+        return rows
+
+    def _process_chunk(self, chunk):
+        """
+        Create invoices for a batch of (row_number, row_data, content key,
+        fingerprint) tuples, then render and deliver them
+        Rows whose fingerprint already belongs to an invoice are skipped after
+        one indexed lookup for the whole batch. With bulk_insert the rest are
+        validated and priced in memory and written with a few bulk INSERTs; if
+        that write fails, the batch is retried row by row so one bad row
+        cannot sink the others.
+        Returns:
+            tuple: (successes, failures, skipped) of this batch
+        """
+        failures = []
+        first_success = len(self.successes)
+        first_failure = len(self.failures)
+        first_skip = len(self.skipped)
+
+        existing = self._existing_invoices([fingerprint for _, _, _, fingerprint in chunk if fingerprint])
+        new_rows = []
+        for row_number, row_data, content_key, fingerprint in chunk:
+            if isinstance(row_data, RowError):
+                failures.append({
+                    'row': row_number,
+                    'data': row_data.data,
+                    'errors': row_data.message
+                })
+            elif fingerprint in existing:
+                self._record_skip(existing[fingerprint], row_number)
+            else:
+                new_rows.append((row_number, row_data, content_key, fingerprint))
+
+        if self.bulk_insert:
+            prepared = []
+            for row_number, row_data, content_key, fingerprint in new_rows:
+                try:
+                    invoice, items = self._build_invoice(self._validate_row(row_data))
+                    self._stamp_row(invoice, row_number, content_key, fingerprint)
+                    prepared.append((row_number, row_data, invoice, items))
+                except Exception as e:
+                    failures.append({
+                        'row': row_number,
+                        'data': row_data,
+                        'errors': str(e)
+                    })
+
+            try:
+                self._bulk_create_invoices(prepared)
+                for row_number, _, invoice, _ in prepared:
+                    self._record_success(invoice, row_number)
+            except Exception as e:
+                print(f"Bulk insert failed for rows {chunk[0][0]}-{chunk[-1][0]}, retrying row by row: {e}")
+                failures.extend(self._process_rows_individually(
+                    [
+                        (row_number, row_data, invoice.row_content_key, invoice.row_fingerprint)
+                        for row_number, row_data, invoice, _ in prepared
+                    ]
+                ))
+        else:
+            failures.extend(self._process_rows_individually(new_rows))
+
+        # Keep failures in row order, as when every row was processed on its own
+        failures.sort(key=lambda failure: failure['row'])
+        if self._report is not None:
+            # The row itself only goes to the report
+            for failure in failures:
+                self._report.add(failure.pop('data'), failure['errors'])
+        self.failures.extend(failures)
+
+        self._finish_pending()
+
+        batch_successes = self.successes[first_success:]
+        batch_failures = self.failures[first_failure:]
+        batch_skipped = self.skipped[first_skip:]
+        self.rows_processed += len(chunk)
+        self.successful += len(batch_successes)
+        self.failed += len(batch_failures)
+        self.already_created += len(batch_skipped)
+
+        if self.on_batch is not None:
+            self.on_batch(chunk[-1][0], batch_successes, batch_failures, batch_skipped)
+
+        if not self.keep_results:
+            del self.successes[first_success:]
+            del self.failures[first_failure:]
+            del self.skipped[first_skip:]
+
+        return batch_successes, batch_failures, batch_skipped
+
+    def _process_rows_individually(self, rows):
+        """Create invoices one row (and savepoint) at a time, returning the failures"""
+        failures = []
+        for row_number, row_data, content_key, fingerprint in rows:
             try:
-                self._process_single_invoice(cleaned_row, row_number)
+                self._process_single_invoice(row_data, row_number, content_key, fingerprint)
+            except IntegrityError as e:
+                # Another upload of the same file may have created this row meanwhile
+                existing = self._existing_invoices([fingerprint])
+                if fingerprint in existing:
+                    self._record_skip(existing[fingerprint], row_number)
+                    continue
+                failures.append({
+                    'row': row_number,
+                    'data': row_data,
+                    'errors': str(e)
+                })
             except Exception as e:
-                self.failures.append({
+                failures.append({
                     'row': row_number,
-                    'data': cleaned_row,
+                    'data': row_data,
                     'errors': str(e)
                 })
+        return failures
+
+    def _validate_row(self, row_data):
+        """Validate a CSV row, returning the validated data"""
+        if isinstance(row_data, RowError):
+            raise ValueError(row_data.message)
+        # Same rules and messages as BulkInvoiceCSVRowSerializer, without a serializer per row
+        validated_row, errors = validate_csv_row(row_data)
+        if errors:
+            raise ValueError(f"Validation errors: {errors}")
+        return validated_row
+
+    def _bulk_create_invoices(self, prepared):
+        """Write a batch of in-memory invoices and their items in one transaction"""
+        if not prepared:
+            return
 
+        with transaction.atomic():
+            # Numbers are taken inside the transaction so a failed batch gives them back
+            numbers = self._reserve_invoice_numbers(len(prepared))
+            invoices = []
+            for (_, _, invoice, _), invoice_number in zip(prepared, numbers):
+                invoice.invoice_number = invoice_number
+                invoices.append(invoice)
+
+            Invoice.objects.bulk_create(invoices)
+
+            if any(invoice.pk is None for invoice in invoices):
+                # Backends that cannot return primary keys from a bulk INSERT
+                ids = dict(
+                    Invoice.objects.filter(invoice_number__in=numbers)
+                    .values_list('invoice_number', 'id')
+                )
+                for invoice in invoices:
+                    invoice.pk = ids[invoice.invoice_number]
+
+            items = []
+            for _, _, invoice, invoice_items in prepared:
+                for item in invoice_items:
+                    item.invoice = invoice
+                    items.append(item)
+            InvoiceItem.objects.bulk_create(items, batch_size=1000)
+
+            # Emails/WhatsApp messages commit (or roll back) with their invoices
+            queue_notifications([
+                notification for invoice in invoices for notification in self._notifications_for(invoice)
+            ])
+
+    def _existing_invoices(self, fingerprints):
+        """
+        Look up invoices already created from these row fingerprints
+        Returns:
+            dict: fingerprint -> (invoice id, invoice number, buyer name, total)
+        """
+        if not fingerprints:
+            return {}
         return {
-            'total_rows': row_number - 1,
-            'successful': len(self.successes),
-            'failed': len(self.failures),
-            'successes': self.successes,
-            'failures': self.failures
+            fingerprint: rest
+            for fingerprint, *rest in Invoice.objects.filter(row_fingerprint__in=fingerprints).values_list(
+                'row_fingerprint', 'id', 'invoice_number', 'buyer_name', 'total'
+            )
         }
 
-    def _process_single_invoice(self, row_data, row_number):
+    def _record_skip(self, existing, row_number):
+        """Report a row that an earlier upload already turned into an invoice"""
+        invoice_id, invoice_number, buyer_name, total = existing
+        self.skipped.append({
+            'row': row_number,
+            'invoice_number': invoice_number,
+            'invoice_id': invoice_id,
+            'buyer_name': buyer_name,
+            'total': float(total),
+            'already_created': True,
+            'message': f'Already created as {invoice_number}'
+        })
+
+    def _process_single_invoice(self, row_data, row_number, content_key=None, fingerprint=None):
         """Process a single invoice with savepoint for isolation"""
-        # Validate row
-        row_serializer = BulkInvoiceCSVRowSerializer(data=row_data)
-        if not row_serializer.is_valid():
-            raise ValueError(f"Validation errors: {row_serializer.errors}")
-
-        validated_row = row_serializer.validated_data
+        validated_row = self._validate_row(row_data)
 
         # Use savepoint for transaction isolation
         with transaction.atomic():
             sid = transaction.savepoint()
 
             try:
-                invoice = self._create_invoice(validated_row)
-
-                # Generate PDF if not draft
-                pdf_url = None
-                if not self.create_as_draft:
-                    try:
-                        generate_invoice_pdf(invoice)
-                        pdf_url = invoice.pdf_file.url if invoice.pdf_file else None
-                    except Exception as pdf_error:
-                        # Log but don't fail invoice creation
-                        print(f"PDF generation failed for row {row_number}: {pdf_error}")
-
+                invoice = self._create_invoice(validated_row, row_number, content_key, fingerprint)
                 transaction.savepoint_commit(sid)
+            except Exception as e:
+                transaction.savepoint_rollback(sid)
+                raise
 
-                # Prepare success result
-                result = {
-                    'row': row_number,
-                    'invoice_number': invoice.invoice_number,
-                    'invoice_id': invoice.id,
-                    'buyer_name': invoice.buyer_name,
-                    'total': float(invoice.total),
-                    'pdf_url': pdf_url,
-                    'is_draft': invoice.is_draft,
-                    'email_sent': False,
-                    'whatsapp_sent': False,
-                    'email_error': None,
-                    'whatsapp_error': None
-                }
+        self._record_success(invoice, row_number)
+
+    def _record_success(self, invoice, row_number):
+        """Add a created invoice to the results and queue it for PDF/delivery"""
+        # Prepare success result (PDF and delivery fields are filled in by
+        # _finish_pending once the render stage has run)
+        result = {
+            'row': row_number,
+            'invoice_number': invoice.invoice_number,
+            'invoice_id': invoice.id,
+            'buyer_name': invoice.buyer_name,
+            'total': float(invoice.total),
+            'pdf_url': None,
+            'is_draft': invoice.is_draft,
+            # Delivery is left to the notification worker (see notifications.py)
+            'email_queued': self._wants_email(invoice),
+            'whatsapp_queued': self._wants_whatsapp(invoice) and whatsapp_configured(),
+            'whatsapp_error': (
+                'Twilio not configured' if self._wants_whatsapp(invoice) and not whatsapp_configured() else None
+            )
+        }
 
-                # Send email if enabled and email exists
-                if self.send_email and invoice.buyer_email:
-                    email_result = self._send_email(invoice)
-                    result['email_sent'] = email_result['success']
-                    result['email_error'] = email_result.get('error')
+        self.successes.append(result)
+        self._pending.append((result, invoice))
+
+    def _finish_pending(self):
+        """Render PDFs for pending invoices"""
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        # Generate PDFs if not draft
+        if not self.create_as_draft:
+            invoices = [invoice for _, invoice in pending]
+            errors = render_invoice_pdfs(invoices, self.pdf_workers)
+
+            # Renders that found a current PDF left the status alone
+            Invoice.objects.filter(
+                pk__in=[invoice.pk for invoice, error in zip(invoices, errors) if error is None],
+                pdf_status=PDF_STATUS_RENDERING,
+            ).update(pdf_status=PDF_STATUS_READY, pdf_finished_at=timezone.now())
+
+            for (result, invoice), pdf_error in zip(pending, errors):
+                if pdf_error is not None:
+                    # Log but don't fail invoice creation; queued notifications
+                    # for it are dead-lettered instead of waiting for the PDF
+                    print(f"PDF generation failed for row {result['row']}: {pdf_error}")
+                    Invoice.objects.filter(pk=invoice.pk, pdf_status=PDF_STATUS_RENDERING).update(
+                        pdf_status=PDF_STATUS_FAILED,
+                        pdf_finished_at=timezone.now(),
+                        pdf_error=str(pdf_error),
+                    )
+                result['pdf_url'] = invoice.pdf_file.url if invoice.pdf_file else None
+
+    def _wants_email(self, invoice):
+        """Whether this upload emails the invoice"""
+        return bool(self.send_email and not self.create_as_draft and invoice.buyer_email)
+
+    def _wants_whatsapp(self, invoice):
+        """Whether this upload sends the invoice over WhatsApp (if Twilio is configured)"""
+        return bool(self.send_whatsapp and not self.create_as_draft and invoice.buyer_phone)
+
+    def _notifications_for(self, invoice):
+        """Outbox rows for a new invoice (drafts have no PDF to send)"""
+        return build_notifications(
+            invoice,
+            email=invoice.buyer_email if self._wants_email(invoice) else None,
+            phone=invoice.buyer_phone if self._wants_whatsapp(invoice) else None,
+            base_url=self.absolute_url('/'),
+        )
 
-                # Send WhatsApp if enabled and phone exists
-                if self.send_whatsapp and invoice.buyer_phone:
-                    whatsapp_result = self._send_whatsapp(invoice)
-                    result['whatsapp_sent'] = whatsapp_result['success']
-                    result['whatsapp_error'] = whatsapp_result.get('error')
+    def _create_invoice(self, validated_row, row_number=None, content_key=None, fingerprint=None):
+        """Create invoice from validated CSV row"""
+        invoice, items = self._build_invoice(validated_row)
+        self._stamp_row(invoice, row_number, content_key, fingerprint)
+        invoice.invoice_number = self._generate_invoice_number()
+        invoice.save(force_insert=True)
 
-                self.successes.append(result)
+        # Create items
+        for item in items:
+            item.invoice = invoice
+            item.save()
 
-            except Exception as e:
-                transaction.savepoint_rollback(sid)
-                raise
+        queue_notifications(self._notifications_for(invoice))
 
-    def _create_invoice(self, validated_row):
-        """Create invoice from validated CSV row"""
+        return invoice
+
+    def _stamp_row(self, invoice, row_number, content_key, fingerprint):
+        """Record which upload row an invoice came from (see _fingerprint_chunk)"""
+        invoice.bulk_row = row_number
+        invoice.row_content_key = content_key
+        invoice.row_fingerprint = fingerprint
+
+    def _build_invoice(self, validated_row):
+        """
+        Price a validated CSV row in memory
+        Returns:
+            tuple: (unsaved Invoice without a number, list of unsaved InvoiceItems)
+        """
+        pricing = self._price_row(validated_row)
+        seller = self._seller_details()
+
+        items = [
+            InvoiceItem(
+                serial_number=i + 1,
+                description=desc,
+                hsn_sac=hsn,
+                quantity=qty,
+                unit_price=base_unit_price,
+                # Same rounding as InvoiceItem.save(), which bulk_create skips
+                amount=amount
+            )
+            for i, (desc, hsn, qty, base_unit_price, amount) in enumerate(pricing['lines'])
+        ]
+
+        invoice = Invoice(
+            invoice_type=self.invoice_type,
+            user_id=self.user_id,
+            invoice_date=date.today(),
+            seller_name=seller['seller_name'],
+            seller_gstin=seller['seller_gstin'],
+            seller_address=seller['seller_address'],
+            seller_pincode=seller['seller_pincode'],
+            seller_state=seller['seller_state'],
+            seller_phone=seller['seller_phone'],
+            seller_email=seller['seller_email'],
+            buyer_name=validated_row['receiver_name'],
+            buyer_gstin=validated_row.get('gstin'),
+            buyer_address=validated_row['receiver_address'],
+            buyer_pincode=validated_row['pincode'],
+            buyer_state=pricing['buyer_state'],
+            buyer_phone=validated_row.get('phone', ''),
+            buyer_email=validated_row.get('email', ''),
+            subtotal=pricing['subtotal'],
+            cgst=pricing['cgst'],
+            sgst=pricing['sgst'],
+            igst=pricing['igst'],
+            total=pricing['total'],
+            gst_rate=pricing['gst_rate'],
+            is_interstate=pricing['is_interstate'],
+            is_draft=self.create_as_draft,
+            bulk_batch_id=self.batch_id,
+            # Rendered inline by _finish_pending (drafts are not rendered);
+            # 'rendering' keeps the background worker off it, and a crashed
+            # upload's invoices are requeued once the render goes stale
+            pdf_status=PDF_STATUS_NONE if self.create_as_draft else PDF_STATUS_RENDERING,
+            pdf_started_at=None if self.create_as_draft else timezone.now(),
+        )
+
+        return invoice, items
+
+    def _upload_key(self):
+        """
+        The uploader and every upload option that changes the invoices
+        Part of each row fingerprint, so uploading a file again as real
+        invoices after drafts, or with another invoice type, GST rate or
+        seller, creates new invoices instead of matching the earlier ones.
+        Delivery options are left out: they do not change the invoice.
+        """
+        if self.invoice_type == 'topmate':
+            seller = self._seller_details()
+        else:
+            # Missing seller fields fail every row later, not the whole upload here
+            seller = self.seller_details or {}
+        return [
+            self.user_id,
+            self.invoice_type,
+            str(Decimal(str(self.gst_rate)).quantize(Decimal('0.01'))),
+            [str(seller.get(name, '')) for name in SELLER_FIELDS],
+            bool(self.create_as_draft),
+        ]
+
+    def _seller_details(self):
+        """Seller fields for this upload's invoices"""
+        if self.invoice_type == 'topmate':
+            topmate_settings = settings.INVOICE_SETTINGS
+            return {
+                'seller_name': topmate_settings['TOPMATE_COMPANY_NAME'],
+                'seller_gstin': topmate_settings['TOPMATE_GSTIN'],
+                'seller_address': topmate_settings['TOPMATE_ADDRESS'],
+                'seller_pincode': topmate_settings['TOPMATE_PINCODE'],
+                'seller_state': topmate_settings['TOPMATE_STATE_CODE'],
+                'seller_phone': topmate_settings.get('TOPMATE_PHONE', ''),
+                'seller_email': topmate_settings.get('TOPMATE_EMAIL', ''),
+            }
+        return {
+            'seller_name': self.seller_details['seller_name'],
+            'seller_gstin': self.seller_details['seller_gstin'],
+            'seller_address': self.seller_details['seller_address'],
+            'seller_pincode': self.seller_details['seller_pincode'],
+            'seller_state': self.seller_details['seller_state'],
+            'seller_phone': self.seller_details.get('seller_phone', ''),
+            'seller_email': self.seller_details.get('seller_email', ''),
+        }
+
+    def _price_row(self, validated_row):
+        """
+        Resolve the buyer's state and calculate line items and taxes for a row
+        Returns:
+            dict: buyer_state, is_interstate, gst_rate, subtotal, cgst, sgst,
+            igst, total and lines as (description, hsn, quantity, unit price, amount)
+        """
         # Extract parsed product arrays
         descriptions = validated_row['_parsed_descriptions']
         hsn_codes = validated_row['_parsed_hsn_codes']
@@ -144,30 +823,12 @@ class BulkInvoiceProcessor:
         total_values = validated_row['_parsed_values']
 
         # Determine buyer state code from pincode
-        buyer_pincode = validated_row['pincode']
-        buyer_state = self._infer_state_from_pincode(buyer_pincode)
+        buyer_state = self._infer_state_from_pincode(validated_row['pincode'])
 
-        # Prepare seller details
         if self.invoice_type == 'topmate':
-            topmate_settings = settings.INVOICE_SETTINGS
-            seller_name = topmate_settings['TOPMATE_COMPANY_NAME']
-            seller_gstin = topmate_settings['TOPMATE_GSTIN']
-            seller_address = topmate_settings['TOPMATE_ADDRESS']
-            seller_pincode = topmate_settings['TOPMATE_PINCODE']
-            seller_state = topmate_settings['TOPMATE_STATE_CODE']
-            seller_phone = topmate_settings.get('TOPMATE_PHONE', '')
-            seller_email = topmate_settings.get('TOPMATE_EMAIL', '')
+            seller_state = settings.INVOICE_SETTINGS['TOPMATE_STATE_CODE']
         else:
-            seller_name = self.seller_details['seller_name']
-            seller_gstin = self.seller_details['seller_gstin']
-            seller_address = self.seller_details['seller_address']
-            seller_pincode = self.seller_details['seller_pincode']
             seller_state = self.seller_details['seller_state']
-            seller_phone = self.seller_details.get('seller_phone', '')
-            seller_email = self.seller_details.get('seller_email', '')
-
-        # Generate invoice number
-        invoice_number = self._generate_invoice_number()
 
         # Calculate financials with GST extraction
         gst_rate_percent = Decimal(str(self.gst_rate))
@@ -176,11 +837,9 @@ class BulkInvoiceProcessor:
 
         # Extract base prices from GST-inclusive values
         subtotal = Decimal('0.00')
-        items_data = []
+        lines = []
 
-        for i, (desc, hsn, qty, value_with_gst) in enumerate(zip(
-            descriptions, hsn_codes, quantities, total_values
-        )):
+        for desc, hsn, qty, value_with_gst in zip(descriptions, hsn_codes, quantities, total_values):
             # value_with_gst is the total value for this item (GST-inclusive)
             # Need to extract unit price
             unit_price_with_gst = value_with_gst / qty
@@ -189,14 +848,7 @@ class BulkInvoiceProcessor:
             item_subtotal = qty * base_unit_price
             subtotal += item_subtotal
 
-            items_data.append({
-                'serial_number': i + 1,
-                'description': desc,
-                'hsn_sac': hsn,
-                'quantity': qty,
-                'unit_price': base_unit_price,
-                'amount': item_subtotal
-            })
+            lines.append((desc, hsn, qty, base_unit_price, item_subtotal.quantize(Decimal('0.01'))))
 
         # Calculate taxes based on state
         if seller_state == buyer_state:
@@ -213,63 +865,33 @@ class BulkInvoiceProcessor:
 
         total = (subtotal + cgst + sgst + igst).quantize(Decimal('0.01'))
 
-        # Create invoice
-        invoice = Invoice.objects.create(
-            invoice_number=invoice_number,
-            invoice_type=self.invoice_type,
-            user_id=self.user_id,
-            invoice_date=date.today(),
-            seller_name=seller_name,
-            seller_gstin=seller_gstin,
-            seller_address=seller_address,
-            seller_pincode=seller_pincode,
-            seller_state=seller_state,
-            seller_phone=seller_phone,
-            seller_email=seller_email,
-            buyer_name=validated_row['receiver_name'],
-            buyer_gstin=validated_row.get('gstin'),
-            buyer_address=validated_row['receiver_address'],
-            buyer_pincode=buyer_pincode,
-            buyer_state=buyer_state,
-            buyer_phone=validated_row.get('phone', ''),
-            buyer_email=validated_row.get('email', ''),
-            subtotal=subtotal,
-            cgst=cgst,
-            sgst=sgst,
-            igst=igst,
-            total=total,
-            gst_rate=gst_rate_percent,
-            is_interstate=is_interstate,
-            is_draft=self.create_as_draft
-        )
-
-        # Create items
-        for item_data in items_data:
-            InvoiceItem.objects.create(invoice=invoice, **item_data)
-
-        return invoice
+        return {
+            'buyer_state': buyer_state,
+            'is_interstate': is_interstate,
+            'gst_rate': gst_rate_percent,
+            'subtotal': subtotal,
+            'cgst': cgst,
+            'sgst': sgst,
+            'igst': igst,
+            'total': total,
+            'lines': lines,
+        }
 
     def _generate_invoice_number(self):
         """Generate unique invoice number atomically"""
-        if self.invoice_type == 'topmate':
-            sequence, _ = InvoiceNumberSequence.objects.get_or_create(
-                sequence_type='topmate',
-                user_id=None,
-                defaults={'current_number': 0}
-            )
-            prefix = settings.INVOICE_SETTINGS['TOPMATE_INVOICE_PREFIX']
-            number = sequence.get_next_number()
-            return f"{prefix}-{number:06d}"
-        else:
-            sequence, _ = InvoiceNumberSequence.objects.get_or_create(
-                sequence_type='user',
-                user_id=self.user_id,
-                defaults={'current_number': 0}
-            )
-            import hashlib
-            user_hash = hashlib.md5(self.user_id.encode()).hexdigest()[:6].upper()
-            number = sequence.get_next_number()
-            return f"INV-{user_hash}-{number:04d}"
+        return self._reserve_invoice_numbers(1)[0]
+
+    def _reserve_invoice_numbers(self, count):
+        """Take the next `count` invoice numbers from this upload's sequence in one UPDATE"""
+        return InvoiceNumberSequence.reserve_invoice_numbers(self.invoice_type, self.user_id, count)
+
+    def absolute_url(self, path):
+        """Make a path absolute using the request, else base_url (unchanged if neither)"""
+        if self.request:
+            return self.request.build_absolute_uri(path)
+        if self.base_url:
+            return urljoin(self.base_url, path)
+        return path
 
     def _infer_state_from_pincode(self, pincode):
         """Infer state code from pincode (first 2 digits map to state)"""
@@ -289,129 +911,3 @@ class BulkInvoiceProcessor:
 
         first_digit = pincode[0] if pincode else '0'
         return pincode_state_map.get(first_digit, 'KA')  # Default to Karnataka
-
-    def _send_email(self, invoice):
-        """Send invoice PDF via email"""
-        try:
-            from django.core.mail import EmailMessage
-
-            # Ensure PDF exists
-            if not invoice.pdf_file:
-                return {'success': False, 'error': 'PDF not generated'}
-
-            subject = f'Invoice {invoice.invoice_number} - Rs.{invoice.total}'
-            body = f"""Dear {invoice.buyer_name},
-
-Please find attached your invoice {invoice.invoice_number}.
-
-Invoice Details:
-- Invoice Number: {invoice.invoice_number}
-- Date: {invoice.invoice_date.strftime('%d/%m/%Y')}
-- Total Amount: Rs.{invoice.total}
-
-Thank you for your business!
-
-Best regards,
-{invoice.seller_name}"""
-
-            email_message = EmailMessage(
-                subject=subject,
-                body=body,
-                from_email=settings.DEFAULT_FROM_EMAIL if hasattr(settings, 'DEFAULT_FROM_EMAIL') else 'noreply@invoice.com',
-                to=[invoice.buyer_email],
-            )
-
-            # Attach PDF
-            invoice.pdf_file.open('rb')
-            email_message.attach(
-                f'{invoice.invoice_number}.pdf',
-                invoice.pdf_file.read(),
-                'application/pdf'
-            )
-            invoice.pdf_file.close()
-
-            email_message.send(fail_silently=False)
-
-            return {'success': True}
-
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
-
-    def _send_whatsapp(self, invoice):
-        """Send invoice PDF via WhatsApp"""
-        try:
-            # Ensure PDF exists
-            if not invoice.pdf_file:
-                return {'success': False, 'error': 'PDF not generated'}
-
-            # Check if Twilio is configured
-            if not hasattr(settings, 'TWILIO_ACCOUNT_SID') or not settings.TWILIO_ACCOUNT_SID:
-                # Fallback: return WhatsApp link (not actually sending)
-                if self.request:
-                    pdf_url = self.request.build_absolute_uri(invoice.pdf_file.url)
-                    message = f"""Hello {invoice.buyer_name},
-
-Here is your invoice:
-
-*Invoice #{invoice.invoice_number}*
-Date: {invoice.invoice_date.strftime('%d/%m/%Y')}
-Amount: ₹{invoice.total}
-
-Download PDF: {pdf_url}
-
-Thank you for your business!
-- {invoice.seller_name}"""
-
-                    import urllib.parse
-                    encoded_message = urllib.parse.quote(message)
-                    whatsapp_link = f"https://wa.me/{invoice.buyer_phone}?text={encoded_message}"
-
-                    return {
-                        'success': False,
-                        'error': 'Twilio not configured. WhatsApp link generated instead.',
-                        'whatsapp_link': whatsapp_link
-                    }
-                else:
-                    return {'success': False, 'error': 'Twilio not configured and no request context'}
-
-            # Send via Twilio WhatsApp API
-            from twilio.rest import Client
-
-            client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
-
-            # Get the full public URL to the PDF file
-            if self.request:
-                pdf_url = self.request.build_absolute_uri(invoice.pdf_file.url)
-            else:
-                pdf_url = invoice.pdf_file.url
-
-            # Format phone number for WhatsApp
-            phone = invoice.buyer_phone.strip()
-            if not phone.startswith('+'):
-                phone = '+' + phone
-            to_whatsapp = f"whatsapp:{phone}"
-
-            # Create message body
-            message_body = f"""Hello {invoice.buyer_name},
-
-Your invoice is ready!
-
-Invoice #: {invoice.invoice_number}
-Date: {invoice.invoice_date.strftime('%d/%m/%Y')}
-Amount: ₹{invoice.total}
-
-Thank you for your business!
-- {invoice.seller_name}"""
-
-            # Send WhatsApp message with PDF attachment
-            message = client.messages.create(
-                from_=settings.TWILIO_WHATSAPP_FROM,
-                body=message_body,
-                to=to_whatsapp,
-                media_url=[pdf_url]
-            )
-
-            return {'success': True, 'message_sid': message.sid}
-
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
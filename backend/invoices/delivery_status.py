@@ -0,0 +1,351 @@
+"""
+Twilio status callbacks for WhatsApp invoices
+Twilio posts a callback to /api/notifications/twilio-status/ every time a
+message moves on (queued, sent, delivered, read, failed...). A bulk upload
+of a few thousand invoices produces several thousand callbacks within
+minutes, so the endpoint does not write notification_outbox for each one:
+callbacks are buffered in memory and written in batches with bulk_update,
+when STATUS_CALLBACK_BATCH_SIZE callbacks are waiting or
+STATUS_CALLBACK_FLUSH_INTERVAL seconds after the first one arrived. A
+callback is only acknowledged once its batch is committed; if the write
+fails or takes longer than STATUS_CALLBACK_ACK_TIMEOUT the endpoint answers
+503 and Twilio sends the callback again.
+
+Callbacks for a SID the outbox does not have yet (the callback raced the
+worker recording the send) are staged in delivery_status_callbacks, in the
+same transaction as their batch, and retried until they match or expire;
+staged callbacks a stopped web process left behind are applied by the
+notification worker.
+
+Callbacks can arrive out of order, so a state never overwrites a later one
+(a late 'sent' does not undo 'delivered').
+"""
+import base64
+import hashlib
+import hmac
+import logging
+import threading
+from collections import namedtuple
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count
+from django.utils import timezone
+from .models import DeliveryStatusCallback, NotificationOutbox
+
+logger = logging.getLogger(__name__)
+
+
+# How far along each provider state is; an update only moves a message forward
+PROVIDER_STATUS_RANK = {
+    'accepted': 0,
+    'queued': 1,
+    'sending': 2,
+    'sent': 3,
+    'failed': 4,
+    'undelivered': 4,
+    'delivered': 4,
+    'read': 5,
+}
+
+# One callback: message SID, provider state, Twilio error code and arrival time
+StatusUpdate = namedtuple('StatusUpdate', ['sid', 'status', 'error_code', 'received_at'])
+
+
+def valid_twilio_signature(url, params, signature, auth_token=None):
+    """
+    Check the X-Twilio-Signature header of a callback
+    Twilio signs the full callback URL followed by every POST parameter
+    (name then value, sorted by name) with HMAC-SHA1 under the auth token.
+    """
+    auth_token = auth_token or settings.TWILIO_AUTH_TOKEN
+    payload = url + ''.join(f'{key}{value}' for key, value in sorted(params.items()))
+    digest = hmac.new(auth_token.encode('utf-8'), payload.encode('utf-8'), hashlib.sha1).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode('ascii'), signature or '')
+
+
+def status_callback_url(base_url):
+    """
+    URL Twilio should post status callbacks to
+    TWILIO_STATUS_CALLBACK_URL when set, otherwise the endpoint on the host
+    the message was queued from ('' when that is unknown).
+    """
+    from django.urls import reverse
+    from urllib.parse import urljoin
+
+    configured = getattr(settings, 'TWILIO_STATUS_CALLBACK_URL', '')
+    if configured:
+        return configured
+    if not base_url:
+        return ''
+    return urljoin(base_url, reverse('invoices:notification-twilio-status'))
+
+
+class _PendingBatch:
+    """Callbacks written together; each is acknowledged once the write commits"""
+
+    def __init__(self):
+        self.updates = []
+        self.written = False
+        self._done = threading.Event()
+
+    def finish(self, written):
+        self.written = written
+        self._done.set()
+
+    def wait(self, timeout):
+        """True once the batch is written, False if that failed or took longer than timeout"""
+        return self._done.wait(timeout) and self.written
+
+
+class DeliveryStatusBuffer:
+    """
+    Collects status callbacks in memory and writes them in batches
+    A batch is written once batch_size callbacks have arrived in this
+    process, or flush_interval seconds after the first one; the requests
+    that brought them wait for the write before they are acknowledged.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None):
+        """
+        Args:
+            batch_size: buffered callbacks that trigger a write
+                (default INVOICE_SETTINGS['STATUS_CALLBACK_BATCH_SIZE'])
+            flush_interval: seconds a buffered callback waits at most
+                (default INVOICE_SETTINGS['STATUS_CALLBACK_FLUSH_INTERVAL'])
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._batch = _PendingBatch()
+        # Callbacks this process staged because their SID was not recorded yet
+        self._waiting = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+
+    def _setting(self, value, key, default):
+        return value if value is not None else settings.INVOICE_SETTINGS.get(key, default)
+
+    def add(self, update):
+        """
+        Buffer one update, writing the batch if it is full
+        Returns:
+            _PendingBatch: wait() on it before acknowledging the callback
+        """
+        batch_size = self._setting(self.batch_size, 'STATUS_CALLBACK_BATCH_SIZE', 500)
+        with self._lock:
+            batch = self._batch
+            batch.updates.append(update)
+            full = len(batch.updates) >= batch_size
+            if not full and self._timer is None:
+                self._start_timer()
+        if full:
+            try:
+                self.flush()
+            except Exception:
+                # The batch is marked failed, so none of its callbacks is acknowledged
+                logger.exception("Failed to write delivery status updates")
+        return batch
+
+    def _start_timer(self):
+        interval = self._setting(self.flush_interval, 'STATUS_CALLBACK_FLUSH_INTERVAL', 0.5)
+        self._timer = threading.Timer(interval, self._flush_from_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Failed to write delivery status updates")
+        finally:
+            # The timer thread has its own database connection
+            connection.close()
+
+    def flush(self):
+        """
+        Write the buffered updates and retry the staged ones
+        The buffered updates go to the outbox in one bulk_update; those whose
+        SID is not in the outbox yet are staged with one bulk_create, in the
+        same transaction.
+        Returns:
+            int: notifications updated
+        """
+        batch_size = self._setting(self.batch_size, 'STATUS_CALLBACK_BATCH_SIZE', 500)
+        with self._flush_lock:
+            with self._lock:
+                batch, self._batch = self._batch, _PendingBatch()
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+
+            updated = 0
+            try:
+                if self._waiting:
+                    updated, self._waiting = apply_staged_updates(batch_size)
+                if batch.updates:
+                    updates = {}
+                    for update in batch.updates:
+                        _merge(updates, update)
+                    with transaction.atomic():
+                        changed, unmatched = write_status_updates(updates)
+                        stage_status_updates(unmatched)
+                    updated += changed
+                    self._waiting += len(unmatched)
+            except Exception:
+                batch.finish(False)
+                raise
+            batch.finish(True)
+
+            if self._waiting:
+                # Callbacks that raced the worker recording their SID
+                with self._lock:
+                    if self._timer is None:
+                        self._start_timer()
+            return updated
+
+
+def stage_status_updates(updates):
+    """Store callbacks that cannot be applied yet, with one bulk_create"""
+    DeliveryStatusCallback.objects.bulk_create([
+        DeliveryStatusCallback(
+            provider_message_id=update.sid,
+            provider_status=update.status,
+            provider_error_code=update.error_code or '',
+            received_at=update.received_at,
+        )
+        for update in updates
+    ], batch_size=settings.INVOICE_SETTINGS.get('STATUS_CALLBACK_BATCH_SIZE', 500))
+
+
+def apply_staged_updates(batch_size=None):
+    """
+    Apply staged callbacks to their notifications, batch_size at a time
+    Applied callbacks are deleted. Callbacks for a SID that is not in the
+    outbox yet (the callback raced the worker recording the send) are kept
+    for STATUS_CALLBACK_UNMATCHED_TTL seconds and tried again on later calls.
+    Returns:
+        tuple: (notifications updated, callbacks still waiting)
+    """
+    if batch_size is None:
+        batch_size = settings.INVOICE_SETTINGS.get('STATUS_CALLBACK_BATCH_SIZE', 500)
+    ttl = settings.INVOICE_SETTINGS.get('STATUS_CALLBACK_UNMATCHED_TTL', 300)
+    cutoff = timezone.now() - timedelta(seconds=ttl)
+    updated = waiting = dropped = 0
+    last_id = 0
+
+    while True:
+        rows = list(DeliveryStatusCallback.objects.filter(id__gt=last_id).order_by('id')[:batch_size])
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        updates = {}
+        for row in rows:
+            _merge(updates, StatusUpdate(
+                row.provider_message_id, row.provider_status, row.provider_error_code, row.received_at
+            ))
+
+        # The outbox update and the removal of what it applied commit together
+        with transaction.atomic():
+            changed, unmatched = write_status_updates(updates)
+            unmatched = {update.sid for update in unmatched}
+            kept = [row.id for row in rows if row.provider_message_id in unmatched and row.received_at >= cutoff]
+            dropped += sum(1 for row in rows if row.provider_message_id in unmatched) - len(kept)
+            DeliveryStatusCallback.objects.filter(id__in=[row.id for row in rows]).exclude(id__in=kept).delete()
+
+        updated += changed
+        waiting += len(kept)
+
+    if dropped:
+        logger.warning("Dropped %d status update(s) for unknown message SIDs", dropped)
+    return updated, waiting
+
+
+def _merge(pending, update):
+    """Keep the furthest state per SID (a later callback wins a tie)"""
+    current = pending.get(update.sid)
+    if current is None or PROVIDER_STATUS_RANK[update.status] >= PROVIDER_STATUS_RANK[current.status]:
+        pending[update.sid] = update
+
+
+def write_status_updates(updates):
+    """
+    Apply status updates to their notifications with bulk_update
+    Args:
+        updates: {sid: StatusUpdate}
+    Returns:
+        tuple: (notifications updated, updates whose SID was not found)
+    """
+    batch_size = settings.INVOICE_SETTINGS.get('STATUS_CALLBACK_BATCH_SIZE', 500)
+    sids = list(updates)
+    changed = []
+    found = set()
+
+    # Chunked so the IN list stays under the database's parameter limit
+    for start in range(0, len(sids), batch_size):
+        rows = NotificationOutbox.objects.filter(
+            provider_message_id__in=sids[start:start + batch_size]
+        ).only('id', 'provider_message_id', 'provider_status')
+        for notification in rows:
+            update = updates[notification.provider_message_id]
+            found.add(update.sid)
+            current_rank = PROVIDER_STATUS_RANK.get(notification.provider_status, -1)
+            if PROVIDER_STATUS_RANK[update.status] < current_rank:
+                continue
+            notification.provider_status = update.status
+            notification.provider_error_code = update.error_code or ''
+            notification.provider_status_at = update.received_at
+            notification.updated_at = update.received_at
+            changed.append(notification)
+
+    NotificationOutbox.objects.bulk_update(
+        changed,
+        ['provider_status', 'provider_error_code', 'provider_status_at', 'updated_at'],
+        batch_size=batch_size,
+    )
+    unmatched = [update for sid, update in updates.items() if sid not in found]
+    return len(changed), unmatched
+
+
+_buffer_lock = threading.Lock()
+_buffer = None
+
+
+def get_status_buffer():
+    """Return the process-wide status callback buffer"""
+    global _buffer
+
+    with _buffer_lock:
+        if _buffer is None:
+            # Nothing is lost if the process stops before a flush: the
+            # buffered callbacks were not acknowledged, so Twilio retries them
+            _buffer = DeliveryStatusBuffer()
+        return _buffer
+
+
+def delivery_state(status, provider_status):
+    """What happened to a message: the provider's report when there is one, else the outbox status"""
+    return provider_status or status
+
+
+def delivery_summary(notifications):
+    """
+    Count notifications by channel and delivery state
+    Args:
+        notifications: NotificationOutbox queryset
+    Returns:
+        dict: {channel: {state: count}}, e.g.
+            {'email': {'sent': 3}, 'whatsapp': {'delivered': 2, 'failed': 1}}
+    """
+    counts = {}
+    rows = (
+        notifications.values_list('channel', 'status', 'provider_status')
+        .annotate(count=Count('id'))
+        .order_by()
+    )
+    for channel, status, provider_status, count in rows:
+        states = counts.setdefault(channel, {})
+        state = delivery_state(status, provider_status)
+        states[state] = states.get(state, 0) + count
+    return counts
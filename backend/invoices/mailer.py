@@ -0,0 +1,146 @@
+"""
+Invoice email delivery over a shared SMTP connection
+Sending each invoice with EmailMessage.send() opens a new SMTP connection
+(TCP connect, STARTTLS, login) per recipient. InvoiceMailer opens one
+connection and sends through it, reconnecting after every chunk of messages
+(providers cap messages per session) and whenever the server drops the
+connection, so a bulk upload pays for one handshake per chunk instead of
+one per invoice.
+"""
+import smtplib
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+
+# Errors after which the connection is reopened and the message retried
+RECONNECT_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, ConnectionError, TimeoutError)
+
+
+def build_invoice_email(invoice, to=None):
+    """
+    Invoice email with the PDF attached
+    Args:
+        invoice: Invoice with a generated pdf_file
+        to: recipient address (default: the buyer's email)
+    Returns:
+        EmailMessage: the message, not yet sent
+    """
+    subject = f'Invoice {invoice.invoice_number} - Rs.{invoice.total}'
+    body = f"""Dear {invoice.buyer_name},
+
+Please find attached your invoice {invoice.invoice_number}.
+
+Invoice Details:
+- Invoice Number: {invoice.invoice_number}
+- Date: {invoice.invoice_date.strftime('%d/%m/%Y')}
+- Total Amount: Rs.{invoice.total}
+
+Thank you for your business!
+
+Best regards,
+{invoice.seller_name}"""
+
+    email_message = EmailMessage(
+        subject=subject,
+        body=body,
+        from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', 'noreply@invoice.com'),
+        to=[to or invoice.buyer_email],
+    )
+
+    # Attach PDF: bytes this process sent recently come from the PDF cache,
+    # anything else is read from storage once
+    from .services import get_invoice_pdf_bytes
+    pdf_content = get_invoice_pdf_bytes(invoice)
+    email_message.attach(f'{invoice.invoice_number}.pdf', pdf_content, 'application/pdf')
+
+    return email_message
+
+
+class InvoiceMailer:
+    """
+    Sends messages over one SMTP connection, in chunks
+    Use as a context manager; the connection is opened on the first send
+    and closed on exit.
+    """
+
+    def __init__(self, chunk_size=None, **connection_kwargs):
+        """
+        Args:
+            chunk_size: messages sent per connection before it is reopened
+                (default INVOICE_SETTINGS['EMAIL_CHUNK_SIZE'])
+            connection_kwargs: passed to django.core.mail.get_connection
+        """
+        if chunk_size is None:
+            chunk_size = settings.INVOICE_SETTINGS.get('EMAIL_CHUNK_SIZE', 50)
+        self.chunk_size = max(1, int(chunk_size))
+        self.connection_kwargs = connection_kwargs
+        self.connection = None
+        # Messages sent over the current connection
+        self.sent_on_connection = 0
+        # Connections opened so far, for benchmarks and tests
+        self.connections_opened = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        """Open a new connection, closing the current one"""
+        self.close()
+        self.connection = get_connection(fail_silently=False, **self.connection_kwargs)
+        self.connection.open()
+        self.sent_on_connection = 0
+        self.connections_opened += 1
+
+    def close(self):
+        """Close the connection, ignoring errors from an already dropped one"""
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+    def send(self, messages):
+        """
+        Send messages, chunk_size per connection
+        Each message goes through send_messages on the shared connection on
+        its own, so a failure is pinned to the message that caused it and a
+        dropped connection never re-sends messages that were already accepted.
+        Returns:
+            list: one error (None on success) per message, in input order
+        """
+        return [self.send_one(message) for message in messages]
+
+    def send_one(self, message):
+        """
+        Send one message, reconnecting once if the connection was lost
+        Returns:
+            Exception: the error, None if the message was accepted
+        """
+        try:
+            if self.connection is None or self.sent_on_connection >= self.chunk_size:
+                self.open()
+        except Exception as e:
+            self.close()
+            return e
+
+        self.sent_on_connection += 1
+        try:
+            self.connection.send_messages([message])
+            return None
+        except RECONNECT_ERRORS:
+            pass
+        except Exception as e:
+            return e
+
+        try:
+            self.open()
+            self.sent_on_connection += 1
+            self.connection.send_messages([message])
+            return None
+        except Exception as e:
+            return e
+
@@ -0,0 +1,79 @@
+"""
+Run invoice performance benchmarks and print the results as JSON
+"""
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from invoices.benchmarks import BENCHMARKS, compare_to_baseline
+
+
+class Command(BaseCommand):
+    help = 'Run invoice performance benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'benchmarks',
+            nargs='*',
+            help=f"Benchmarks to run (default: all). Available: {', '.join(BENCHMARKS)}"
+        )
+        parser.add_argument(
+            '--sizes',
+            help='Comma-separated sizes overriding each benchmark\'s defaults, e.g. 10,100'
+        )
+        parser.add_argument(
+            '--baseline',
+            help='JSON file from an earlier run; fail if any gated metric regressed beyond the threshold'
+        )
+        parser.add_argument(
+            '--save-baseline',
+            help='Write this run\'s results to a JSON file for later comparison'
+        )
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=settings.INVOICE_SETTINGS.get('BENCHMARK_REGRESSION_THRESHOLD', 20),
+            help='Allowed growth of any metric, in percent (default: %(default)s)'
+        )
+
+    def handle(self, *args, **options):
+        names = options['benchmarks'] or list(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError(f"Unknown benchmarks: {', '.join(unknown)}")
+
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read baseline: {e}")
+
+        kwargs = {}
+        if options['sizes']:
+            kwargs['sizes'] = [int(size) for size in options['sizes'].split(',')]
+
+        results = {}
+        for name in names:
+            self.stderr.write(f"Running {name}...")
+            results[name] = BENCHMARKS[name](**kwargs)
+
+        self.stdout.write(json.dumps(results, indent=2))
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+        if baseline is not None:
+            regressions = compare_to_baseline(results, baseline, options['threshold'])
+            for regression in regressions:
+                self.stderr.write(
+                    f"{regression['benchmark']} {regression['case']}: {regression['metric']} "
+                    f"{regression['baseline']} -> {regression['current']} "
+                    f"(+{regression['change_percent']}%)"
+                )
+            if regressions:
+                raise CommandError(
+                    f"{len(regressions)} metric(s) regressed by more than {options['threshold']}%"
+                )
+            self.stderr.write(f"No regressions beyond {options['threshold']}%")
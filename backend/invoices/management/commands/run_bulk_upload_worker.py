@@ -0,0 +1,32 @@
+"""
+Process queued bulk CSV uploads in the background
+"""
+from django.core.management.base import BaseCommand
+from invoices.bulk_jobs import run_bulk_upload_worker
+
+
+class Command(BaseCommand):
+    help = 'Run queued bulk invoice uploads (keeps polling unless --once is given)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run every job currently queued, then exit'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            help='Seconds to wait when no job is queued (default: BULK_UPLOAD_POLL_INTERVAL)'
+        )
+
+    def handle(self, *args, **options):
+        self.stderr.write('Bulk upload worker started')
+        try:
+            run_bulk_upload_worker(
+                poll_interval=options['poll_interval'],
+                once=options['once'],
+            )
+        except KeyboardInterrupt:
+            pass
+        self.stderr.write('Bulk upload worker stopped')
@@ -0,0 +1,38 @@
+"""
+Deliver queued invoice emails and WhatsApp messages in the background
+"""
+from django.core.management.base import BaseCommand
+from invoices.notifications import run_notification_worker
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued notifications (keeps polling unless --once is given)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Deliver everything currently due, then exit'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='Notifications claimed per round (default: NOTIFICATION_BATCH_SIZE)'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            help='Seconds to wait when nothing is due (default: NOTIFICATION_POLL_INTERVAL)'
+        )
+
+    def handle(self, *args, **options):
+        self.stderr.write('Notification worker started')
+        try:
+            run_notification_worker(
+                poll_interval=options['poll_interval'],
+                batch_size=options['batch_size'],
+                once=options['once'],
+            )
+        except KeyboardInterrupt:
+            pass
+        self.stderr.write('Notification worker stopped')
@@ -0,0 +1,44 @@
+"""
+Render queued invoice PDFs in the background
+"""
+from django.core.management.base import BaseCommand
+from invoices.pdf_queue import run_pdf_worker
+
+
+class Command(BaseCommand):
+    help = 'Render pending invoice PDFs (keeps polling unless --once is given)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Render everything currently pending, then exit'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='Invoices claimed per round (default: PDF_QUEUE_BATCH_SIZE)'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            help='Seconds to wait when the queue is empty (default: PDF_QUEUE_POLL_INTERVAL)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Render processes (default: PDF_WORKERS)'
+        )
+
+    def handle(self, *args, **options):
+        self.stderr.write('PDF worker started')
+        try:
+            run_pdf_worker(
+                poll_interval=options['poll_interval'],
+                batch_size=options['batch_size'],
+                pdf_workers=options['workers'],
+                once=options['once'],
+            )
+        except KeyboardInterrupt:
+            pass
+        self.stderr.write('PDF worker stopped')
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.8 on 2026-10-18 04:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0003_alter_invoiceitem_hsn_sac'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='pdf_hash',
+            field=models.CharField(blank=True, default='', help_text='Content digest of the data the stored PDF was rendered from', max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.8 on 2026-10-18 04:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0004_invoice_pdf_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='bulk_batch_id',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='Batch ID of the bulk upload that created this invoice', max_length=32),
+        ),
+    ]
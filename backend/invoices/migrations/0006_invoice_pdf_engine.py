@@ -0,0 +1,18 @@
+# Generated by Django 4.2.8 on 2026-10-18 04:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0005_invoice_bulk_batch_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='pdf_engine',
+            field=models.CharField(blank=True, default='', help_text='Renderer that produced the stored PDF (wkhtmltopdf or reportlab)', max_length=20),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.8 on 2026-10-18 04:35
+
+from django.db import migrations, models
+
+
+def mark_existing_pdfs_ready(apps, schema_editor):
+    """
+    Invoices that already have a stored PDF don't need a background render,
+    and the rest (drafts included) are rendered on demand rather than all
+    at once by the first worker run
+    """
+    Invoice = apps.get_model('invoices', 'Invoice')
+    has_pdf = Invoice.objects.exclude(pdf_file='').exclude(pdf_file__isnull=True)
+    has_pdf.update(pdf_status='ready')
+    Invoice.objects.exclude(pk__in=has_pdf.values('pk')).update(pdf_status='none')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0006_invoice_pdf_engine'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='pdf_error',
+            field=models.TextField(blank=True, default='', help_text='Error from the last failed render'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='pdf_finished_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='pdf_queued_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='pdf_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='pdf_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('rendering', 'Rendering'), ('ready', 'Ready'), ('failed', 'Failed')], db_index=True, default='pending', help_text='State of the background PDF render', max_length=10),
+        ),
+        migrations.RunPython(mark_existing_pdfs_ready, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.8 on 2026-10-18 04:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0007_invoice_pdf_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkUploadJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(db_index=True, max_length=100)),
+                ('invoice_type', models.CharField(choices=[('topmate', 'Topmate Invoice'), ('user', 'User Invoice')], max_length=10)),
+                ('csv_file', models.FileField(upload_to='bulk_uploads/')),
+                ('options', models.JSONField(default=dict, help_text='Processor options: draft/email/WhatsApp flags, GST rate, seller details')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], db_index=True, default='queued', max_length=10)),
+                ('batch_id', models.CharField(blank=True, default='', help_text='Batch ID of the created invoices', max_length=32)),
+                ('error', models.TextField(blank=True, default='')),
+                ('total_rows', models.IntegerField(blank=True, help_text='Line count estimate while running, exact row count once completed', null=True)),
+                ('rows_processed', models.IntegerField(default=0)),
+                ('successful', models.IntegerField(default=0)),
+                ('failed', models.IntegerField(default=0)),
+                ('emails_sent', models.IntegerField(default=0)),
+                ('whatsapp_sent', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Bulk Upload Job',
+                'verbose_name_plural': 'Bulk Upload Jobs',
+                'db_table': 'bulk_upload_jobs',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BulkUploadJobResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row', models.IntegerField(help_text='CSV line number')),
+                ('success', models.BooleanField()),
+                ('data', models.JSONField(help_text='Same shape as the synchronous successes/failures entries')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='invoices.bulkuploadjob')),
+            ],
+            options={
+                'db_table': 'bulk_upload_job_results',
+                'ordering': ['row'],
+                'indexes': [models.Index(fields=['job', 'success', 'row'], name='bulk_upload_job_id_f32ec6_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.8 on 2026-10-18 04:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0008_bulkuploadjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bulkuploadjob',
+            name='already_created',
+            field=models.IntegerField(default=0, help_text='Rows skipped because an earlier upload created them'),
+        ),
+        migrations.AddField(
+            model_name='bulkuploadjob',
+            name='last_committed_row',
+            field=models.IntegerField(default=0, help_text='CSV line number of the last row whose batch was committed; a resumed job starts after it'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='row_fingerprint',
+            field=models.CharField(blank=True, editable=False, help_text='Fingerprint of the bulk upload row that created this invoice', max_length=64, null=True, unique=True),
+        ),
+    ]
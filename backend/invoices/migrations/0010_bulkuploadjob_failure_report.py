@@ -0,0 +1,18 @@
+# Generated by Django 4.2.8 on 2026-10-18 04:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0009_bulk_upload_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bulkuploadjob',
+            name='failure_report',
+            field=models.FileField(blank=True, help_text='CSV of the failing rows with an errors column', upload_to='bulk_uploads/failures/'),
+        ),
+    ]
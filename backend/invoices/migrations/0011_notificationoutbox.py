@@ -0,0 +1,51 @@
+# Generated by Django 4.2.8 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0010_bulkuploadjob_failure_report'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='bulkuploadjob',
+            old_name='emails_sent',
+            new_name='emails_queued',
+        ),
+        migrations.RenameField(
+            model_name='bulkuploadjob',
+            old_name='whatsapp_sent',
+            new_name='whatsapp_queued',
+        ),
+        migrations.CreateModel(
+            name='NotificationOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel', models.CharField(choices=[('email', 'Email'), ('whatsapp', 'WhatsApp')], max_length=10)),
+                ('recipient', models.CharField(help_text='Email address or phone number', max_length=255)),
+                ('base_url', models.CharField(blank=True, default='', help_text='Scheme and host for the PDF link sent over WhatsApp', max_length=255)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('dead', 'Dead letter')], db_index=True, default='pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Not retried before this time')),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('provider_message_id', models.CharField(blank=True, default='', help_text='Message ID returned by the provider (Twilio message SID)', max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('delivered_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='invoices.invoice')),
+            ],
+            options={
+                'verbose_name': 'Notification',
+                'verbose_name_plural': 'Notification Outbox',
+                'db_table': 'notification_outbox',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='notificatio_status_7f28bd_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.8 on 2026-10-18 05:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0011_notificationoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationoutbox',
+            name='provider_error_code',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='notificationoutbox',
+            name='provider_status',
+            field=models.CharField(blank=True, choices=[('accepted', 'Accepted'), ('queued', 'Queued'), ('sending', 'Sending'), ('sent', 'Sent'), ('delivered', 'Delivered'), ('read', 'Read'), ('undelivered', 'Undelivered'), ('failed', 'Failed')], default='', help_text="Latest delivery state from the provider's status callbacks", max_length=20),
+        ),
+        migrations.AddField(
+            model_name='notificationoutbox',
+            name='provider_status_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='notificationoutbox',
+            name='provider_message_id',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='Message ID returned by the provider (Twilio message SID)', max_length=64),
+        ),
+    ]
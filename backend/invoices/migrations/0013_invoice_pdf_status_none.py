@@ -0,0 +1,25 @@
+# Generated by Django 4.2.8 on 2026-10-18 05:25
+
+from django.db import migrations, models
+
+
+def unqueue_drafts(apps, schema_editor):
+    """Drafts queued under the old 'pending' default are never rendered by the worker"""
+    Invoice = apps.get_model('invoices', 'Invoice')
+    Invoice.objects.filter(is_draft=True, pdf_status='pending').update(pdf_status='none')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0012_notificationoutbox_provider_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='invoice',
+            name='pdf_status',
+            field=models.CharField(choices=[('none', 'Not queued'), ('pending', 'Pending'), ('rendering', 'Rendering'), ('ready', 'Ready'), ('failed', 'Failed')], db_index=True, default='none', help_text="State of the background PDF render (only 'pending' invoices are picked up by the worker)", max_length=10),
+        ),
+        migrations.RunPython(unqueue_drafts, migrations.RunPython.noop),
+    ]
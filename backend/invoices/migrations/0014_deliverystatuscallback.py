@@ -0,0 +1,28 @@
+# Generated by Django 4.2.8 on 2026-10-18 05:41
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0013_invoice_pdf_status_none'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryStatusCallback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider_message_id', models.CharField(help_text='Twilio message SID', max_length=64)),
+                ('provider_status', models.CharField(choices=[('accepted', 'Accepted'), ('queued', 'Queued'), ('sending', 'Sending'), ('sent', 'Sent'), ('delivered', 'Delivered'), ('read', 'Read'), ('undelivered', 'Undelivered'), ('failed', 'Failed')], max_length=20)),
+                ('provider_error_code', models.CharField(blank=True, default='', max_length=10)),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'delivery_status_callbacks',
+                'ordering': ['id'],
+            },
+        ),
+    ]
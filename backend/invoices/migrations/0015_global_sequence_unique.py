@@ -0,0 +1,30 @@
+# Generated by Django 4.2.8 on 2026-10-18 06:17
+
+from django.db import migrations, models
+
+
+def merge_duplicate_global_sequences(apps, schema_editor):
+    """Keep one global row per sequence type, at the highest number any duplicate handed out"""
+    InvoiceNumberSequence = apps.get_model('invoices', 'InvoiceNumberSequence')
+    rows = InvoiceNumberSequence.objects.filter(user_id__isnull=True).order_by('sequence_type', '-current_number', 'id')
+    kept = set()
+    for row in rows:
+        if row.sequence_type in kept:
+            row.delete()
+        else:
+            kept.add(row.sequence_type)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0014_deliverystatuscallback'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_global_sequences, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='invoicenumbersequence',
+            constraint=models.UniqueConstraint(condition=models.Q(('user_id__isnull', True)), fields=('sequence_type',), name='unique_global_sequence_type'),
+        ),
+    ]
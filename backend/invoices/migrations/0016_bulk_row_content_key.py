@@ -0,0 +1,27 @@
+# Generated by Django 4.2.8 on 2026-10-18 06:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0015_global_sequence_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='bulk_row',
+            field=models.IntegerField(blank=True, editable=False, help_text='Row number in the bulk upload that created this invoice', null=True),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='row_content_key',
+            field=models.CharField(blank=True, editable=False, help_text="Fingerprint of the bulk upload row's content, whichever copy of it this is", max_length=64, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['bulk_batch_id', 'row_content_key'], name='invoices_bulk_ba_12c19d_idx'),
+        ),
+    ]
@@ -1,5 +1,7 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.conf import settings
+from django.utils import timezone
 from django.core.validators import MinValueValidator, RegexValidator
 from decimal import Decimal
 
@@ -45,6 +47,22 @@ INDIAN_STATES = [
 ]
 
 
+# Background PDF rendering states
+PDF_STATUS_NONE = 'none'
+PDF_STATUS_PENDING = 'pending'
+PDF_STATUS_RENDERING = 'rendering'
+PDF_STATUS_READY = 'ready'
+PDF_STATUS_FAILED = 'failed'
+
+PDF_STATUS_CHOICES = [
+    (PDF_STATUS_NONE, 'Not queued'),
+    (PDF_STATUS_PENDING, 'Pending'),
+    (PDF_STATUS_RENDERING, 'Rendering'),
+    (PDF_STATUS_READY, 'Ready'),
+    (PDF_STATUS_FAILED, 'Failed'),
+]
+
+
 class BusinessProfile(models.Model):
     """
     Stores business profile for 'self-use' invoices
@@ -109,16 +127,68 @@ class InvoiceNumberSequence(models.Model):
     class Meta:
         db_table = 'invoice_number_sequences'
         unique_together = [['sequence_type', 'user_id']]
+        constraints = [
+            # unique_together lets any number of NULL user_id rows through, so
+            # the global (topmate) sequence needs its own constraint
+            models.UniqueConstraint(
+                fields=['sequence_type'],
+                condition=models.Q(user_id__isnull=True),
+                name='unique_global_sequence_type',
+            ),
+        ]
         verbose_name = 'Invoice Number Sequence'
         verbose_name_plural = 'Invoice Number Sequences'
 
     def get_next_number(self):
         """Atomically increment and return next invoice number"""
-        from django.db import transaction
+        number = InvoiceNumberSequence.reserve_numbers(self.sequence_type, self.user_id)[0]
+        self.current_number = number
+        return number
+
+    @classmethod
+    def reserve_numbers(cls, sequence_type, user_id=None, count=1):
+        """
+        Atomically reserve a block of consecutive numbers from a sequence
+        The increment is a single UPDATE ... SET current_number = current_number + count.
+        The row stays locked until the caller's transaction ends, so the block
+        read back belongs to this caller alone and goes back to the sequence
+        if that transaction rolls back (no gaps).
+        Returns:
+            range: the reserved numbers
+        """
         with transaction.atomic():
-            self.current_number += 1
-            self.save()
-            return self.current_number
+            sequence = cls.objects.filter(sequence_type=sequence_type, user_id=user_id)
+            increment = {
+                'current_number': F('current_number') + count,
+                'updated_at': timezone.now(),
+            }
+            if not sequence.update(**increment):
+                cls.objects.get_or_create(
+                    sequence_type=sequence_type,
+                    user_id=user_id,
+                    defaults={'current_number': 0}
+                )
+                sequence.update(**increment)
+            last = sequence.values_list('current_number', flat=True).get()
+
+        return range(last - count + 1, last + 1)
+
+    @classmethod
+    def reserve_invoice_numbers(cls, invoice_type, user_id=None, count=1):
+        """
+        Reserve and format the next `count` invoice numbers
+        Topmate invoices share one global sequence, user invoices have one per user_id
+        Returns:
+            list: invoice number strings
+        """
+        if invoice_type == 'topmate':
+            prefix = settings.INVOICE_SETTINGS['TOPMATE_INVOICE_PREFIX']
+            return [f"{prefix}-{number:06d}" for number in cls.reserve_numbers('topmate', None, count)]
+
+        # Create a hash of user_id to keep invoice number clean
+        import hashlib
+        user_hash = hashlib.md5(user_id.encode()).hexdigest()[:6].upper()
+        return [f"INV-{user_hash}-{number:04d}" for number in cls.reserve_numbers('user', user_id, count)]
 
     def __str__(self):
         if self.sequence_type == 'topmate':
@@ -201,6 +271,65 @@ class Invoice(models.Model):
     # PDF storage
     pdf_url = models.URLField(blank=True, null=True)
     pdf_file = models.FileField(upload_to='invoices/', blank=True, null=True)
+    pdf_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        help_text="Content digest of the data the stored PDF was rendered from"
+    )
+    pdf_engine = models.CharField(
+        max_length=20,
+        blank=True,
+        default='',
+        help_text="Renderer that produced the stored PDF (wkhtmltopdf or reportlab)"
+    )
+
+    # Background PDF rendering (see pdf_queue.py)
+    pdf_status = models.CharField(
+        max_length=10,
+        choices=PDF_STATUS_CHOICES,
+        default=PDF_STATUS_NONE,
+        db_index=True,
+        help_text="State of the background PDF render (only 'pending' invoices are picked up by the worker)"
+    )
+    pdf_queued_at = models.DateTimeField(null=True, blank=True)
+    pdf_started_at = models.DateTimeField(null=True, blank=True)
+    pdf_finished_at = models.DateTimeField(null=True, blank=True)
+    pdf_error = models.TextField(blank=True, default='', help_text="Error from the last failed render")
+
+    # Bulk upload this invoice was created by (empty for single invoices)
+    bulk_batch_id = models.CharField(
+        max_length=32,
+        blank=True,
+        default='',
+        db_index=True,
+        help_text="Batch ID of the bulk upload that created this invoice"
+    )
+    # Deterministic hash of the uploader, upload options and CSV row (see bulk_upload_service.row_fingerprint),
+    # so re-uploading a file skips rows that already became invoices
+    row_fingerprint = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        unique=True,
+        editable=False,
+        help_text="Fingerprint of the bulk upload row that created this invoice"
+    )
+    # row_fingerprint of the first copy of the row and the row's number in the
+    # upload, so later batches can number repeated rows from the database
+    row_content_key = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Fingerprint of the bulk upload row's content, whichever copy of it this is"
+    )
+    bulk_row = models.IntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Row number in the bulk upload that created this invoice"
+    )
 
     # Metadata
     created_at = models.DateTimeField(auto_now_add=True)
@@ -216,6 +345,7 @@ class Invoice(models.Model):
             models.Index(fields=['user_id', '-created_at']),
             models.Index(fields=['invoice_number']),
             models.Index(fields=['invoice_type']),
+            models.Index(fields=['bulk_batch_id', 'row_content_key']),
         ]
 
     def __str__(self):
@@ -295,3 +425,204 @@ class InvoiceItem(models.Model):
         # Auto-calculate amount
         self.amount = (self.quantity * self.unit_price).quantize(Decimal('0.01'))
         super().save(*args, **kwargs)
+
+
+class BulkUploadJob(models.Model):
+    """
+    A bulk CSV upload processed in the background (see bulk_jobs.py)
+    Progress counters are updated after every batch of rows
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    user_id = models.CharField(max_length=100, db_index=True)
+    invoice_type = models.CharField(max_length=10, choices=Invoice.INVOICE_TYPE_CHOICES)
+    csv_file = models.FileField(upload_to='bulk_uploads/')
+    options = models.JSONField(
+        default=dict,
+        help_text="Processor options: draft/email/WhatsApp flags, GST rate, seller details"
+    )
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    batch_id = models.CharField(max_length=32, blank=True, default='', help_text="Batch ID of the created invoices")
+    error = models.TextField(blank=True, default='')
+    failure_report = models.FileField(
+        upload_to='bulk_uploads/failures/',
+        blank=True,
+        help_text="CSV of the failing rows with an errors column"
+    )
+
+    # Progress
+    total_rows = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text="Line count estimate while running, exact row count once completed"
+    )
+    rows_processed = models.IntegerField(default=0)
+    successful = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    already_created = models.IntegerField(default=0, help_text="Rows skipped because an earlier upload created them")
+    # Delivery itself is done by the notification worker (see notifications.py)
+    emails_queued = models.IntegerField(default=0)
+    whatsapp_queued = models.IntegerField(default=0)
+    last_committed_row = models.IntegerField(
+        default=0,
+        help_text="CSV line number of the last row whose batch was committed; a resumed job starts after it"
+    )
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'bulk_upload_jobs'
+        ordering = ['-created_at']
+        verbose_name = 'Bulk Upload Job'
+        verbose_name_plural = 'Bulk Upload Jobs'
+
+    def __str__(self):
+        return f"Bulk upload {self.pk} ({self.status})"
+
+
+class BulkUploadJobResult(models.Model):
+    """Outcome of one CSV row of a background bulk upload"""
+    job = models.ForeignKey(
+        BulkUploadJob,
+        on_delete=models.CASCADE,
+        related_name='results'
+    )
+    row = models.IntegerField(help_text="CSV line number")
+    success = models.BooleanField()
+    data = models.JSONField(help_text="Same shape as the synchronous successes/failures entries")
+
+    class Meta:
+        db_table = 'bulk_upload_job_results'
+        ordering = ['row']
+        indexes = [
+            models.Index(fields=['job', 'success', 'row']),
+        ]
+
+    def __str__(self):
+        return f"Job {self.job_id} row {self.row}"
+
+
+class NotificationOutbox(models.Model):
+    """
+    An email or WhatsApp message waiting to be delivered (see notifications.py)
+    Rows are written in the same transaction as the invoice they announce,
+    and delivered by a worker with retries, so a slow or throttling provider
+    never holds up (or fails) invoice creation.
+    """
+    CHANNEL_EMAIL = 'email'
+    CHANNEL_WHATSAPP = 'whatsapp'
+
+    CHANNEL_CHOICES = [
+        (CHANNEL_EMAIL, 'Email'),
+        (CHANNEL_WHATSAPP, 'WhatsApp'),
+    ]
+
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_DEAD = 'dead'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_DEAD, 'Dead letter'),
+    ]
+
+    # Delivery states reported by Twilio status callbacks
+    PROVIDER_STATUS_CHOICES = [
+        ('accepted', 'Accepted'),
+        ('queued', 'Queued'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('delivered', 'Delivered'),
+        ('read', 'Read'),
+        ('undelivered', 'Undelivered'),
+        ('failed', 'Failed'),
+    ]
+
+    invoice = models.ForeignKey(
+        Invoice,
+        on_delete=models.CASCADE,
+        related_name='notifications'
+    )
+    channel = models.CharField(max_length=10, choices=CHANNEL_CHOICES)
+    recipient = models.CharField(max_length=255, help_text="Email address or phone number")
+    base_url = models.CharField(
+        max_length=255,
+        blank=True,
+        default='',
+        help_text="Scheme and host for the PDF link sent over WhatsApp"
+    )
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now, help_text="Not retried before this time")
+    last_error = models.TextField(blank=True, default='')
+    provider_message_id = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        db_index=True,
+        help_text="Message ID returned by the provider (Twilio message SID)"
+    )
+    provider_status = models.CharField(
+        max_length=20,
+        choices=PROVIDER_STATUS_CHOICES,
+        blank=True,
+        default='',
+        help_text="Latest delivery state from the provider's status callbacks"
+    )
+    provider_error_code = models.CharField(max_length=10, blank=True, default='')
+    provider_status_at = models.DateTimeField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'notification_outbox'
+        ordering = ['-created_at']
+        verbose_name = 'Notification'
+        verbose_name_plural = 'Notification Outbox'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.channel} to {self.recipient} ({self.status})"
+
+
+class DeliveryStatusCallback(models.Model):
+    """
+    A Twilio status callback whose message SID is not in the outbox yet
+    Staged in the same transaction as the rest of its batch, retried until
+    the worker has recorded the SID and then deleted (see delivery_status.py),
+    so an acknowledged update is not lost while it waits.
+    """
+    provider_message_id = models.CharField(max_length=64, help_text="Twilio message SID")
+    provider_status = models.CharField(max_length=20, choices=NotificationOutbox.PROVIDER_STATUS_CHOICES)
+    provider_error_code = models.CharField(max_length=10, blank=True, default='')
+    received_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'delivery_status_callbacks'
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.provider_message_id} {self.provider_status}"
@@ -0,0 +1,429 @@
+"""
+Email and WhatsApp delivery backed by the notification_outbox table
+Invoice creation writes one NotificationOutbox row per message, in the same
+transaction as the invoice. A worker process
+(python manage.py run_notification_worker) claims due rows with a
+conditional UPDATE and delivers them:
+
+- emails of a round share one SMTP connection (mailer.InvoiceMailer);
+  WhatsApp messages are sent concurrently over one pooled HTTP session
+  (whatsapp.WhatsAppDispatcher) while the emails go out
+- every channel is paced by a token bucket (NOTIFICATION_RATE_LIMITS), so a
+  large upload never bursts past the provider's rate limit
+- a failed delivery is retried with exponential backoff; after
+  NOTIFICATION_MAX_ATTEMPTS, or straight away on an error retrying cannot
+  fix (refused recipient, invalid number), the row is dead-lettered
+- a message whose invoice PDF is still being rendered waits for it
+  without using up an attempt
+
+Delivery is at least once: a worker that dies between the provider
+accepting a message and the row being marked sent will send it again.
+"""
+import smtplib
+import threading
+import time
+import urllib.parse
+from datetime import timedelta
+from urllib.parse import urljoin
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from .models import (
+    NotificationOutbox,
+    PDF_STATUS_PENDING,
+    PDF_STATUS_RENDERING,
+    PDF_STATUS_FAILED,
+)
+from .delivery_status import apply_staged_updates
+from .whatsapp import WhatsAppDispatcher, WhatsAppMessage, future_result, whatsapp_address, whatsapp_message_body
+
+
+class PermanentDeliveryError(Exception):
+    """A delivery failure that retrying cannot fix"""
+
+
+def whatsapp_configured():
+    """Whether Twilio credentials are set, so WhatsApp messages can be sent"""
+    return bool(getattr(settings, 'TWILIO_ACCOUNT_SID', '') and getattr(settings, 'TWILIO_AUTH_TOKEN', ''))
+
+
+def build_notifications(invoice, email=None, phone=None, base_url=''):
+    """
+    Unsaved outbox rows announcing an invoice
+    Args:
+        invoice: saved Invoice
+        email: address to email the PDF to (None for no email)
+        phone: WhatsApp number (None for no message; nothing is queued
+            while Twilio is not configured)
+        base_url: scheme and host for the PDF link in WhatsApp messages
+    Returns:
+        list: NotificationOutbox instances, not yet saved
+    """
+    notifications = []
+    if email:
+        notifications.append(NotificationOutbox(
+            invoice=invoice,
+            channel=NotificationOutbox.CHANNEL_EMAIL,
+            recipient=email,
+        ))
+    if phone and whatsapp_configured():
+        notifications.append(NotificationOutbox(
+            invoice=invoice,
+            channel=NotificationOutbox.CHANNEL_WHATSAPP,
+            recipient=phone,
+            base_url=base_url or '',
+        ))
+    return notifications
+
+
+def queue_notifications(notifications):
+    """Write outbox rows (call inside the transaction that creates their invoices)"""
+    if notifications:
+        NotificationOutbox.objects.bulk_create(notifications)
+    return notifications
+
+
+def whatsapp_link(invoice, phone, pdf_url):
+    """
+    wa.me link carrying the invoice details, for when Twilio is not configured
+    Returns:
+        tuple: (message text, link)
+    """
+    message = f"""Hello {invoice.buyer_name},
+
+Here is your invoice:
+
+*Invoice #{invoice.invoice_number}*
+Date: {invoice.invoice_date.strftime('%d/%m/%Y')}
+Amount: ₹{invoice.total}
+
+Download PDF: {pdf_url}
+
+Thank you for your business!
+- {invoice.seller_name}"""
+
+    return message, f"https://wa.me/{phone}?text={urllib.parse.quote(message)}"
+
+
+class TokenBucket:
+    """
+    Paces one channel to `rate` messages per second
+    Up to `burst` messages go out back to back after a quiet spell; after
+    that acquire() sleeps until the next token is due. Safe to share
+    between threads: waiters take their tokens one at a time.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, rate))
+        self.tokens = self.burst
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Take one token, waiting for it if the bucket is empty"""
+        with self.lock:
+            self._refill()
+            if self.tokens < 1:
+                self.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+def get_rate_limiters():
+    """One token bucket per channel from NOTIFICATION_RATE_LIMITS (a rate of 0 or None is unlimited)"""
+    limits = settings.INVOICE_SETTINGS.get('NOTIFICATION_RATE_LIMITS', {})
+    return {channel: TokenBucket(rate) for channel, rate in limits.items() if rate}
+
+
+def retry_delay(attempts):
+    """Seconds before the next try after `attempts` failures: doubling from NOTIFICATION_RETRY_BACKOFF, capped"""
+    base = settings.INVOICE_SETTINGS.get('NOTIFICATION_RETRY_BACKOFF', 30)
+    cap = settings.INVOICE_SETTINGS.get('NOTIFICATION_RETRY_BACKOFF_MAX', 3600)
+    return min(cap, base * 2 ** (attempts - 1))
+
+
+def is_permanent(error):
+    """Whether a delivery error will fail the same way on every retry"""
+    if isinstance(error, (PermanentDeliveryError, smtplib.SMTPRecipientsRefused)):
+        return True
+    # 5xx SMTP replies are permanent (4xx, e.g. 421/451 throttling, are not);
+    # a bad login is left to retry while the settings are fixed
+    smtp_code = getattr(error, 'smtp_code', None)
+    if isinstance(smtp_code, int) and smtp_code >= 500 and not isinstance(error, smtplib.SMTPAuthenticationError):
+        return True
+    # Twilio client errors (invalid number, unverified recipient), except throttling
+    status = getattr(error, 'status', None)
+    return isinstance(status, int) and 400 <= status < 500 and status != 429
+
+
+def claim_due_notifications(limit):
+    """
+    Claim up to `limit` notifications that are due for this worker
+    Each row is moved pending -> sending with a conditional UPDATE, so two
+    workers polling at once never deliver the same message.
+    """
+    candidates = (
+        NotificationOutbox.objects.filter(
+            status=NotificationOutbox.STATUS_PENDING,
+            next_attempt_at__lte=timezone.now(),
+        )
+        .order_by('next_attempt_at', 'id')
+        .values_list('id', flat=True)[:limit]
+    )
+
+    claimed = []
+    for notification_id in candidates:
+        updated = NotificationOutbox.objects.filter(
+            pk=notification_id,
+            status=NotificationOutbox.STATUS_PENDING,
+        ).update(
+            status=NotificationOutbox.STATUS_SENDING,
+            started_at=timezone.now(),
+        )
+        if updated:
+            claimed.append(notification_id)
+
+    return list(
+        NotificationOutbox.objects.filter(id__in=claimed)
+        .select_related('invoice')
+        .order_by('next_attempt_at', 'id')
+    )
+
+
+def requeue_stale_notifications(timeout=None):
+    """Put back deliveries whose worker died mid-send (stuck in 'sending' too long)"""
+    if timeout is None:
+        timeout = settings.INVOICE_SETTINGS.get('NOTIFICATION_STALE_AFTER', 300)
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    return NotificationOutbox.objects.filter(
+        status=NotificationOutbox.STATUS_SENDING,
+        started_at__lt=cutoff,
+    ).update(status=NotificationOutbox.STATUS_PENDING)
+
+
+def retry_notification(notification):
+    """
+    Queue a dead-lettered notification again, with a fresh set of attempts
+    Returns:
+        bool: False if the notification was not dead-lettered
+    """
+    updated = NotificationOutbox.objects.filter(
+        pk=notification.pk,
+        status=NotificationOutbox.STATUS_DEAD,
+    ).update(
+        status=NotificationOutbox.STATUS_PENDING,
+        attempts=0,
+        next_attempt_at=timezone.now(),
+        last_error='',
+    )
+    notification.refresh_from_db()
+    return bool(updated)
+
+
+def _check_pdf(invoice):
+    """Raise PermanentDeliveryError if the invoice has no PDF to send"""
+    if invoice.pdf_status == PDF_STATUS_FAILED:
+        raise PermanentDeliveryError(f"PDF generation failed: {invoice.pdf_error}")
+    if not invoice.pdf_file:
+        raise PermanentDeliveryError('PDF not generated')
+
+
+def deliver_email(notification, mailer):
+    """
+    Send one email notification
+    Args:
+        mailer: open InvoiceMailer shared by the emails of this round
+    """
+    from .mailer import build_invoice_email
+
+    invoice = notification.invoice
+    _check_pdf(invoice)
+    error = mailer.send_one(build_invoice_email(invoice, to=notification.recipient))
+    if error is not None:
+        raise error
+
+
+def whatsapp_message(notification):
+    """
+    The WhatsApp message for a notification, with a link to its invoice PDF
+    Returns:
+        WhatsAppMessage: ready for WhatsAppDispatcher
+    """
+    invoice = notification.invoice
+    _check_pdf(invoice)
+    if not whatsapp_configured():
+        raise PermanentDeliveryError('Twilio not configured')
+    from .delivery_status import status_callback_url
+
+    return WhatsAppMessage(
+        to=whatsapp_address(notification.recipient),
+        body=whatsapp_message_body(invoice),
+        media_url=urljoin(notification.base_url, invoice.pdf_file.url),
+        status_callback=status_callback_url(notification.base_url),
+    )
+
+
+def _record_delivery(notification, provider_message_id):
+    """Mark a notification sent"""
+    now = timezone.now()
+    NotificationOutbox.objects.filter(pk=notification.pk).update(
+        status=NotificationOutbox.STATUS_SENT,
+        attempts=notification.attempts + 1,
+        provider_message_id=provider_message_id or '',
+        last_error='',
+        delivered_at=now,
+        updated_at=now,
+    )
+
+
+def _record_failure(notification, error):
+    """Schedule a retry with backoff, or dead-letter the notification"""
+    attempts = notification.attempts + 1
+    max_attempts = settings.INVOICE_SETTINGS.get('NOTIFICATION_MAX_ATTEMPTS', 6)
+    now = timezone.now()
+
+    if is_permanent(error) or attempts >= max_attempts:
+        print(f"Notification {notification.pk} ({notification.channel} to {notification.recipient}) "
+              f"dead-lettered after {attempts} attempt(s): {error}")
+        status = NotificationOutbox.STATUS_DEAD
+        next_attempt_at = notification.next_attempt_at
+    else:
+        status = NotificationOutbox.STATUS_PENDING
+        next_attempt_at = now + timedelta(seconds=retry_delay(attempts))
+
+    NotificationOutbox.objects.filter(pk=notification.pk).update(
+        status=status,
+        attempts=attempts,
+        last_error=str(error),
+        next_attempt_at=next_attempt_at,
+        updated_at=now,
+    )
+
+
+def _record_outcome(notification, provider_message_id=None, error=None):
+    """Record a delivery attempt, returning whether it succeeded"""
+    if error is not None:
+        _record_failure(notification, error)
+        return False
+    _record_delivery(notification, provider_message_id)
+    return True
+
+
+def _defer(notification):
+    """Put a notification back until its invoice's PDF is rendered (no attempt is used up)"""
+    delay = settings.INVOICE_SETTINGS.get('PDF_RETRY_AFTER', 2)
+    NotificationOutbox.objects.filter(pk=notification.pk).update(
+        status=NotificationOutbox.STATUS_PENDING,
+        next_attempt_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def deliver_due_notifications(batch_size=None, rate_limiters=None, dispatcher=None):
+    """
+    Claim and deliver one batch of due notifications
+    Args:
+        batch_size: notifications claimed per round
+        rate_limiters: channel -> TokenBucket, kept across rounds by the worker
+        dispatcher: WhatsAppDispatcher kept across rounds by the worker
+            (default: one opened for this round if it has WhatsApp messages)
+    Returns:
+        tuple: (number sent, number failed)
+    """
+    from .mailer import InvoiceMailer
+
+    if batch_size is None:
+        batch_size = settings.INVOICE_SETTINGS.get('NOTIFICATION_BATCH_SIZE', 50)
+    if rate_limiters is None:
+        rate_limiters = get_rate_limiters()
+
+    notifications = claim_due_notifications(batch_size)
+    if not notifications:
+        return 0, 0
+
+    due = []
+    for notification in notifications:
+        if notification.invoice.pdf_status in (PDF_STATUS_PENDING, PDF_STATUS_RENDERING):
+            _defer(notification)
+        else:
+            due.append(notification)
+    emails = [n for n in due if n.channel == NotificationOutbox.CHANNEL_EMAIL]
+    whatsapp = [n for n in due if n.channel == NotificationOutbox.CHANNEL_WHATSAPP]
+
+    own_dispatcher = dispatcher is None and bool(whatsapp)
+    if own_dispatcher:
+        dispatcher = WhatsAppDispatcher()
+
+    # True per delivered notification, False per failed one
+    delivered = []
+    try:
+        # WhatsApp messages go out on the dispatcher's threads (paced by the
+        # shared token bucket) while the emails are sent here
+        in_flight = []
+        for notification in whatsapp:
+            try:
+                message = whatsapp_message(notification)
+            except Exception as e:
+                delivered.append(_record_outcome(notification, error=e))
+                continue
+            in_flight.append((notification, dispatcher.submit(message, rate_limiters.get(notification.channel))))
+
+        # Emails of the round share one SMTP connection (opened on the first email)
+        with InvoiceMailer() as mailer:
+            limiter = rate_limiters.get(NotificationOutbox.CHANNEL_EMAIL)
+            for notification in emails:
+                if limiter is not None:
+                    limiter.acquire()
+                try:
+                    deliver_email(notification, mailer)
+                except Exception as e:
+                    delivered.append(_record_outcome(notification, error=e))
+                else:
+                    delivered.append(_record_outcome(notification, ''))
+
+        for notification, future in in_flight:
+            result = future_result(future)
+            if isinstance(result, Exception):
+                delivered.append(_record_outcome(notification, error=result))
+            else:
+                delivered.append(_record_outcome(notification, result))
+    finally:
+        if own_dispatcher:
+            dispatcher.close()
+
+    sent = sum(delivered)
+    return sent, len(delivered) - sent
+
+
+def run_notification_worker(poll_interval=None, batch_size=None, once=False):
+    """
+    Deliver queued notifications until interrupted
+    Args:
+        poll_interval: seconds to sleep when nothing is due
+        batch_size: notifications claimed per round
+        once: deliver everything currently due and return instead of polling
+    """
+    if poll_interval is None:
+        poll_interval = settings.INVOICE_SETTINGS.get('NOTIFICATION_POLL_INTERVAL', 1)
+
+    rate_limiters = get_rate_limiters()
+    requeue_stale_notifications()
+    # One pooled Twilio session for the life of the worker
+    with WhatsAppDispatcher() as dispatcher:
+        while True:
+            close_old_connections()
+            sent, failed = deliver_due_notifications(batch_size, rate_limiters, dispatcher)
+            if sent or failed:
+                continue
+            # Status callbacks left staged by a web process that stopped before applying them
+            apply_staged_updates()
+            if once:
+                return
+            time.sleep(poll_interval)
@@ -0,0 +1,156 @@
+"""
+Background PDF rendering backed by the invoices table
+Invoices start out with pdf_status='none'; queue_invoice_pdf moves them to
+'pending'. A worker process (python manage.py run_pdf_worker) claims pending
+invoices with a conditional UPDATE, renders them and records the outcome, so
+API requests never render inline. Drafts are never claimed, and bulk uploads
+that render inline mark their invoices 'rendering' so the worker leaves
+them alone.
+"""
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from .models import (
+    Invoice,
+    PDF_STATUS_PENDING,
+    PDF_STATUS_RENDERING,
+    PDF_STATUS_READY,
+    PDF_STATUS_FAILED,
+)
+
+
+def queue_invoice_pdf(invoice, force=False):
+    """
+    Mark an invoice for background rendering (drafts are left alone)
+    Args:
+        invoice: Invoice instance (updated in place)
+        force: Re-render even if the stored PDF matches the invoice content
+    Returns:
+        bool: whether the invoice was queued
+    """
+    if invoice.is_draft:
+        return False
+
+    fields = {
+        'pdf_status': PDF_STATUS_PENDING,
+        'pdf_queued_at': timezone.now(),
+        'pdf_started_at': None,
+        'pdf_finished_at': None,
+        'pdf_error': '',
+    }
+    if force:
+        # A blank digest never matches, so the worker cannot skip the render
+        fields['pdf_hash'] = ''
+
+    Invoice.objects.filter(pk=invoice.pk).update(**fields)
+    for name, value in fields.items():
+        setattr(invoice, name, value)
+    return True
+
+
+def claim_pending_invoices(limit):
+    """
+    Claim up to `limit` pending invoices for this worker
+    Each row is moved pending -> rendering with a conditional UPDATE, so two
+    workers polling at once never render the same invoice.
+    """
+    candidates = (
+        Invoice.objects.filter(pdf_status=PDF_STATUS_PENDING, is_draft=False)
+        .order_by('pdf_queued_at', 'id')
+        .values_list('id', flat=True)[:limit]
+    )
+
+    claimed = []
+    for invoice_id in candidates:
+        updated = Invoice.objects.filter(pk=invoice_id, pdf_status=PDF_STATUS_PENDING).update(
+            pdf_status=PDF_STATUS_RENDERING,
+            pdf_started_at=timezone.now(),
+        )
+        if updated:
+            claimed.append(invoice_id)
+
+    # No prefetch: the renderer reads each invoice's items in chunks, and a
+    # prefetch would load every item of the batch up front
+    return list(Invoice.objects.filter(id__in=claimed).order_by('id'))
+
+
+def requeue_stale_renders(timeout=None):
+    """Put back renders whose worker died mid-job (stuck in 'rendering' too long)"""
+    if timeout is None:
+        timeout = settings.INVOICE_SETTINGS.get('PDF_RENDER_STALE_AFTER', 600)
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    return Invoice.objects.filter(
+        pdf_status=PDF_STATUS_RENDERING,
+        pdf_started_at__lt=cutoff,
+    ).update(pdf_status=PDF_STATUS_PENDING)
+
+
+def render_pending_pdfs(batch_size=None, pdf_workers=None):
+    """
+    Claim and render one batch of pending invoices
+    Returns:
+        tuple: (number rendered, number failed)
+    """
+    from .pdf_workers import render_invoice_pdfs
+
+    if batch_size is None:
+        batch_size = settings.INVOICE_SETTINGS.get('PDF_QUEUE_BATCH_SIZE', 20)
+
+    invoices = claim_pending_invoices(batch_size)
+    if not invoices:
+        return 0, 0
+
+    errors = render_invoice_pdfs(invoices, pdf_workers)
+
+    failed = 0
+    for invoice, error in zip(invoices, errors):
+        # Only while the invoice is still this worker's claim: one edited or
+        # re-queued during the render belongs to its next render
+        claimed = Invoice.objects.filter(
+            pk=invoice.pk,
+            pdf_status=PDF_STATUS_RENDERING,
+            pdf_hash=invoice.pdf_hash,
+            pdf_started_at=invoice.pdf_started_at,
+        )
+        if error is None:
+            # Stored renders are already marked ready; this covers invoices
+            # whose PDF was still current and so was not re-rendered
+            claimed.update(
+                pdf_status=PDF_STATUS_READY,
+                pdf_finished_at=timezone.now(),
+            )
+            continue
+        failed += 1
+        print(f"PDF generation failed for invoice {invoice.invoice_number}: {error}")
+        claimed.update(
+            pdf_status=PDF_STATUS_FAILED,
+            pdf_finished_at=timezone.now(),
+            pdf_error=str(error),
+        )
+
+    return len(invoices) - failed, failed
+
+
+def run_pdf_worker(poll_interval=None, batch_size=None, pdf_workers=None, once=False):
+    """
+    Render pending invoice PDFs until interrupted
+    Args:
+        poll_interval: seconds to sleep when the queue is empty
+        batch_size: invoices claimed per round
+        pdf_workers: process pool size for rendering (see pdf_workers.py)
+        once: drain the queue once and return instead of polling
+    """
+    if poll_interval is None:
+        poll_interval = settings.INVOICE_SETTINGS.get('PDF_QUEUE_POLL_INTERVAL', 1)
+
+    requeue_stale_renders()
+    while True:
+        close_old_connections()
+        rendered, failed = render_pending_pdfs(batch_size, pdf_workers)
+        if rendered or failed:
+            continue
+        if once:
+            return
+        time.sleep(poll_interval)
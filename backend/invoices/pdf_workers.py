@@ -0,0 +1,120 @@
+"""
+Process pool for rendering invoice PDFs in parallel
+"""
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+
+
+_executor = None
+_executor_key = None
+
+
+def get_pdf_workers(pdf_workers=None):
+    """Resolve pool size from an explicit value or INVOICE_SETTINGS['PDF_WORKERS']"""
+    if pdf_workers is None:
+        pdf_workers = settings.INVOICE_SETTINGS.get('PDF_WORKERS', 1)
+    return max(1, int(pdf_workers))
+
+
+def _worker_paths():
+    """
+    Database and media root of this process, for the workers to use
+    Spawned workers read the settings module afresh, so without these they
+    would miss a test database or an overridden MEDIA_ROOT.
+    """
+    from django.db import connections
+    return str(connections['default'].settings_dict['NAME']), str(settings.MEDIA_ROOT)
+
+
+def _init_worker(settings_module, database_name, media_root):
+    """Set up Django once in each worker process"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+    from django.db import connections
+    connections['default'].settings_dict['NAME'] = database_name
+    settings.MEDIA_ROOT = media_root
+
+
+def _render_invoice(invoice_id, claim):
+    """
+    Render and store the PDF for one invoice (runs inside a worker)
+    claim holds the PDF state the caller saw (services.pdf_claim), so the
+    PDF is only stored if the row is still in that state.
+    """
+    from .models import Invoice
+    from .services import generate_invoice_pdf
+
+    invoice = Invoice.objects.get(pk=invoice_id)
+    for name, value in claim.items():
+        setattr(invoice, name, value)
+    generate_invoice_pdf(invoice)
+    return invoice.pdf_file.name, invoice.pdf_hash, invoice.pdf_engine
+
+
+def get_executor(pdf_workers):
+    """Return the shared process pool, recreating it if the size, database or media root changed"""
+    global _executor, _executor_key
+
+    paths = _worker_paths()
+    if _executor is not None and _executor_key == (pdf_workers, paths):
+        return _executor
+
+    shutdown_executor()
+    # spawn gives every worker a clean interpreter, so no DB connection
+    # or file handle from the web process leaks into the pool
+    _executor = ProcessPoolExecutor(
+        max_workers=pdf_workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'invoice_api.settings'),) + paths,
+    )
+    _executor_key = (pdf_workers, paths)
+    return _executor
+
+
+def shutdown_executor():
+    """Stop the shared process pool if it is running"""
+    global _executor, _executor_key
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+    _executor = None
+    _executor_key = None
+
+
+def render_invoice_pdfs(invoices, pdf_workers=None):
+    """
+    Render PDFs for a list of invoices
+    Args:
+        invoices: list of saved Invoice instances (rows must be committed)
+        pdf_workers: pool size, 1 renders serially in this process
+    Returns:
+        list: one error (None on success) per invoice, in input order
+    """
+    from .services import generate_invoice_pdfs, pdf_claim
+
+    pdf_workers = get_pdf_workers(pdf_workers)
+    errors = []
+
+    if pdf_workers == 1 or len(invoices) <= 1:
+        return generate_invoice_pdfs(invoices)
+
+    executor = get_executor(pdf_workers)
+    futures = [
+        executor.submit(_render_invoice, invoice.id, pdf_claim(invoice))
+        for invoice in invoices
+    ]
+
+    for invoice, future in zip(invoices, futures):
+        try:
+            # The worker already saved the file against the row; mirror the
+            # stored name, digest and engine onto our instance instead of re-reading it
+            invoice.pdf_file.name, invoice.pdf_hash, invoice.pdf_engine = future.result()
+            errors.append(None)
+        except Exception as e:
+            errors.append(e)
+
+    return errors
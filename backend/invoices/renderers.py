@@ -0,0 +1,245 @@
+"""
+PDF rendering engines
+- Persistent wkhtmltopdf worker pool for the HTML template path
+- Per-engine latency counters
+"""
+import atexit
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+
+ENGINE_WKHTMLTOPDF = 'wkhtmltopdf'
+ENGINE_REPORTLAB = 'reportlab'
+
+
+# Latency counters (per process)
+_stats_lock = threading.Lock()
+_render_stats = {}
+
+
+def record_render(engine, seconds, failed=False):
+    """Record one render attempt for an engine"""
+    with _stats_lock:
+        stats = _render_stats.setdefault(engine, {
+            'count': 0,
+            'failures': 0,
+            'total_seconds': 0.0,
+            'max_seconds': 0.0,
+        })
+        stats['count'] += 1
+        if failed:
+            stats['failures'] += 1
+        stats['total_seconds'] += seconds
+        stats['max_seconds'] = max(stats['max_seconds'], seconds)
+
+
+def get_render_stats():
+    """Snapshot of the latency counters for every engine used in this process"""
+    with _stats_lock:
+        snapshot = {}
+        for engine, stats in _render_stats.items():
+            snapshot[engine] = {
+                'count': stats['count'],
+                'failures': stats['failures'],
+                'avg_ms': round(stats['total_seconds'] * 1000 / stats['count'], 2),
+                'max_ms': round(stats['max_seconds'] * 1000, 2),
+                'total_seconds': round(stats['total_seconds'], 3),
+            }
+        return snapshot
+
+
+def reset_render_stats():
+    """Clear the latency counters"""
+    with _stats_lock:
+        _render_stats.clear()
+
+
+# wkhtmltopdf availability is probed once per process
+_probe_lock = threading.Lock()
+_probed = False
+_wkhtmltopdf_path = None
+
+
+def get_wkhtmltopdf_path():
+    """Locate the wkhtmltopdf binary through pdfkit (None if unavailable)"""
+    global _probed, _wkhtmltopdf_path
+
+    with _probe_lock:
+        if not _probed:
+            try:
+                import pdfkit
+                configuration = pdfkit.configuration(
+                    wkhtmltopdf=settings.INVOICE_SETTINGS.get('WKHTMLTOPDF_PATH', '')
+                )
+                path = configuration.wkhtmltopdf
+                if isinstance(path, bytes):
+                    path = path.decode()
+                _wkhtmltopdf_path = path or None
+            except (ImportError, OSError):
+                _wkhtmltopdf_path = None
+            _probed = True
+
+    return _wkhtmltopdf_path
+
+
+class WkhtmltopdfWorker:
+    """
+    One long-lived wkhtmltopdf process
+    Runs in --read-args-from-stdin mode, so Qt/WebKit start-up is paid once
+    and each job is a single line of arguments on stdin.
+    """
+
+    def __init__(self, binary, timeout):
+        self.binary = binary
+        self.timeout = timeout
+        self.process = None
+        self.lines = None
+        self.start()
+
+    def start(self):
+        """Start (or restart) the wkhtmltopdf process"""
+        self.close()
+        self.process = subprocess.Popen(
+            [self.binary, '--read-args-from-stdin'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+        # Progress output goes to stderr; a reader thread lets us wait on it with a timeout
+        self.lines = queue.Queue()
+        threading.Thread(target=self._pump, args=(self.process, self.lines), daemon=True).start()
+
+    @staticmethod
+    def _pump(process, lines):
+        for line in process.stderr:
+            lines.put(line)
+        lines.put(None)
+
+    def render(self, html):
+        """Render one HTML document, returning the PDF bytes"""
+        if self.process.poll() is not None:
+            self.start()
+
+        with tempfile.TemporaryDirectory(prefix='invoice-pdf-') as tmp_dir:
+            source = os.path.join(tmp_dir, 'invoice.html')
+            target = os.path.join(tmp_dir, 'invoice.pdf')
+            with open(source, 'w', encoding='utf-8') as f:
+                f.write(html)
+
+            try:
+                self.process.stdin.write(f'--encoding utf-8 "{source}" "{target}"\n')
+                self.process.stdin.flush()
+                self._wait_for_job()
+            except Exception:
+                # Leave no half-finished job behind for the next caller
+                self.start()
+                raise
+
+            if not os.path.exists(target) or os.path.getsize(target) == 0:
+                raise RuntimeError('wkhtmltopdf produced no output')
+            with open(target, 'rb') as f:
+                return f.read()
+
+    def _wait_for_job(self):
+        """Consume progress lines until wkhtmltopdf reports the job finished"""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f'wkhtmltopdf did not finish within {self.timeout}s')
+            try:
+                line = self.lines.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            if line is None:
+                raise RuntimeError('wkhtmltopdf exited unexpectedly')
+            line = line.strip()
+            if line.startswith('Done'):
+                return
+            if line.startswith('Exit with code'):
+                # Non-fatal load errors still leave a usable PDF behind
+                return
+
+    def close(self):
+        """Stop the wkhtmltopdf process"""
+        if self.process is not None and self.process.poll() is None:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=5)
+            except Exception:
+                self.process.kill()
+        self.process = None
+
+
+class WkhtmltopdfPool:
+    """Fixed set of warm wkhtmltopdf workers shared by all threads of a process"""
+
+    def __init__(self, binary, size=2, timeout=30):
+        self.size = size
+        self._idle = queue.Queue()
+        self._workers = []
+        for _ in range(size):
+            worker = WkhtmltopdfWorker(binary, timeout)
+            self._workers.append(worker)
+            self._idle.put(worker)
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix='wkhtmltopdf')
+
+    def render(self, html):
+        """Render one HTML document on the next free worker"""
+        worker = self._idle.get()
+        try:
+            return worker.render(html)
+        finally:
+            self._idle.put(worker)
+
+    def render_many(self, html_documents):
+        """
+        Render a batch of HTML documents across all workers
+        Returns:
+            list: PDF bytes or the raised exception, in input order
+        """
+        futures = [self._executor.submit(self.render, html) for html in html_documents]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def close(self):
+        """Stop every worker"""
+        self._executor.shutdown(wait=True)
+        for worker in self._workers:
+            worker.close()
+
+
+_pool_lock = threading.Lock()
+_pool = None
+
+
+def get_wkhtmltopdf_pool():
+    """Return the process-wide wkhtmltopdf pool, or None if the binary is unavailable"""
+    global _pool
+
+    binary = get_wkhtmltopdf_path()
+    if binary is None:
+        return None
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = WkhtmltopdfPool(
+                binary,
+                size=settings.INVOICE_SETTINGS.get('WKHTMLTOPDF_WORKERS', 2),
+                timeout=settings.INVOICE_SETTINGS.get('WKHTMLTOPDF_TIMEOUT', 30),
+            )
+            atexit.register(_pool.close)
+        return _pool
@@ -0,0 +1,185 @@
+"""
+Row sources for bulk uploads
+Each source reads one upload format incrementally and yields
+(row_number, row) pairs, so BulkInvoiceProcessor runs the same validation,
+fingerprinting and batching pipeline whatever the file type:
+
+- CSV: product columns are comma-packed strings
+- XLSX: the first worksheet, read in openpyxl's streaming read-only mode
+- JSON Lines: one object per line; product columns may be native arrays,
+  which are used as they are instead of being split on commas. A line that
+  is not a JSON object is yielded as a RowError, so it fails on its own
+  like a row that fails validation instead of aborting the upload
+"""
+import csv
+import io
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+
+# File extension -> upload format
+UPLOAD_FORMATS = {
+    '.csv': 'csv',
+    '.xlsx': 'xlsx',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+}
+
+
+def detect_format(name):
+    """Upload format from a file name, None if the extension is not supported"""
+    name = (name or '').lower()
+    for extension, file_format in UPLOAD_FORMATS.items():
+        if name.endswith(extension):
+            return file_format
+    return None
+
+
+def clean_value(value):
+    """
+    Normalise one cell to what the row validator expects
+    Strings are stripped, numbers and dates become their text (a whole
+    number stored as a float in a spreadsheet loses its '.0'), and lists
+    become lists of cleaned strings. Anything else is left for the
+    validator to reject.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, (int, float, Decimal)):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.date().isoformat() if value.time() == datetime.min.time() else value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return [clean_value(item) for item in value]
+    return value
+
+
+class RowError:
+    """A row that could not be read; yielded in place of the row's dict"""
+
+    def __init__(self, message):
+        self.message = message
+        # Nothing readable to copy into the failure report
+        self.data = {}
+
+    def __str__(self):
+        return self.message
+
+
+def clean_row(row):
+    """Lower-case, stripped column names with cleaned values (unnamed columns are dropped)"""
+    return {
+        key.strip().lower(): clean_value(value)
+        for key, value in row.items()
+        if isinstance(key, str) and key.strip()
+    }
+
+
+class CSVRowSource:
+    """CSV decoded chunk by chunk (utf-8-sig handles a BOM)"""
+
+    def __init__(self, file):
+        self.stream = io.TextIOWrapper(getattr(file, 'file', file), encoding='utf-8-sig', newline='')
+        self.reader = csv.DictReader(self.stream)
+
+    @property
+    def fieldnames(self):
+        return self.reader.fieldnames
+
+    def __iter__(self):
+        row_number = 1
+        for row in self.reader:
+            row_number += 1
+            yield row_number, row
+
+    def close(self):
+        # Hand the file back to its owner instead of closing it with the wrapper
+        self.stream.detach()
+
+
+class JSONLinesRowSource:
+    """One JSON object per line; rows are numbered by line and blank lines are skipped"""
+
+    # No header: missing keys are reported per row by the validator
+    fieldnames = None
+
+    def __init__(self, file):
+        self.stream = io.TextIOWrapper(getattr(file, 'file', file), encoding='utf-8-sig')
+
+    def __iter__(self):
+        for row_number, line in enumerate(self.stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield row_number, RowError(f"Line {row_number} is not valid JSON: {e}")
+                continue
+            if not isinstance(row, dict):
+                yield row_number, RowError(f"Line {row_number} is not a JSON object")
+                continue
+            yield row_number, row
+
+    def close(self):
+        self.stream.detach()
+
+
+class XLSXRowSource:
+    """First worksheet of a workbook; the first row holds the column names"""
+
+    def __init__(self, file):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ValueError("XLSX uploads need openpyxl installed (pip install openpyxl)")
+
+        try:
+            # read_only streams rows from the archive instead of loading every cell
+            self.workbook = load_workbook(getattr(file, 'file', file), read_only=True, data_only=True)
+        except Exception as e:
+            raise ValueError(f"Could not read XLSX file: {e}")
+        self.rows = self.workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(self.rows, ())
+        self.fieldnames = [clean_value(name) for name in header]
+
+    def __iter__(self):
+        for row_number, values in enumerate(self.rows, start=2):
+            # Skip empty rows, like csv.DictReader skips blank lines
+            if all(value is None or value == '' for value in values):
+                continue
+            yield row_number, {
+                name: values[index] if index < len(values) else None
+                for index, name in enumerate(self.fieldnames)
+            }
+
+    def close(self):
+        self.workbook.close()
+
+
+ROW_SOURCES = {
+    'csv': CSVRowSource,
+    'xlsx': XLSXRowSource,
+    'jsonl': JSONLinesRowSource,
+}
+
+
+def open_row_source(file, file_format=None):
+    """
+    Open the row source for an upload
+    Args:
+        file: uploaded or stored file, opened in binary mode
+        file_format: 'csv', 'xlsx' or 'jsonl'; detected from the file name
+            when omitted (files without a recognised name are read as CSV)
+    """
+    if file_format is None:
+        file_format = detect_format(getattr(file, 'name', '')) or 'csv'
+    return ROW_SOURCES[file_format](file)
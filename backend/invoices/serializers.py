@@ -1,6 +1,7 @@
 from rest_framework import serializers
-from .models import BusinessProfile, Invoice, InvoiceItem, InvoiceNumberSequence, INDIAN_STATES
+from .models import BusinessProfile, Invoice, InvoiceItem, InvoiceNumberSequence, NotificationOutbox, INDIAN_STATES
 from django.conf import settings
+from django.db import transaction
 from decimal import Decimal
 from datetime import date
 
@@ -78,12 +79,13 @@ class InvoiceSerializer(serializers.ModelSerializer):
             'buyer_state', 'buyer_state_name', 'buyer_phone', 'buyer_email',
             'subtotal', 'cgst', 'sgst', 'igst', 'total', 'gst_rate',
             'is_interstate', 'notes', 'payment_terms',
-            'pdf_url', 'pdf_file', 'items',
-            'is_draft', 'created_at', 'updated_at'
+            'pdf_url', 'pdf_file', 'pdf_status', 'pdf_error', 'pdf_finished_at', 'items',
+            'is_draft', 'bulk_batch_id', 'created_at', 'updated_at'
         ]
         read_only_fields = [
             'id', 'invoice_number', 'cgst', 'sgst', 'igst', 'total',
-            'is_interstate', 'pdf_url', 'pdf_file', 'created_at', 'updated_at'
+            'is_interstate', 'pdf_url', 'pdf_file', 'pdf_status', 'pdf_error',
+            'pdf_finished_at', 'bulk_batch_id', 'created_at', 'updated_at'
         ]
 
     def get_state_name(self, obj):
@@ -132,35 +134,6 @@ class InvoiceSerializer(serializers.ModelSerializer):
         """Create invoice with items and generate invoice number"""
         items_data = validated_data.pop('items')
 
-        # Generate invoice number
-        invoice_type = validated_data['invoice_type']
-        user_id = validated_data['user_id']
-
-        if invoice_type == 'topmate':
-            # Get or create Topmate sequence
-            sequence, _ = InvoiceNumberSequence.objects.get_or_create(
-                sequence_type='topmate',
-                user_id=None,
-                defaults={'current_number': 0}
-            )
-            prefix = settings.INVOICE_SETTINGS['TOPMATE_INVOICE_PREFIX']
-            number = sequence.get_next_number()
-            invoice_number = f"{prefix}-{number:06d}"
-        else:
-            # Get or create user-specific sequence
-            sequence, _ = InvoiceNumberSequence.objects.get_or_create(
-                sequence_type='user',
-                user_id=user_id,
-                defaults={'current_number': 0}
-            )
-            # Create a hash of user_id to keep invoice number clean
-            import hashlib
-            user_hash = hashlib.md5(user_id.encode()).hexdigest()[:6].upper()
-            number = sequence.get_next_number()
-            invoice_number = f"INV-{user_hash}-{number:04d}"
-
-        validated_data['invoice_number'] = invoice_number
-
         # Get GST rate first (needed for price extraction)
         gst_rate_percent = validated_data.get('gst_rate', Decimal(str(settings.INVOICE_SETTINGS['GST_RATE'])))
         gst_rate = gst_rate_percent / 100
@@ -203,13 +176,20 @@ class InvoiceSerializer(serializers.ModelSerializer):
             subtotal + validated_data['cgst'] + validated_data['sgst'] + validated_data['igst']
         ).quantize(Decimal('0.01'))
 
-        # Create invoice with all calculated fields
-        invoice = Invoice.objects.create(**validated_data)
+        # Number the invoice and write it in one transaction: the sequence row
+        # stays locked until commit, and a failed insert returns the number
+        with transaction.atomic():
+            validated_data['invoice_number'] = InvoiceNumberSequence.reserve_invoice_numbers(
+                validated_data['invoice_type'], validated_data['user_id']
+            )[0]
 
-        # Create items
-        for idx, item_data in enumerate(items_data, start=1):
-            item_data['serial_number'] = idx
-            InvoiceItem.objects.create(invoice=invoice, **item_data)
+            # Create invoice with all calculated fields
+            invoice = Invoice.objects.create(**validated_data)
+
+            # Create items
+            for idx, item_data in enumerate(items_data, start=1):
+                item_data['serial_number'] = idx
+                InvoiceItem.objects.create(invoice=invoice, **item_data)
 
         return invoice
 
@@ -345,3 +325,23 @@ class InvoiceListSerializer(serializers.ModelSerializer):
 
     def get_item_count(self, obj):
         return obj.items.count()
+
+
+class NotificationOutboxSerializer(serializers.ModelSerializer):
+    """Delivery state of a queued email or WhatsApp message"""
+    invoice_number = serializers.CharField(source='invoice.invoice_number', read_only=True)
+    delivery_state = serializers.SerializerMethodField()
+
+    class Meta:
+        model = NotificationOutbox
+        fields = [
+            'id', 'invoice', 'invoice_number', 'channel', 'recipient', 'status', 'attempts',
+            'next_attempt_at', 'last_error', 'provider_message_id', 'provider_status', 'provider_error_code',
+            'provider_status_at', 'delivery_state', 'created_at', 'delivered_at', 'updated_at'
+        ]
+        read_only_fields = fields
+
+    def get_delivery_state(self, obj):
+        """The provider's latest report (WhatsApp), else the outbox status"""
+        from .delivery_status import delivery_state
+        return delivery_state(obj.status, obj.provider_status)
@@ -4,25 +4,460 @@ Invoice PDF Generation Service
 from django.template.loader import render_to_string
 from django.core.files.base import ContentFile
 from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from collections import OrderedDict
+from functools import lru_cache
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import cm
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Table, TableStyle
+from .models import Invoice, PDF_STATUS_READY
+from .renderers import (
+    ENGINE_WKHTMLTOPDF,
+    ENGINE_REPORTLAB,
+    get_wkhtmltopdf_pool,
+    record_render,
+)
+import hashlib
 import os
+import threading
+import time
+
+
+# Bump whenever the PDF layout changes so cached PDFs are re-rendered
+PDF_LAYOUT_VERSION = 2
+
+# Invoice fields that appear on the rendered PDF (reportlab or HTML template)
+PDF_INVOICE_FIELDS = [
+    'invoice_number', 'invoice_date', 'due_date', 'created_at',
+    'seller_name', 'seller_gstin', 'seller_address', 'seller_pincode',
+    'seller_state', 'seller_phone', 'seller_email',
+    'buyer_name', 'buyer_gstin', 'buyer_address', 'buyer_pincode',
+    'buyer_state', 'buyer_phone', 'buyer_email',
+    'subtotal', 'cgst', 'sgst', 'igst', 'total', 'gst_rate',
+    'is_interstate', 'notes',
+]
+
+PDF_ITEM_FIELDS = ['serial_number', 'description', 'hsn_sac', 'quantity', 'unit_price', 'amount']
+
+# Chunk size used when streaming PDFs to the client
+PDF_STREAM_CHUNK_SIZE = 64 * 1024
+
+# Merged PDFs larger than this are spooled to disk while they are sent
+MERGED_PDF_SPOOL_SIZE = 1024 * 1024
+
+# Static page geometry for the reportlab layout
+PAGE_WIDTH, PAGE_HEIGHT = A4
+PAGE_MARGIN = 1.2*cm
+BOX_TOP = PAGE_HEIGHT - 5*cm
+BOX_HEIGHT = 6.5*cm  # Increased height for bank details
+BOX_WIDTH = (PAGE_WIDTH - 2*PAGE_MARGIN) / 2 - 0.4*cm
+BUYER_BOX_X = PAGE_MARGIN + (PAGE_WIDTH - 2*PAGE_MARGIN) / 2 + 0.4*cm
+# Where the bank details block is drawn in its form; placed per invoice by translation
+BANK_DETAILS_Y = BOX_TOP - 4.15*cm
+
+ITEM_TABLE_HEADER = ['#', 'Description', 'HSN/SAC', 'Qty', 'Rate', 'Amount']
+ITEM_TABLE_COL_WIDTHS = [1.2*cm, 7.5*cm, 2.5*cm, 1.8*cm, 2.8*cm, 2.8*cm]
+ITEM_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2D3748')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('ALIGN', (1, 1), (1, -1), 'LEFT'),
+    ('ALIGN', (4, 1), (5, -1), 'RIGHT'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 11),
+    ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 1), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 14),
+    ('TOPPADDING', (0, 1), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 1), (-1, -1), 10),
+    ('GRID', (0, 0), (-1, -1), 0.75, colors.HexColor('#A0AEC0')),
+    ('BOX', (0, 0), (-1, -1), 1.5, colors.HexColor('#2D3748')),
+])
+
+# Names of the reusable form XObjects holding the static page layers
+FORM_LETTERHEAD = 'invoiceLetterhead'
+FORM_BANK_DETAILS = 'invoiceBankDetails'
+FORM_FOOTER = 'invoiceFooter'
+
+
+def compute_pdf_hash(invoice):
+    """
+    Compute a stable digest over everything that reaches the invoice PDF
+    Args:
+        invoice: Invoice model instance
+    Returns:
+        str: hex SHA-256 digest
+    """
+    digest = hashlib.sha256()
+
+    def update(value):
+        # Separator keeps ('ab', 'c') and ('a', 'bc') from colliding
+        digest.update(str(value).encode('utf-8'))
+        digest.update(b'\x1f')
+
+    update(PDF_LAYOUT_VERSION)
+    for key in ('CGST_RATE', 'SGST_RATE', 'IGST_RATE'):
+        update(settings.INVOICE_SETTINGS.get(key))
+
+    for field in PDF_INVOICE_FIELDS:
+        value = getattr(invoice, field)
+        if field == 'created_at' and value is not None:
+            value = value.date()
+        update(value)
+
+    for item in invoice.items.all().order_by('serial_number').values_list(*PDF_ITEM_FIELDS):
+        for value in item:
+            update(value)
+        digest.update(b'\x1e')
+
+    return digest.hexdigest()
+
 
+def is_pdf_current(invoice, pdf_hash=None):
+    """Check whether the stored PDF was rendered from the current invoice data"""
+    if not invoice.pdf_file or not invoice.pdf_hash:
+        return False
+    if pdf_hash is None:
+        pdf_hash = compute_pdf_hash(invoice)
+    if invoice.pdf_hash != pdf_hash:
+        return False
+    return invoice.pdf_file.storage.exists(invoice.pdf_file.name)
 
-def generate_invoice_pdf(invoice):
+
+class PdfCache:
+    """
+    Bounded LRU of recent PDF bytes, keyed on (invoice number, content hash)
+    A re-rendered invoice gets a new hash, so a stale entry is never served;
+    it just ages out.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Cached bytes for key, or None"""
+        with self._lock:
+            content = self._entries.get(key)
+            if content is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return content
+
+    def put(self, key, content):
+        """Cache bytes for key, evicting the least recently used entries"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = content
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+_pdf_cache_lock = threading.Lock()
+_pdf_cache = None
+
+
+def get_pdf_cache():
+    """Return the process-wide PDF bytes cache, sized by INVOICE_SETTINGS['PDF_CACHE_SIZE']"""
+    global _pdf_cache
+
+    with _pdf_cache_lock:
+        if _pdf_cache is None:
+            _pdf_cache = PdfCache(settings.INVOICE_SETTINGS.get('PDF_CACHE_SIZE', 32))
+        return _pdf_cache
+
+
+def get_invoice_pdf_bytes(invoice):
+    """
+    Bytes of an invoice's stored PDF, from the cache when this process sent
+    them recently, otherwise read from storage (and cached)
+    Args:
+        invoice: Invoice with a generated pdf_file
+    Returns:
+        bytes: PDF content
+    """
+    cache = get_pdf_cache()
+    # Without a content hash there is nothing to tell a stale entry apart
+    key = (invoice.invoice_number, invoice.pdf_hash) if invoice.pdf_hash else None
+    if key is not None:
+        content = cache.get(key)
+        if content is not None:
+            return content
+
+    with invoice.pdf_file.open('rb') as pdf:
+        content = pdf.read()
+    if key is not None:
+        cache.put(key, content)
+    return content
+
+
+# Columns a render is stored against; the start time tells two claims of an
+# invoice apart even when neither has a digest yet
+PDF_CLAIM_FIELDS = ('pdf_status', 'pdf_hash', 'pdf_started_at')
+
+
+def pdf_claim(invoice):
+    """The PDF_CLAIM_FIELDS values of an invoice instance"""
+    return {name: getattr(invoice, name) for name in PDF_CLAIM_FIELDS}
+
+
+def _save_pdf(invoice, pdf_content, pdf_hash, engine):
+    """
+    Store rendered PDF bytes, replacing the previous file instead of suffixing
+    The row is only updated if its PDF_CLAIM_FIELDS still hold what the
+    rendered instance read (for a queued render: 'rendering', with the digest
+    and start time of this worker's claim). An invoice edited or re-queued
+    during the render keeps its new state and the stale render is dropped.
+    Returns:
+        bool: whether the PDF was stored
+    """
+    filename = f"{invoice.invoice_number}.pdf"
+    now = timezone.now()
+    fields = {
+        'pdf_hash': pdf_hash,
+        'pdf_engine': engine,
+        'pdf_status': PDF_STATUS_READY,
+        'pdf_finished_at': now,
+        'pdf_error': '',
+    }
+
+    with transaction.atomic():
+        # Only the PDF columns: a background render must not undo concurrent edits
+        claimed = Invoice.objects.filter(pk=invoice.pk, **pdf_claim(invoice))
+        if not claimed.update(updated_at=now, **fields):
+            return False
+
+        # The row stays locked until the file is in place
+        if invoice.pdf_file:
+            invoice.pdf_file.delete(save=False)
+        invoice.pdf_file.save(filename, ContentFile(pdf_content), save=False)
+        Invoice.objects.filter(pk=invoice.pk).update(pdf_file=invoice.pdf_file.name)
+
+    for name, value in fields.items():
+        setattr(invoice, name, value)
+    invoice.updated_at = now
+    return True
+
+
+def generate_invoice_pdf(invoice, force=False):
     """
     Generate PDF for an invoice using HTML template
+    Skips rendering when the stored PDF already matches the invoice content
     Args:
         invoice: Invoice model instance
+        force: Re-render even if the content hash is unchanged
     Returns:
         str: Path to generated PDF file
     """
-    try:
-        # Try importing pdfkit (requires wkhtmltopdf)
-        import pdfkit
-        use_pdfkit = True
-    except (ImportError, OSError):
-        # Fallback to reportlab if pdfkit not available
-        use_pdfkit = False
+    pdf_hash = compute_pdf_hash(invoice)
+    if not force and is_pdf_current(invoice, pdf_hash):
+        return invoice.pdf_file.path
+
+    # Save PDF to model
+    pdf_content, engine = _render_invoice_pdf(invoice)
+    _save_pdf(invoice, pdf_content, pdf_hash, engine)
+
+    return invoice.pdf_file.path
+
+
+def generate_invoice_pdfs(invoices, force=False):
+    """
+    Generate PDFs for a batch of invoices
+    When wkhtmltopdf is available the batch's HTML is fed to the warm worker
+    pool in one go; database work stays on the calling thread.
+    Args:
+        invoices: list of Invoice instances
+        force: Re-render even if the content hash is unchanged
+    Returns:
+        list: one error (None on success) per invoice, in input order
+    """
+    errors = [None] * len(invoices)
+    pending = []
+
+    for index, invoice in enumerate(invoices):
+        try:
+            pdf_hash = compute_pdf_hash(invoice)
+            if force or not is_pdf_current(invoice, pdf_hash):
+                pending.append((index, invoice, pdf_hash))
+        except Exception as e:
+            errors[index] = e
+
+    pool = get_wkhtmltopdf_pool()
+    rendered = {}
+    if pool is not None and pending:
+        html_documents = []
+        for _, invoice, _ in pending:
+            html_documents.append(_render_invoice_html(invoice))
+
+        start = time.perf_counter()
+        results = pool.render_many(html_documents)
+        # Latency per invoice is approximated by the batch's wall time share
+        share = (time.perf_counter() - start) / len(results)
+        for (index, invoice, _), result in zip(pending, results):
+            if isinstance(result, Exception):
+                record_render(ENGINE_WKHTMLTOPDF, share, failed=True)
+                print(f"pdfkit error: {result}")
+            else:
+                record_render(ENGINE_WKHTMLTOPDF, share)
+                rendered[index] = (result, ENGINE_WKHTMLTOPDF)
+
+    for index, invoice, pdf_hash in pending:
+        try:
+            if index in rendered:
+                pdf_content, engine = rendered.pop(index)
+            else:
+                pdf_content, engine = _render_reportlab_timed(invoice)
+            _save_pdf(invoice, pdf_content, pdf_hash, engine)
+        except Exception as e:
+            errors[index] = e
+
+    return errors
+
+
+def stream_invoice_pdf(invoice, persist=True, chunk_size=PDF_STREAM_CHUNK_SIZE):
+    """
+    Render an invoice PDF for a streamed response, skipping the
+    write-to-storage-then-reopen round trip
+    Args:
+        invoice: Invoice model instance
+        persist: Also store the rendered bytes once they have been sent
+        chunk_size: Size of each yielded chunk
+    Returns:
+        tuple: (content length, iterator over PDF byte chunks)
+    """
+    pdf_hash = compute_pdf_hash(invoice) if persist else None
+    pdf_content, engine = _render_invoice_pdf(invoice)
+
+    def chunks():
+        try:
+            for start in range(0, len(pdf_content), chunk_size):
+                yield pdf_content[start:start + chunk_size]
+        finally:
+            # Runs after the last chunk (or on client disconnect) so storage
+            # never delays the first byte
+            if persist:
+                try:
+                    _save_pdf(invoice, pdf_content, pdf_hash, engine)
+                except Exception as e:
+                    print(f"Failed to persist streamed PDF {invoice.invoice_number}: {e}")
+
+    return len(pdf_content), chunks()
+
+
+class _ZipStreamBuffer:
+    """Write-only file object that collects zipfile output for a generator"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+
+def stream_invoice_pdf_zip(invoices, chunk_size=PDF_STREAM_CHUNK_SIZE):
+    """
+    Build a ZIP of invoice PDFs incrementally
+    Stored PDFs are copied from storage chunk by chunk; missing or stale ones
+    are rendered on the fly and persisted. Memory use is bounded by a single
+    PDF, however many invoices are included.
+    Args:
+        invoices: iterable of Invoice instances (e.g. queryset.iterator())
+        chunk_size: Size of the chunks copied from storage
+    Yields:
+        bytes: ZIP archive data
+    """
+    import zipfile
+
+    buffer = _ZipStreamBuffer()
+
+    # PDF page streams are already compressed, deflating them again only costs CPU
+    with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for invoice in invoices:
+            arcname = f"{invoice.invoice_number}.pdf"
+            pdf_hash = compute_pdf_hash(invoice)
+
+            if is_pdf_current(invoice, pdf_hash):
+                with archive.open(arcname, mode='w') as dest, invoice.pdf_file.open('rb') as src:
+                    while True:
+                        chunk = src.read(chunk_size)
+                        if not chunk:
+                            break
+                        dest.write(chunk)
+                        yield from buffer.drain()
+            else:
+                pdf_content, engine = _render_invoice_pdf(invoice)
+                archive.writestr(arcname, pdf_content)
+                yield from buffer.drain()
+                _save_pdf(invoice, pdf_content, pdf_hash, engine)
+
+    # Central directory is written on close
+    yield from buffer.drain()
+
+
+def render_invoice_pdf(invoice):
+    """
+    Render an invoice PDF in memory without touching storage
+    Args:
+        invoice: Invoice model instance
+    Returns:
+        bytes: PDF document
+    """
+    return _render_invoice_pdf(invoice)[0]
 
+
+def _render_invoice_pdf(invoice):
+    """
+    Render an invoice PDF, preferring the wkhtmltopdf pool over reportlab
+    Returns:
+        tuple: (PDF bytes, name of the engine that rendered it)
+    """
+    # Availability of wkhtmltopdf is probed once per process
+    pool = get_wkhtmltopdf_pool()
+
+    if pool is not None:
+        html_string = _render_invoice_html(invoice)
+        start = time.perf_counter()
+        try:
+            pdf_content = pool.render(html_string)
+            record_render(ENGINE_WKHTMLTOPDF, time.perf_counter() - start)
+            return pdf_content, ENGINE_WKHTMLTOPDF
+        except Exception as e:
+            record_render(ENGINE_WKHTMLTOPDF, time.perf_counter() - start, failed=True)
+            print(f"pdfkit error: {e}")
+            # Fall through to reportlab
+
+    return _render_reportlab_timed(invoice)
+
+
+def _render_invoice_html(invoice):
+    """Render the HTML invoice template used by the wkhtmltopdf path"""
     # Prepare context data
     context = {
         'invoice': invoice,
@@ -30,36 +465,154 @@ def generate_invoice_pdf(invoice):
         'settings': settings.INVOICE_SETTINGS,
     }
 
-    # Render HTML template
-    html_string = render_to_string('invoices/invoice_template.html', context)
+    return render_to_string('invoices/invoice_template.html', context)
 
-    if use_pdfkit:
-        # Generate PDF using pdfkit
-        try:
-            pdf_content = pdfkit.from_string(html_string, False)
-            filename = f"{invoice.invoice_number}.pdf"
 
-            # Save PDF to model
-            invoice.pdf_file.save(filename, ContentFile(pdf_content), save=True)
+def _render_reportlab_timed(invoice):
+    """Render with reportlab, recording its latency"""
+    start = time.perf_counter()
+    try:
+        pdf_content = _render_reportlab(invoice)
+    except Exception:
+        record_render(ENGINE_REPORTLAB, time.perf_counter() - start, failed=True)
+        raise
+    record_render(ENGINE_REPORTLAB, time.perf_counter() - start)
+    return pdf_content, ENGINE_REPORTLAB
 
-            return invoice.pdf_file.path
-        except Exception as e:
-            print(f"pdfkit error: {e}")
-            # Fall through to reportlab
 
-    # Fallback: Generate professional PDF using reportlab
-    from reportlab.lib.pagesizes import letter, A4
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.units import inch, cm
-    from reportlab.lib import colors
-    from reportlab.platypus import Table, TableStyle
-    from io import BytesIO
-    from decimal import Decimal
+def _render_reportlab(invoice):
+    """Generate professional PDF using reportlab"""
+    # No output file: the finished document is taken with getpdfdata()
+    p = canvas.Canvas(None, pagesize=A4)
+    _draw_invoice(p, invoice)
 
-    buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
-    margin = 1.2*cm
+    return p.getpdfdata()
+
+
+def render_merged_invoice_pdf(invoices, output=None):
+    """
+    Render many invoices into one PDF document, page after page
+    Uses a single reportlab canvas so fonts and resources are shared instead
+    of building a separate document per invoice. Each invoice's pages are
+    finalised and compressed as soon as it is drawn, and invoices are pulled
+    from the iterable one at a time. reportlab still assembles the finished
+    document in memory, so callers should bound the number of invoices.
+    Args:
+        invoices: iterable of Invoice instances (e.g. queryset.iterator())
+        output: binary file to write the document to (default: return it)
+    Returns:
+        bytes: PDF document, None when written to output
+    """
+    p = canvas.Canvas(output, pagesize=A4, pageCompression=1)
+    # Static layers are written once and referenced from every invoice
+    _ensure_static_forms(p)
+    for invoice in invoices:
+        _draw_invoice(p, invoice)
+
+    if output is None:
+        return p.getpdfdata()
+    p.save()
+    return None
+
+
+def _iter_invoice_items(invoice):
+    """Iterate invoice items in serial order, using prefetched rows when present"""
+    prefetched = getattr(invoice, '_prefetched_objects_cache', {})
+    if 'items' in prefetched:
+        return iter(prefetched['items'])
+    return invoice.items.order_by('serial_number').iterator(chunk_size=500)
+
+
+@lru_cache(maxsize=None)
+def _item_row_heights():
+    """Header and single-line row heights of the items table (measured once per process)"""
+    sample = Table([ITEM_TABLE_HEADER, ['1', 'x', 'x', '1', 'x', 'x']], colWidths=ITEM_TABLE_COL_WIDTHS)
+    sample.setStyle(ITEM_TABLE_STYLE)
+    sample.wrap(PAGE_WIDTH, PAGE_HEIGHT)
+    return sample._rowHeights[0], sample._rowHeights[1]
+
+
+def _draw_letterhead(p):
+    """Header band, title and the empty seller/buyer boxes"""
+    p.setFillColorRGB(0.2, 0.2, 0.2)
+    p.rect(PAGE_MARGIN, PAGE_HEIGHT - 3.5*cm, PAGE_WIDTH - 2*PAGE_MARGIN, 2.5*cm, fill=1, stroke=0)
+    p.setFillColorRGB(1, 1, 1)
+    p.setFont("Helvetica-Bold", 26)
+    p.drawString(PAGE_MARGIN + 0.7*cm, PAGE_HEIGHT - 2.2*cm, "TAX INVOICE")
+
+    p.setStrokeColorRGB(0.7, 0.7, 0.7)
+    p.setLineWidth(1)
+    p.rect(PAGE_MARGIN, BOX_TOP - BOX_HEIGHT, BOX_WIDTH, BOX_HEIGHT, stroke=1, fill=0)
+    p.rect(BUYER_BOX_X, BOX_TOP - BOX_HEIGHT, BOX_WIDTH, BOX_HEIGHT, stroke=1, fill=0)
+
+    p.setFillColorRGB(0, 0, 0)
+    p.setFont("Helvetica-Bold", 11)
+    p.drawString(PAGE_MARGIN + 0.6*cm, BOX_TOP - 0.7*cm, "SELLER DETAILS")
+    p.drawString(BUYER_BOX_X + 0.6*cm, BOX_TOP - 0.7*cm, "BUYER DETAILS")
+
+
+def _draw_bank_details(p):
+    """Bank details block inside the seller box"""
+    x = PAGE_MARGIN + 0.6*cm
+    p.setFillColorRGB(0, 0, 0)
+    p.setFont("Helvetica-Bold", 10)
+    p.drawString(x, BANK_DETAILS_Y, "BANK DETAILS")
+    p.setFont("Helvetica", 8)
+    p.drawString(x, BANK_DETAILS_Y - 0.5*cm, "Bank: HDFC Bank")
+    p.drawString(x, BANK_DETAILS_Y - 0.9*cm, "A/c: 50200012345678")
+    p.drawString(x, BANK_DETAILS_Y - 1.3*cm, "IFSC: HDFC0001234")
+
+
+def _draw_footer(p):
+    """Computer-generated notice and thank-you line"""
+    p.setFont("Helvetica-Oblique", 9)
+    p.setFillColorRGB(0.4, 0.4, 0.4)
+    p.drawString(PAGE_MARGIN, 2.5*cm, "This is a computer-generated invoice and does not require a signature.")
+
+    p.setFont("Helvetica-Bold", 10)
+    p.setFillColorRGB(0.2, 0.4, 0.7)
+    thank_you_text = "Thank you for your business!"
+    text_width = p.stringWidth(thank_you_text, "Helvetica-Bold", 10)
+    p.drawString((PAGE_WIDTH - text_width) / 2, 1.2*cm, thank_you_text)
+
+
+STATIC_FORMS = {
+    FORM_LETTERHEAD: _draw_letterhead,
+    FORM_BANK_DETAILS: _draw_bank_details,
+    FORM_FOOTER: _draw_footer,
+}
+
+
+def _ensure_static_forms(p):
+    """
+    Define the static page layers as form XObjects on this canvas
+    Forms belong to a PDF document, so they pay off on canvases holding many
+    invoices: each layer is written once and every invoice only references it.
+    """
+    if getattr(p, '_invoice_static_forms', False):
+        return
+    for name, draw in STATIC_FORMS.items():
+        p.beginForm(name)
+        draw(p)
+        p.endForm()
+    p._invoice_static_forms = True
+
+
+def _draw_static_layer(p, name):
+    """Draw a static layer, referencing its form when the canvas defines one"""
+    if getattr(p, '_invoice_static_forms', False):
+        p.doForm(name)
+    else:
+        # A single invoice uses each layer once, where a form is pure overhead
+        p.saveState()
+        STATIC_FORMS[name](p)
+        p.restoreState()
+
+
+def _draw_invoice(p, invoice):
+    """Draw one invoice onto a reportlab canvas, finishing its last page"""
+    width, height = PAGE_WIDTH, PAGE_HEIGHT
+    margin = PAGE_MARGIN
 
     # Helper function to format currency (avoiding Unicode rupee symbol)
     def format_currency(amount):
@@ -77,26 +630,20 @@ def generate_invoice_pdf(invoice):
         else:
             p.drawString(x, y, str(text))
 
-    # Header - INVOICE title and number
-    p.setFillColorRGB(0.2, 0.2, 0.2)
-    p.rect(margin, height - 3.5*cm, width - 2*margin, 2.5*cm, fill=1, stroke=0)
+    # Header band, title and box outlines (static letterhead layer)
+    _draw_static_layer(p, FORM_LETTERHEAD)
+
+    # Invoice number and date
     p.setFillColorRGB(1, 1, 1)
-    draw_text(margin + 0.7*cm, height - 2.2*cm, "TAX INVOICE", "Helvetica", 26, bold=True)
     draw_text(width - margin - 8*cm, height - 2*cm, f"Invoice #: {invoice.invoice_number}", "Helvetica", 13, bold=True)
     draw_text(width - margin - 8*cm, height - 2.7*cm, f"Date: {invoice.invoice_date.strftime('%d/%m/%Y')}", "Helvetica", 11)
 
     p.setFillColorRGB(0, 0, 0)
 
     # Seller and Buyer boxes
-    y_pos = height - 5*cm
-    box_height = 6.5*cm  # Increased height for bank details
-
-    # Seller box (with bank details)
-    p.setStrokeColorRGB(0.7, 0.7, 0.7)
-    p.setLineWidth(1)
-    p.rect(margin, y_pos - box_height, (width - 2*margin) / 2 - 0.4*cm, box_height, stroke=1, fill=0)
+    y_pos = BOX_TOP
+    box_height = BOX_HEIGHT
 
-    draw_text(margin + 0.6*cm, y_pos - 0.7*cm, "SELLER DETAILS", "Helvetica", 11, bold=True)
     draw_text(margin + 0.6*cm, y_pos - 1.3*cm, invoice.seller_name, "Helvetica", 10, bold=True)
     draw_text(margin + 0.6*cm, y_pos - 1.8*cm, f"GSTIN: {invoice.seller_gstin}", "Helvetica", 9)
     if invoice.seller_phone:
@@ -128,20 +675,13 @@ def generate_invoice_pdf(invoice):
         draw_text(margin + 0.6*cm, y_addr, f"PIN: {invoice.seller_pincode}", "Helvetica", 9)
         y_addr -= 0.6*cm
 
-    # Bank details within seller box
-    draw_text(margin + 0.6*cm, y_addr, "BANK DETAILS", "Helvetica", 10, bold=True)
-    y_addr -= 0.5*cm
-    draw_text(margin + 0.6*cm, y_addr, "Bank: HDFC Bank", "Helvetica", 8)
-    y_addr -= 0.4*cm
-    draw_text(margin + 0.6*cm, y_addr, "A/c: 50200012345678", "Helvetica", 8)
-    y_addr -= 0.4*cm
-    draw_text(margin + 0.6*cm, y_addr, "IFSC: HDFC0001234", "Helvetica", 8)
+    # Bank details within seller box, shifted to sit below the address
+    p.saveState()
+    p.translate(0, y_addr - BANK_DETAILS_Y)
+    _draw_static_layer(p, FORM_BANK_DETAILS)
+    p.restoreState()
 
-    # Buyer box (same height as seller box)
-    p.rect(margin + (width - 2*margin) / 2 + 0.4*cm, y_pos - box_height, (width - 2*margin) / 2 - 0.4*cm, box_height, stroke=1, fill=0)
-
-    buyer_x = margin + (width - 2*margin) / 2 + 1*cm
-    draw_text(buyer_x, y_pos - 0.7*cm, "BUYER DETAILS", "Helvetica", 11, bold=True)
+    buyer_x = BUYER_BOX_X + 0.6*cm
     # Truncate buyer name if too long (max 30 characters for better fit)
     buyer_name_display = invoice.buyer_name[:30] + "..." if len(invoice.buyer_name) > 30 else invoice.buyer_name
     draw_text(buyer_x, y_pos - 1.3*cm, buyer_name_display, "Helvetica", 10, bold=True)
@@ -182,55 +722,63 @@ def generate_invoice_pdf(invoice):
     # Items table
     y_pos = y_pos - box_height - 1.2*cm
 
-    # Table header
-    table_data = [
-        ['#', 'Description', 'HSN/SAC', 'Qty', 'Rate', 'Amount']
-    ]
-
-    # Table rows
-    for item in invoice.items.all():
-        table_data.append([
+    # Items table, split across pages with the header row repeated.
+    # Rows are pulled from the database lazily and only one page of them is
+    # laid out at a time, so very large invoices render in bounded memory
+    # and linear time.
+    # Header, column widths and style are shared module-level objects
+    def draw_table(rows, top):
+        """Draw header + rows with its top edge at `top`, returning its height"""
+        table = Table([ITEM_TABLE_HEADER] + rows, colWidths=ITEM_TABLE_COL_WIDTHS)
+        table.setStyle(ITEM_TABLE_STYLE)
+        table.wrapOn(p, width, height)
+        table.drawOn(p, margin, top - table._height)
+        return table._height
+
+    # Every row is a single line, so one measurement gives the page capacity
+    header_height, row_height = _item_row_heights()
+    table_bottom = 3*cm  # Keep clear of the footer lines
+    continued_top = height - 3*cm
+
+    def rows_fitting(top):
+        return max(1, int((top - table_bottom - header_height) // row_height))
+
+    rows = []
+    capacity = rows_fitting(y_pos)
+    table_height = 0
+    item_count = 0
+
+    for item in _iter_invoice_items(invoice):
+        item_count += 1
+        rows.append([
             str(item.serial_number),
-            item.description[:50],
+            # Newlines would turn a row into several lines and break the row height
+            item.description[:50].replace('\r', ' ').replace('\n', ' '),
             item.hsn_sac,
             str(item.quantity),
             format_currency(item.unit_price),
             format_currency(item.amount)
         ])
 
-    # Create table with wider columns
-    col_widths = [1.2*cm, 7.5*cm, 2.5*cm, 1.8*cm, 2.8*cm, 2.8*cm]
-    table = Table(table_data, colWidths=col_widths)
-
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2D3748')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('ALIGN', (1, 1), (1, -1), 'LEFT'),
-        ('ALIGN', (4, 1), (5, -1), 'RIGHT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 11),
-        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 1), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 14),
-        ('TOPPADDING', (0, 1), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 1), (-1, -1), 10),
-        ('GRID', (0, 0), (-1, -1), 0.75, colors.HexColor('#A0AEC0')),
-        ('BOX', (0, 0), (-1, -1), 1.5, colors.HexColor('#2D3748')),
-    ]))
-
-    # Draw table
-    table.wrapOn(p, width, height)
-    table_height = table._height
-    table.drawOn(p, margin, y_pos - table_height)
+        if len(rows) == capacity:
+            draw_table(rows, y_pos)
+            rows = []
+
+            # Continue on a new page
+            p.showPage()
+            p.setFillColorRGB(0.2, 0.2, 0.2)
+            draw_text(margin, height - 2*cm, f"TAX INVOICE {invoice.invoice_number} (continued)", "Helvetica", 11, bold=True)
+            p.setFillColorRGB(0, 0, 0)
+            y_pos = continued_top
+            capacity = rows_fitting(y_pos)
+
+    if rows or not item_count:
+        table_height = draw_table(rows, y_pos)
 
     # Totals section - Fixed alignment
     y_pos = y_pos - table_height - 1.5*cm
     totals_x = width - margin - 7.5*cm
 
-    # Draw totals box with better styling
-    p.setStrokeColorRGB(0.7, 0.7, 0.7)
-    p.setLineWidth(1)
     totals_box_height = 3.5*cm if invoice.is_interstate else 4*cm
 
     # Ensure totals section doesn't go below minimum margin (4cm from bottom for footer)
@@ -241,6 +789,9 @@ def generate_invoice_pdf(invoice):
         y_pos = height - 3*cm  # Start near top of new page
         totals_x = width - margin - 7.5*cm
 
+    # Draw totals box with better styling (after any page break, which resets the graphics state)
+    p.setStrokeColorRGB(0.7, 0.7, 0.7)
+    p.setLineWidth(1)
     p.rect(totals_x - 0.4*cm, y_pos - totals_box_height, 7.9*cm, totals_box_height, stroke=1, fill=0)
 
     # Subtotal row
@@ -277,28 +828,11 @@ def generate_invoice_pdf(invoice):
     draw_text(totals_x + 6.5*cm, y_totals + 0.1*cm, format_currency(invoice.total), "Helvetica", 13, bold=True, align='right')
     p.setFillColorRGB(0, 0, 0)
 
-    # Footer
-    p.setFont("Helvetica-Oblique", 9)
-    p.setFillColorRGB(0.4, 0.4, 0.4)
-    p.drawString(margin, 2.5*cm, "This is a computer-generated invoice and does not require a signature.")
+    # Footer (static layer) and notes
+    _draw_static_layer(p, FORM_FOOTER)
     if invoice.notes:
         p.setFont("Helvetica", 9)
         p.setFillColorRGB(0, 0, 0)
         p.drawString(margin, 2*cm, f"Notes: {invoice.notes[:90]}")
 
-    # Thank you message
-    p.setFont("Helvetica-Bold", 10)
-    p.setFillColorRGB(0.2, 0.4, 0.7)
-    thank_you_text = "Thank you for your business!"
-    text_width = p.stringWidth(thank_you_text, "Helvetica-Bold", 10)
-    p.drawString((width - text_width) / 2, 1.2*cm, thank_you_text)
-
     p.showPage()
-    p.save()
-
-    # Save PDF to model
-    buffer.seek(0)
-    filename = f"{invoice.invoice_number}.pdf"
-    invoice.pdf_file.save(filename, ContentFile(buffer.read()), save=True)
-
-    return invoice.pdf_file.path
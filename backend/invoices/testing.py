@@ -0,0 +1,112 @@
+"""
+Fixtures shared by the test suite and the benchmarks
+"""
+import csv
+import io
+import tempfile
+from contextlib import contextmanager
+from datetime import date
+from decimal import Decimal
+from django.test import TestCase
+from django.test.utils import override_settings
+from .models import Invoice, InvoiceItem
+
+
+def make_invoices(count, item_count=3, interstate=False, address_length=40, prefix='BENCH'):
+    """Create synthetic invoices with line items"""
+    address = ('42 Benchmark Road, Koramangala, Bangalore ' * (address_length // 40 + 1))[:address_length]
+    invoices = []
+
+    for n in range(count):
+        subtotal = Decimal('100.00') * item_count
+        invoice = Invoice(
+            invoice_number=f"{prefix}-{n:06d}",
+            invoice_type='user',
+            user_id='benchmark',
+            invoice_date=date.today(),
+            seller_name='Benchmark Seller Pvt Ltd',
+            seller_gstin='29ABCDE1234F1Z5',
+            seller_address=address,
+            seller_pincode='560001',
+            seller_state='KA',
+            seller_phone='9876543210',
+            buyer_name=f'Benchmark Buyer {n}',
+            buyer_gstin='27ABCDE1234F1Z5',
+            buyer_address=address,
+            buyer_pincode='400001',
+            buyer_state='MH' if interstate else 'KA',
+            buyer_phone='9876543211',
+            buyer_email='buyer@example.com',
+            subtotal=subtotal,
+            gst_rate=Decimal('18.00'),
+        )
+        invoice.calculate_taxes()
+        invoices.append(invoice)
+
+    Invoice.objects.bulk_create(invoices)
+    invoices = list(Invoice.objects.filter(invoice_number__startswith=f"{prefix}-").order_by('id'))
+
+    items = []
+    for invoice in invoices:
+        for i in range(item_count):
+            items.append(InvoiceItem(
+                invoice=invoice,
+                serial_number=i + 1,
+                description=f'Consulting service line {i + 1}',
+                hsn_sac='998314',
+                quantity=Decimal('1.00'),
+                unit_price=Decimal('100.00'),
+                amount=Decimal('100.00'),
+            ))
+    InvoiceItem.objects.bulk_create(items, batch_size=1000)
+
+    return invoices
+
+
+def make_bulk_csv(rows, item_count=2):
+    """Build an in-memory bulk upload CSV, alternating intrastate/interstate buyers"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow([
+        'receiver_name', 'receiver_address', 'pincode', 'phone', 'email', 'gstin',
+        'product_descriptions', 'hsn_sac_codes', 'quantities', 'total_values',
+    ])
+    for n in range(rows):
+        writer.writerow([
+            f'Bulk Buyer {n}',
+            '42 Benchmark Road, Koramangala, Bangalore',
+            '560001' if n % 2 == 0 else '400001',  # KA (same as seller) / other state
+            '9876543210',
+            'buyer@example.com',
+            '27ABCDE1234F1Z5',
+            ','.join(f'Service {i + 1}' for i in range(item_count)),
+            ','.join('998314' for _ in range(item_count)),
+            ','.join('1' for _ in range(item_count)),
+            ','.join('118.00' for _ in range(item_count)),
+        ])
+    return io.BytesIO(output.getvalue().encode('utf-8'))
+
+
+BENCH_SELLER_DETAILS = {
+    'seller_name': 'Benchmark Seller Pvt Ltd',
+    'seller_gstin': '29ABCDE1234F1Z5',
+    'seller_address': '42 Benchmark Road, Koramangala, Bangalore',
+    'seller_pincode': '560001',
+    'seller_state': 'KA',
+}
+
+
+@contextmanager
+def scratch_media():
+    """Point MEDIA_ROOT at a throwaway directory so rendered PDFs are not kept"""
+    with tempfile.TemporaryDirectory(prefix='invoice-bench-') as media_root:
+        with override_settings(MEDIA_ROOT=media_root):
+            yield
+
+
+class InvoiceTestCase(TestCase):
+    """TestCase whose rendered PDFs and uploaded files go to a throwaway MEDIA_ROOT"""
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(scratch_media())
@@ -1,3 +1,2052 @@
+import io
+
+from django.db import transaction
+from django.http import FileResponse
 from django.test import TestCase
 
-# Create your tests here.
+from .benchmarks import (
+    bench_bulk_upload,
+    bench_email_delivery,
+    bench_render,
+    bench_whatsapp_delivery,
+    compare_to_baseline,
+    local_smtp_server,
+    local_twilio_server,
+    percentile,
+)
+from .bulk_jobs import run_bulk_upload_worker
+from .notifications import TokenBucket, deliver_due_notifications, run_notification_worker
+from .bulk_upload_service import repeat_fingerprint, row_fingerprint
+from .bulk_upload_serializers import BulkInvoiceCSVRowSerializer, validate_csv_row
+from .bulk_upload_service import BulkInvoiceProcessor
+from .models import (
+    BulkUploadJob,
+    DeliveryStatusCallback,
+    Invoice,
+    InvoiceItem,
+    InvoiceNumberSequence,
+    NotificationOutbox,
+    PDF_STATUS_FAILED,
+    PDF_STATUS_PENDING,
+    PDF_STATUS_READY,
+    PDF_STATUS_RENDERING,
+)
+from .pdf_queue import claim_pending_invoices, queue_invoice_pdf, render_pending_pdfs
+from .testing import (
+    BENCH_SELLER_DETAILS,
+    InvoiceTestCase,
+    make_bulk_csv,
+    make_invoices,
+    scratch_media,
+)
+
+
+def make_csv_with_failures():
+    """Seven-row bulk CSV where rows 3 and 6 fail validation"""
+    csv_file = make_bulk_csv(7, item_count=3)
+    lines = csv_file.getvalue().decode('utf-8').splitlines()
+    # Row 3: bad pincode, row 6: mismatched product counts
+    lines[2] = lines[2].replace('400001', '40001')
+    lines[5] = lines[5].replace('"1,1,1"', '"1,1"')
+    return io.BytesIO('\n'.join(lines).encode('utf-8'))
+
+
+def pdf_page_count(content):
+    """Pages in a reportlab PDF (page objects are written uncompressed)"""
+    import re
+
+    return len(re.findall(rb'/Type /Page\b', content))
+
+
+class ProcessPoolRenderTests(InvoiceTestCase):
+    """Bulk PDFs rendered by spawned worker processes"""
+
+    def setUp(self):
+        from .pdf_workers import shutdown_executor
+        from .renderers import reset_render_stats
+
+        super().setUp()
+        self.addCleanup(shutdown_executor)
+        reset_render_stats()
+        self.addCleanup(reset_render_stats)
+
+    def _share_database(self):
+        """
+        Copy the in-memory test database, with this test's rows, to a file the
+        workers can open, and point them at it
+        """
+        import os
+        import sqlite3
+        import tempfile
+        from django.conf import settings
+        from django.db import connection
+        from unittest import mock
+
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        path = os.path.join(folder.name, 'workers.sqlite3')
+        # Dumped through the test's own connection, which sees its uncommitted rows
+        with sqlite3.connect(path) as target:
+            target.executescript('\n'.join(connection.connection.iterdump()))
+
+        patcher = mock.patch('invoices.pdf_workers._worker_paths', return_value=(path, str(settings.MEDIA_ROOT)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return path
+
+    def test_workers_render_and_store_pdfs(self):
+        import os
+        import sqlite3
+        from django.conf import settings
+        from .pdf_workers import render_invoice_pdfs
+        from .renderers import get_render_stats
+        from .services import compute_pdf_hash
+
+        invoices = make_invoices(3, prefix='POOL')
+        database = self._share_database()
+        self.assertEqual(render_invoice_pdfs(invoices, pdf_workers=2), [None, None, None])
+
+        for invoice in invoices:
+            # The worker's file name, digest and engine are mirrored onto the instance
+            self.assertTrue(os.path.exists(os.path.join(settings.MEDIA_ROOT, invoice.pdf_file.name)))
+            self.assertEqual((invoice.pdf_hash, invoice.pdf_engine), (compute_pdf_hash(invoice), 'reportlab'))
+        # Nothing was rendered in this process; the workers wrote the rows
+        self.assertEqual(get_render_stats(), {})
+        with sqlite3.connect(database) as rows:
+            stored = rows.execute('SELECT id, pdf_hash FROM invoices ORDER BY id').fetchall()
+        self.assertEqual(stored, [(invoice.pk, invoice.pdf_hash) for invoice in invoices])
+
+    def test_worker_errors_are_reported_per_invoice(self):
+        from .pdf_workers import render_invoice_pdfs
+
+        invoices = make_invoices(2, prefix='POOL')
+        self._share_database()
+        # Not in the workers' copy of the database
+        invoices.insert(1, make_invoices(1, prefix='LATE')[0])
+
+        errors = render_invoice_pdfs(invoices, pdf_workers=2)
+        self.assertIsNone(errors[0])
+        self.assertIsInstance(errors[1], Invoice.DoesNotExist)
+        self.assertIsNone(errors[2])
+        self.assertFalse(invoices[1].pdf_file)
+
+
+class PdfHashTests(InvoiceTestCase):
+    """Re-renders are skipped while the stored PDF matches the invoice content"""
+
+    def setUp(self):
+        super().setUp()
+        self.invoice = make_invoices(1, prefix='HASH')[0]
+
+    def test_hash_follows_pdf_content(self):
+        from django.conf import settings
+        from unittest import mock
+        from .services import compute_pdf_hash
+
+        original = compute_pdf_hash(self.invoice)
+        self.assertEqual(compute_pdf_hash(Invoice.objects.get(pk=self.invoice.pk)), original)
+
+        # Columns that are not printed leave the hash alone
+        self.invoice.pdf_error = 'unrelated'
+        self.assertEqual(compute_pdf_hash(self.invoice), original)
+
+        self.invoice.buyer_name = 'Renamed Buyer'
+        renamed = compute_pdf_hash(self.invoice)
+        self.assertNotEqual(renamed, original)
+
+        self.invoice.items.filter(serial_number=2).update(description='Changed line')
+        edited = compute_pdf_hash(self.invoice)
+        self.assertNotEqual(edited, renamed)
+
+        # The printed tax rates come from settings
+        with mock.patch.dict(settings.INVOICE_SETTINGS, {'CGST_RATE': 6}):
+            self.assertNotEqual(compute_pdf_hash(self.invoice), edited)
+
+    def test_unchanged_invoice_is_not_rendered_again(self):
+        from unittest import mock
+        from .services import _save_pdf, generate_invoice_pdf, is_pdf_current
+
+        with mock.patch('invoices.services._save_pdf', wraps=_save_pdf) as save:
+            generate_invoice_pdf(self.invoice)
+            self.assertTrue(is_pdf_current(self.invoice))
+            generate_invoice_pdf(Invoice.objects.get(pk=self.invoice.pk))
+            self.assertEqual(save.call_count, 1)
+
+            generate_invoice_pdf(self.invoice, force=True)
+            self.assertEqual(save.call_count, 2)
+
+            self.invoice.items.filter(serial_number=1).update(quantity=5)
+            self.assertFalse(is_pdf_current(self.invoice))
+            generate_invoice_pdf(self.invoice)
+            self.assertEqual(save.call_count, 3)
+
+        # A matching hash is not enough once the file is gone
+        self.invoice.pdf_file.storage.delete(self.invoice.pdf_file.name)
+        self.assertFalse(is_pdf_current(self.invoice))
+
+    def test_generate_pdf_endpoint_skips_current_pdf(self):
+        from .services import generate_invoice_pdf
+
+        url = f'/api/invoices/{self.invoice.id}/generate_pdf/'
+        generate_invoice_pdf(self.invoice)
+
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['message'], 'PDF is up to date')
+        self.assertEqual(claim_pending_invoices(10), [])
+
+        response = self.client.post(url, {'force': 'true'})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(Invoice.objects.get(pk=self.invoice.pk).pdf_status, PDF_STATUS_PENDING)
+
+
+class PdfStreamTests(InvoiceTestCase):
+    """PDFs rendered straight into the response, stored once sent"""
+
+    def setUp(self):
+        super().setUp()
+        self.invoice = make_invoices(1, prefix='STREAM')[0]
+
+    def test_stored_after_the_last_chunk(self):
+        from .services import is_pdf_current, stream_invoice_pdf
+
+        content_length, chunks = stream_invoice_pdf(self.invoice, chunk_size=1024)
+        first = next(chunks)
+        self.assertEqual(len(first), 1024)
+        self.assertTrue(first.startswith(b'%PDF'))
+        # Nothing is written before the client has the whole file
+        self.assertFalse(Invoice.objects.get(pk=self.invoice.pk).pdf_file)
+
+        content = first + b''.join(chunks)
+        self.assertEqual(len(content), content_length)
+        invoice = Invoice.objects.get(pk=self.invoice.pk)
+        self.assertTrue(is_pdf_current(invoice))
+        self.assertEqual(invoice.pdf_status, PDF_STATUS_READY)
+        with invoice.pdf_file.open('rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_persist_false_stores_nothing(self):
+        from .services import stream_invoice_pdf
+
+        content_length, chunks = stream_invoice_pdf(self.invoice, persist=False)
+        self.assertEqual(len(b''.join(chunks)), content_length)
+        self.assertFalse(Invoice.objects.get(pk=self.invoice.pk).pdf_file)
+
+    def test_download_pdf_stream_endpoint(self):
+        url = f'/api/invoices/{self.invoice.id}/download_pdf/?stream=true'
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content)
+        self.assertEqual(int(response['Content-Length']), len(content))
+        self.assertTrue(content.startswith(b'%PDF'))
+
+        # The stored copy is served from now on, without rendering again
+        response = self.client.get(url)
+        self.assertIsInstance(response, FileResponse)
+        self.assertEqual(b''.join(response.streaming_content), content)
+
+        other = make_invoices(1, prefix='NOKEEP')[0]
+        response = self.client.get(f'/api/invoices/{other.id}/download_pdf/?stream=true&persist=false')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        self.assertFalse(Invoice.objects.get(pk=other.pk).pdf_file)
+
+
+class PdfZipExportTests(InvoiceTestCase):
+    """Streamed ZIP of many invoices' PDFs"""
+
+    def setUp(self):
+        from .services import generate_invoice_pdf
+
+        super().setUp()
+        self.invoices = make_invoices(3, prefix='ZIP')
+        # One stored PDF, the others rendered while the ZIP streams
+        generate_invoice_pdf(self.invoices[0])
+        Invoice.objects.filter(pk__in=[i.pk for i in self.invoices]).update(bulk_batch_id='zip-batch')
+
+    def _open(self, chunks):
+        import zipfile
+
+        return zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+
+    def test_zip_holds_every_pdf(self):
+        from .services import is_pdf_current, stream_invoice_pdf_zip
+
+        with self.invoices[0].pdf_file.open('rb') as f:
+            stored = f.read()
+
+        archive = self._open(stream_invoice_pdf_zip(Invoice.objects.order_by('id').iterator(), chunk_size=1024))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(archive.namelist(), ['ZIP-000000.pdf', 'ZIP-000001.pdf', 'ZIP-000002.pdf'])
+        self.assertEqual(archive.read('ZIP-000000.pdf'), stored)
+
+        for invoice in Invoice.objects.order_by('id'):
+            # Rendered entries were stored as well
+            self.assertTrue(is_pdf_current(invoice))
+            with invoice.pdf_file.open('rb') as f:
+                self.assertEqual(archive.read(f'{invoice.invoice_number}.pdf'), f.read())
+
+    def test_download_zip_endpoint(self):
+        response = self.client.get('/api/invoices/download-zip/?batch_id=zip-batch')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="invoices-zip-batch.zip"')
+        self.assertEqual(len(self._open(response.streaming_content).namelist()), 3)
+
+        ids = ','.join(str(i.pk) for i in self.invoices[1:])
+        response = self.client.post('/api/invoices/download-zip/', {'invoice_ids': ids})
+        self.assertEqual(self._open(response.streaming_content).namelist(), ['ZIP-000001.pdf', 'ZIP-000002.pdf'])
+
+        self.assertEqual(self.client.get('/api/invoices/download-zip/').status_code, 400)
+        self.assertEqual(self.client.get('/api/invoices/download-zip/?invoice_ids=x').status_code, 400)
+        self.assertEqual(self.client.get('/api/invoices/download-zip/?batch_id=unknown').status_code, 404)
+
+
+class MergedPdfTests(InvoiceTestCase):
+    """Many invoices printed as one PDF"""
+
+    def setUp(self):
+        super().setUp()
+        self.invoices = make_invoices(2, prefix='MERGE') + make_invoices(1, item_count=60, prefix='MERGELONG')
+        Invoice.objects.filter(pk__in=[i.pk for i in self.invoices]).update(bulk_batch_id='merge-batch')
+
+    def test_pages_of_every_invoice_in_order(self):
+        from .services import render_invoice_pdf, render_merged_invoice_pdf
+
+        pages = [pdf_page_count(render_invoice_pdf(invoice)) for invoice in self.invoices]
+        self.assertEqual(pages[:2], [1, 1])
+        self.assertGreater(pages[2], 1)
+
+        merged = render_merged_invoice_pdf(iter(self.invoices))
+        self.assertEqual(pdf_page_count(merged), sum(pages))
+        # Nothing is stored for a print run
+        self.assertFalse(Invoice.objects.filter(pk__in=[i.pk for i in self.invoices]).exclude(pdf_file='').exists())
+
+    def test_merged_pdf_endpoint(self):
+        from .services import render_merged_invoice_pdf
+
+        response = self.client.get('/api/invoices/merged-pdf/?batch_id=merge-batch')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="invoices-merge-batch.pdf"')
+        content = b''.join(response.streaming_content)
+        self.assertEqual(int(response['Content-Length']), len(content))
+        self.assertEqual(pdf_page_count(content), pdf_page_count(render_merged_invoice_pdf(iter(self.invoices))))
+
+        response = self.client.post('/api/invoices/merged-pdf/', {'invoice_ids': str(self.invoices[0].pk)})
+        self.assertEqual(pdf_page_count(b''.join(response.streaming_content)), 1)
+
+        # Drafts are left out of print runs
+        Invoice.objects.filter(pk=self.invoices[0].pk).update(is_draft=True)
+        response = self.client.post('/api/invoices/merged-pdf/', {'invoice_ids': str(self.invoices[0].pk)})
+        self.assertEqual(response.status_code, 404)
+
+
+    def test_merged_pdf_is_capped_and_spooled(self):
+        from tempfile import SpooledTemporaryFile
+        from unittest import mock
+        from django.conf import settings
+        from .services import render_merged_invoice_pdf
+
+        with mock.patch.dict(settings.INVOICE_SETTINGS, {'MERGED_PDF_MAX_INVOICES': 2}):
+            response = self.client.get('/api/invoices/merged-pdf/?batch_id=merge-batch')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('download-zip', response.json()['error'])
+
+        spooled = []
+
+        def spool(max_size):
+            spooled.append(SpooledTemporaryFile(max_size=max_size))
+            return spooled[-1]
+
+        with mock.patch('invoices.services.MERGED_PDF_SPOOL_SIZE', 1024), \
+                mock.patch('tempfile.SpooledTemporaryFile', side_effect=spool):
+            response = self.client.get('/api/invoices/merged-pdf/?batch_id=merge-batch')
+            content = b''.join(response.streaming_content)
+        # Sent from a spooled file, which went to disk past the spool size
+        self.assertTrue(spooled[0]._rolled)
+        self.assertTrue(spooled[0].closed)
+        self.assertEqual(int(response['Content-Length']), len(content))
+        self.assertEqual(pdf_page_count(content), pdf_page_count(render_merged_invoice_pdf(iter(self.invoices))))
+
+# Stand-in for wkhtmltopdf in --read-args-from-stdin mode. It logs its
+# arguments and every job to the log file, and behaves per job as the mode
+# file says: ok, exit-code (non-fatal load error), empty (no PDF), crash.
+FAKE_WKHTMLTOPDF = '''#!{python}
+import os, shlex, sys
+
+folder = os.path.dirname(os.path.abspath(__file__))
+with open(os.path.join(folder, 'log'), 'a') as log:
+    log.write('start %d %s\\n' % (os.getpid(), ' '.join(sys.argv[1:])))
+for line in sys.stdin:
+    target = shlex.split(line)[-1]
+    with open(os.path.join(folder, 'mode')) as f:
+        mode = f.read().strip()
+    with open(os.path.join(folder, 'log'), 'a') as log:
+        log.write('job %d %s\\n' % (os.getpid(), mode))
+    if mode == 'crash':
+        sys.exit(1)
+    if mode != 'empty':
+        with open(target, 'wb') as f:
+            f.write(b'%PDF-1.4 fake')
+    sys.stderr.write('Loading pages (1/6)\\n')
+    if mode == 'exit-code':
+        sys.stderr.write('Exit with code 1 due to network error: ContentNotFoundError\\n')
+    else:
+        sys.stderr.write('Done\\n')
+    sys.stderr.flush()
+'''
+
+
+class WkhtmltopdfPoolTests(InvoiceTestCase):
+    """The warm wkhtmltopdf workers, driven through a fake binary"""
+
+    def setUp(self):
+        import os
+        import sys
+        import tempfile
+        from django.conf import settings
+        from unittest import mock
+        from . import renderers
+
+        super().setUp()
+
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = folder.name
+        binary = os.path.join(self.folder, 'wkhtmltopdf')
+        with open(binary, 'w') as f:
+            f.write(FAKE_WKHTMLTOPDF.format(python=sys.executable))
+        os.chmod(binary, 0o755)
+        self.set_mode('ok')
+
+        patcher = mock.patch.dict(settings.INVOICE_SETTINGS, {
+            'WKHTMLTOPDF_PATH': binary,
+            'WKHTMLTOPDF_WORKERS': 1,
+            'WKHTMLTOPDF_TIMEOUT': 10,
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Probe again (against the fake) and build a fresh pool
+        for name in ('_probed', '_wkhtmltopdf_path', '_pool'):
+            patcher = mock.patch.object(renderers, name, False if name == '_probed' else None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.pool = renderers.get_wkhtmltopdf_pool()
+        self.addCleanup(self.pool.close)
+        self.assertEqual(renderers.get_wkhtmltopdf_path(), binary)
+
+        renderers.reset_render_stats()
+        self.addCleanup(renderers.reset_render_stats)
+        self.invoice = make_invoices(1, prefix='WKHTML')[0]
+
+    def set_mode(self, mode):
+        import os
+
+        with open(os.path.join(self.folder, 'mode'), 'w') as f:
+            f.write(mode)
+
+    def log(self):
+        import os
+
+        with open(os.path.join(self.folder, 'log')) as f:
+            return [line.split() for line in f.read().splitlines()]
+
+    def test_jobs_go_to_one_process_over_stdin(self):
+        from .services import generate_invoice_pdf
+
+        self.assertEqual(self.pool.render('<p>one</p>'), b'%PDF-1.4 fake')
+        generate_invoice_pdf(self.invoice)
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.pdf_engine, 'wkhtmltopdf')
+
+        log = self.log()
+        self.assertEqual(log[0][2:], ['--read-args-from-stdin'])
+        # Both jobs ran in the process started for the first
+        self.assertEqual([entry[:2] for entry in log[1:]], [['job', log[0][1]]] * 2)
+
+    def test_exit_code_line_finishes_the_job(self):
+        self.set_mode('exit-code')
+        self.assertEqual(self.pool.render('<p>one</p>'), b'%PDF-1.4 fake')
+        # The worker is still usable afterwards
+        self.set_mode('ok')
+        self.assertEqual(self.pool.render('<p>two</p>'), b'%PDF-1.4 fake')
+        self.assertEqual(len([entry for entry in self.log() if entry[0] == 'start']), 1)
+
+    def test_dead_worker_is_respawned(self):
+        self.pool.render('<p>one</p>')
+        worker = self.pool._workers[0]
+        worker.process.kill()
+        worker.process.wait()
+
+        self.assertEqual(self.pool.render('<p>two</p>'), b'%PDF-1.4 fake')
+        starts = [entry[1] for entry in self.log() if entry[0] == 'start']
+        self.assertEqual(len(starts), 2)
+        self.assertEqual(self.log()[-1][:2], ['job', starts[1]])
+
+    def test_failed_renders_fall_back_to_reportlab(self):
+        from .renderers import get_render_stats
+        from .services import generate_invoice_pdf
+
+        for mode in ('crash', 'empty'):
+            self.set_mode(mode)
+            Invoice.objects.filter(pk=self.invoice.pk).update(pdf_hash='')
+            self.invoice.refresh_from_db()
+            generate_invoice_pdf(self.invoice)
+
+            self.invoice.refresh_from_db()
+            self.assertEqual(self.invoice.pdf_engine, 'reportlab')
+            with self.invoice.pdf_file.open('rb') as f:
+                self.assertGreater(len(f.read()), len(b'%PDF-1.4 fake'))
+
+        stats = get_render_stats()
+        self.assertEqual((stats['wkhtmltopdf']['count'], stats['wkhtmltopdf']['failures']), (2, 2))
+        self.assertEqual(stats['reportlab']['count'], 2)
+
+        # The crashed worker was replaced and takes the next job
+        self.set_mode('ok')
+        self.assertEqual(self.pool.render('<p>again</p>'), b'%PDF-1.4 fake')
+
+    def test_render_stats(self):
+        from .renderers import get_render_stats, record_render, reset_render_stats
+        from .services import generate_invoice_pdf
+
+        record_render('reportlab', 0.010)
+        record_render('reportlab', 0.030, failed=True)
+        self.assertEqual(get_render_stats()['reportlab'], {
+            'count': 2, 'failures': 1, 'avg_ms': 20.0, 'max_ms': 30.0, 'total_seconds': 0.04,
+        })
+        reset_render_stats()
+
+        generate_invoice_pdf(self.invoice)
+        self.set_mode('empty')
+        generate_invoice_pdf(self.invoice, force=True)
+
+        response = self.client.get('/api/invoices/render-stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['wkhtmltopdf_available'])
+        engines = response.data['engines']
+        self.assertEqual((engines['wkhtmltopdf']['count'], engines['wkhtmltopdf']['failures']), (2, 1))
+        self.assertEqual((engines['reportlab']['count'], engines['reportlab']['failures']), (1, 0))
+
+
+class PdfPaginationTests(TestCase):
+    """Large item tables split over pages without rows running off the page"""
+
+    def _render_tables(self, invoice):
+        """Render an invoice, recording every items table drawn: (page, bottom, top, serials, row heights)"""
+        from unittest import mock
+        from reportlab.platypus import Table
+        from .services import render_invoice_pdf
+
+        tables = []
+        draw_on = Table.drawOn
+
+        def record(table, canvas, x, y, *args, **kwargs):
+            tables.append((
+                canvas.getPageNumber(),
+                y,
+                y + table._height,
+                [row[0] for row in table._cellvalues[1:]],
+                table._rowHeights[1:],
+            ))
+            return draw_on(table, canvas, x, y, *args, **kwargs)
+
+        with mock.patch.object(Table, 'drawOn', autospec=True, side_effect=record):
+            content = render_invoice_pdf(invoice)
+        return content, tables
+
+    def test_long_invoice_is_paginated(self):
+        from reportlab.lib.pagesizes import A4
+        from reportlab.lib.units import cm
+
+        invoice = make_invoices(1, item_count=150, prefix='LONG')[0]
+        # Descriptions are cut to one line, embedded newlines included
+        invoice.items.filter(serial_number=7).update(description='Line one\nline two ' + 'x' * 200)
+
+        content, tables = self._render_tables(invoice)
+
+        self.assertGreater(len(tables), 2)
+        # Every row is one line high
+        row_height = tables[0][4][0]
+        self.assertEqual([page for page, *_ in tables], list(range(1, len(tables) + 1)))
+        serials = [serial for *_, rows, _ in tables for serial in rows]
+        self.assertEqual(serials, [str(n) for n in range(1, 151)])
+
+        for page, bottom, top, rows, heights in tables:
+            self.assertGreaterEqual(bottom, 3*cm - 0.01)
+            self.assertLessEqual(top, A4[1])
+            self.assertEqual(heights, [row_height] * len(rows))
+        # Continuation pages are filled to the same capacity
+        self.assertEqual(len({len(rows) for *_, rows, _ in tables[1:-1]}), 1)
+
+        # The totals follow the last table, on a page of their own if needed
+        self.assertIn(pdf_page_count(content), (len(tables), len(tables) + 1))
+
+    def test_short_invoice_stays_on_one_page(self):
+        content, tables = self._render_tables(make_invoices(1, item_count=3, prefix='SHORT')[0])
+        self.assertEqual(pdf_page_count(content), 1)
+        self.assertEqual([rows for *_, rows, _ in tables], [['1', '2', '3']])
+
+
+class StaticPdfFormTests(TestCase):
+    """Static page layers are written once per document and referenced by every invoice"""
+
+    def _count(self, pattern, content):
+        import re
+
+        return len(re.findall(pattern, content))
+
+    def test_multi_invoice_canvas_reuses_forms(self):
+        from .services import STATIC_FORMS, render_merged_invoice_pdf
+
+        invoices = make_invoices(4, prefix='FORMS')
+        content = render_merged_invoice_pdf(iter(invoices))
+
+        self.assertEqual(pdf_page_count(content), 4)
+        # One definition per layer, however many invoices use it
+        self.assertEqual(self._count(rb'/Subtype /Form', content), len(STATIC_FORMS))
+        for name in STATIC_FORMS:
+            self.assertEqual(self._count(rb'/FormXob\.' + name.encode() + rb'\b', content), 4)
+
+        # Twice the invoices, same definitions
+        more = render_merged_invoice_pdf(iter(invoices + make_invoices(4, prefix='MOREFORMS')))
+        self.assertEqual(self._count(rb'/Subtype /Form', more), len(STATIC_FORMS))
+
+    def test_single_invoice_draws_layers_inline(self):
+        from .services import render_invoice_pdf
+
+        content = render_invoice_pdf(make_invoices(1, prefix='INLINE')[0])
+        self.assertEqual(self._count(rb'/Subtype /Form', content), 0)
+
+
+class BaselineComparisonTests(TestCase):
+    """Regression detection against a saved benchmark baseline"""
+
+    baseline = {
+        'render': [
+            {'engine': 'reportlab', 'items': 10, 'address_length': 40, 'interstate': False,
+             'p50_ms': 10.0, 'p95_ms': 12.0, 'max_ms': 15.0, 'bytes': 4000},
+            {'engine': 'wkhtmltopdf', 'skipped': 'wkhtmltopdf not installed'},
+        ],
+    }
+
+    def _run(self, **metrics):
+        row = dict(self.baseline['render'][0], **metrics)
+        return {'render': [row]}
+
+    def test_within_threshold_passes(self):
+        results = self._run(p50_ms=11.5, bytes=4100)
+        self.assertEqual(compare_to_baseline(results, self.baseline, 20), [])
+
+    def test_regression_beyond_threshold_is_reported(self):
+        regressions = compare_to_baseline(self._run(p95_ms=15.0), self.baseline, 20)
+        self.assertEqual(len(regressions), 1)
+        self.assertEqual(regressions[0]['metric'], 'p95_ms')
+        self.assertEqual(regressions[0]['change_percent'], 25.0)
+        self.assertEqual(regressions[0]['case']['items'], 10)
+
+    def test_max_latency_and_improvements_are_ignored(self):
+        results = self._run(max_ms=100.0, p50_ms=2.0)
+        self.assertEqual(compare_to_baseline(results, self.baseline, 20), [])
+
+    def test_reference_paths_are_not_gated(self):
+        baseline = {'row_validation': [{'rows': 1000, 'serializer_seconds': 1.0, 'fast_seconds': 0.1}]}
+        results = {'row_validation': [{'rows': 1000, 'serializer_seconds': 3.0, 'fast_seconds': 0.1}]}
+        self.assertEqual(compare_to_baseline(results, baseline, 20), [])
+
+        results['row_validation'][0]['fast_seconds'] = 0.2
+        regressions = compare_to_baseline(results, baseline, 20)
+        self.assertEqual([r['metric'] for r in regressions], ['fast_seconds'])
+
+    def test_cases_missing_from_baseline_are_ignored(self):
+        results = self._run(items=1000, p50_ms=500.0)
+        self.assertEqual(compare_to_baseline(results, self.baseline, 20), [])
+
+    def test_percentile(self):
+        values = [5, 1, 4, 2, 3]
+        self.assertEqual(percentile(values, 50), 3)
+        self.assertEqual(percentile(values, 95), 5)
+        self.assertEqual(percentile(values, 0), 1)
+
+
+class BenchmarkSuiteTests(TestCase):
+    """The benchmarks themselves run and report the expected shape"""
+
+    def test_render_benchmark(self):
+        results = bench_render(sizes=(2,), repeats=2)
+        rendered = [row for row in results if 'skipped' not in row]
+        # Two address lengths x intrastate/interstate for every installed engine
+        self.assertGreaterEqual(len(rendered), 4)
+        for row in rendered:
+            self.assertLessEqual(row['p50_ms'], row['p95_ms'])
+            self.assertGreater(row['bytes'], 0)
+            self.assertGreater(row['peak_bytes'], 0)
+
+    def test_bulk_upload_benchmark(self):
+        results = bench_bulk_upload(sizes=(3,))
+        self.assertEqual(results[0]['rows'], 3)
+        self.assertEqual(results[0]['successful'], 3)
+
+    def test_email_delivery_benchmark(self):
+        row = bench_email_delivery(sizes=(3,), latency=0)[0]
+        self.assertEqual((row['delivered'], row['failed']), (3, 0))
+        self.assertEqual((row['per_message_connections'], row['mailer_connections']), (3, 1))
+
+    def test_whatsapp_delivery_benchmark(self):
+        row = bench_whatsapp_delivery(sizes=(6,), latency=0, concurrency=2)[0]
+        self.assertEqual(row['failed'], 0)
+        self.assertEqual(row['sequential_connections'], 6)
+        self.assertLessEqual(row['dispatcher_connections'], 2)
+
+
+class PdfQueueTests(InvoiceTestCase):
+    """Background PDF rendering through the invoices table"""
+
+    def setUp(self):
+        super().setUp()
+        self.invoice = make_invoices(1, prefix='QUEUE')[0]
+        queue_invoice_pdf(self.invoice)
+
+    def test_download_waits_for_worker(self):
+        url = f'/api/invoices/{self.invoice.id}/download_pdf/'
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['Retry-After'], '2')
+
+        self.assertEqual(render_pending_pdfs(), (1, 0))
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.pdf_status, PDF_STATUS_READY)
+        self.assertIsNotNone(self.invoice.pdf_finished_at)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+    def test_claimed_invoice_is_not_claimed_twice(self):
+        self.assertEqual(len(claim_pending_invoices(10)), 1)
+        self.assertEqual(claim_pending_invoices(10), [])
+
+    def test_failure_is_recorded(self):
+        from unittest import mock
+
+        with mock.patch('invoices.services._render_reportlab', side_effect=RuntimeError('boom')):
+            self.assertEqual(render_pending_pdfs(), (0, 1))
+
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.pdf_status, PDF_STATUS_FAILED)
+        self.assertEqual(self.invoice.pdf_error, 'boom')
+
+        queue_invoice_pdf(self.invoice)
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.pdf_status, PDF_STATUS_PENDING)
+
+    def test_render_of_an_invoice_requeued_meanwhile_is_dropped(self):
+        from unittest import mock
+        from .services import _render_reportlab, compute_pdf_hash, generate_invoice_pdfs
+
+        reclaimed = []
+
+        def edit_during_render(invoice):
+            # Edited and re-queued while this render runs, then claimed by a second worker
+            Invoice.objects.filter(pk=invoice.pk).update(buyer_name='Renamed Buyer')
+            queue_invoice_pdf(Invoice.objects.get(pk=invoice.pk), force=True)
+            reclaimed.extend(claim_pending_invoices(10))
+            return _render_reportlab(invoice)
+
+        with mock.patch('invoices.services._render_reportlab', side_effect=edit_during_render):
+            render_pending_pdfs()
+
+        self.invoice.refresh_from_db()
+        self.assertEqual((self.invoice.pdf_status, bool(self.invoice.pdf_file)), (PDF_STATUS_RENDERING, False))
+
+        self.assertEqual(generate_invoice_pdfs(reclaimed), [None])
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.pdf_status, PDF_STATUS_READY)
+        self.assertEqual(self.invoice.pdf_hash, compute_pdf_hash(self.invoice))
+
+    def test_drafts_are_never_claimed(self):
+        draft = make_invoices(1, prefix='DRAFT')[0]
+        Invoice.objects.filter(pk=draft.pk).update(is_draft=True, pdf_status=PDF_STATUS_PENDING)
+        draft.refresh_from_db()
+        self.assertFalse(queue_invoice_pdf(draft))
+
+        self.assertEqual([invoice.pk for invoice in claim_pending_invoices(10)], [self.invoice.pk])
+
+    def test_new_invoices_are_not_queued_by_default(self):
+        other = make_invoices(1, prefix='IDLE')[0]
+        self.assertEqual(other.pdf_status, 'none')
+        self.assertNotIn(other.pk, [invoice.pk for invoice in claim_pending_invoices(10)])
+
+    def test_worker_leaves_bulk_renders_alone(self):
+        from unittest import mock
+        from .pdf_workers import render_invoice_pdfs
+
+        Invoice.objects.filter(pk=self.invoice.pk).update(pdf_status=PDF_STATUS_READY)
+        claimed_during_render = []
+
+        def render(invoices, pdf_workers=None):
+            # A worker polling while the upload renders inline finds nothing
+            claimed_during_render.extend(claim_pending_invoices(10))
+            statuses = set(Invoice.objects.filter(pk__in=[i.pk for i in invoices]).values_list('pdf_status', flat=True))
+            self.assertEqual(statuses, {'rendering'})
+            return render_invoice_pdfs(invoices, pdf_workers)
+
+        for draft in (True, False):
+            with mock.patch('invoices.bulk_upload_service.render_invoice_pdfs', side_effect=render):
+                result = BulkInvoiceProcessor(
+                    csv_file=make_bulk_csv(2),
+                    user_id=f'queue-test-{draft}',
+                    invoice_type='user',
+                    seller_details=BENCH_SELLER_DETAILS,
+                    create_as_draft=draft,
+                ).process()
+            statuses = list(
+                Invoice.objects.filter(bulk_batch_id=result['batch_id']).values_list('pdf_status', flat=True)
+            )
+            self.assertEqual(statuses, ['none', 'none'] if draft else [PDF_STATUS_READY, PDF_STATUS_READY])
+
+        self.assertEqual(claimed_during_render, [])
+        self.assertEqual(claim_pending_invoices(10), [])
+        self.assertEqual(self.invoice.pdf_error, '')
+
+
+class BulkStreamingIngestTests(TestCase):
+    """Uploads are parsed as they are read and processed one batch at a time"""
+
+    class TrackedFile(io.BytesIO):
+        """Upload that remembers how far it has been read"""
+
+        furthest = 0
+
+        def read(self, *args):
+            data = super().read(*args)
+            self.furthest = max(self.furthest, self.tell())
+            return data
+
+        def read1(self, *args):
+            data = super().read1(*args)
+            self.furthest = max(self.furthest, self.tell())
+            return data
+
+        def readinto(self, buffer):
+            count = super().readinto(buffer)
+            self.furthest = max(self.furthest, self.tell())
+            return count
+
+    def _processor(self, csv_file, **kwargs):
+        return BulkInvoiceProcessor(
+            csv_file=csv_file,
+            user_id='ingest-test',
+            invoice_type='user',
+            seller_details=BENCH_SELLER_DETAILS,
+            create_as_draft=True,
+            **kwargs
+        )
+
+    def test_rows_are_read_as_batches_complete(self):
+        upload = self.TrackedFile(make_bulk_csv(600).getvalue())
+        size = len(upload.getvalue())
+        processor = self._processor(upload, batch_size=100)
+        finish_pending = processor._finish_pending
+        batches = []
+
+        def record_batch():
+            if processor._pending:
+                batches.append((len(processor._pending), upload.furthest))
+            finish_pending()
+
+        processor._finish_pending = record_batch
+        result = processor.process()
+
+        self.assertEqual(result['successful'], 600)
+        self.assertEqual([count for count, _ in batches], [100] * 6)
+        # The first batch finished with most of the file still unread
+        self.assertLess(batches[0][1], size / 2)
+        # The upload is handed back open, not closed with the decoder
+        self.assertFalse(upload.closed)
+
+    def test_byte_order_mark_is_ignored(self):
+        upload = io.BytesIO(b'\xef\xbb\xbf' + make_bulk_csv(2).getvalue())
+        self.assertEqual(self._processor(upload).process()['successful'], 2)
+
+    def test_upload_size_limit_comes_from_settings(self):
+        from django.conf import settings
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from unittest import mock
+
+        content = make_bulk_csv(20).getvalue()
+
+        def upload():
+            return self.client.post('/api/invoices/bulk-upload/', dict(
+                BENCH_SELLER_DETAILS,
+                csv_file=SimpleUploadedFile('invoices.csv', content),
+                user_id='ingest-test',
+                invoice_type='user',
+                create_as_draft='true',
+                background='false',
+            ))
+
+        with mock.patch.dict(settings.INVOICE_SETTINGS, {'BULK_UPLOAD_MAX_SIZE': 1024}):
+            response = upload()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['errors']['csv_file'], ['File size cannot exceed 1.0\xa0KB'])
+
+        with mock.patch.dict(settings.INVOICE_SETTINGS, {'BULK_UPLOAD_MAX_SIZE': None}):
+            self.assertEqual(upload().status_code, 200)
+
+
+class BulkInsertTests(TestCase):
+    """Batched bulk_create writes report exactly what row-by-row processing does"""
+
+    def _process(self, **kwargs):
+        processor = BulkInvoiceProcessor(
+            csv_file=make_csv_with_failures(),
+            user_id='bulk-insert-test',
+            invoice_type='user',
+            seller_details=BENCH_SELLER_DETAILS,
+            create_as_draft=True,
+            batch_size=3,
+            **kwargs
+        )
+        result = processor.process()
+        snapshot = {
+            'result': result,
+            'invoices': list(
+                Invoice.objects.filter(bulk_batch_id=processor.batch_id).order_by('id').values_list(
+                    'invoice_number', 'buyer_name', 'subtotal', 'cgst', 'sgst', 'igst', 'total', 'is_interstate'
+                )
+            ),
+            'items': list(
+                InvoiceItem.objects.filter(invoice__bulk_batch_id=processor.batch_id).order_by('id').values_list(
+                    'invoice__invoice_number', 'serial_number', 'quantity', 'unit_price', 'amount'
+                )
+            ),
+        }
+        # IDs and the batch differ between runs; everything else must match
+        del result['batch_id']
+        for success in result['successes']:
+            del success['invoice_id']
+        transaction.set_rollback(True)
+        return snapshot
+
+    def _run(self, **kwargs):
+        with transaction.atomic():
+            return self._process(**kwargs)
+
+    def test_bulk_matches_row_by_row(self):
+        expected = self._run(bulk_insert=False)
+        self.assertEqual(expected['result']['successful'], 5)
+        self.assertEqual([f['row'] for f in expected['result']['failures']], [3, 6])
+        self.assertEqual(self._run(bulk_insert=True), expected)
+
+    def test_failed_batch_falls_back_to_row_by_row(self):
+        from unittest import mock
+
+        expected = self._run(bulk_insert=False)
+        with mock.patch.object(InvoiceItem.objects, 'bulk_create', side_effect=RuntimeError('boom')):
+            self.assertEqual(self._run(bulk_insert=True), expected)
+
+
+class BulkUploadJobTests(InvoiceTestCase):
+    """Background bulk uploads: 202 + job, worker progress, paginated results"""
+
+    def setUp(self):
+        from unittest import mock
+        from django.conf import settings
+
+        super().setUp()
+        patcher = mock.patch.dict(settings.INVOICE_SETTINGS, {
+            'BULK_UPLOAD_BATCH_SIZE': 3,
+            'BULK_UPLOAD_RESULTS_PAGE_SIZE': 4,
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _upload(self, **data):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        csv_file = make_csv_with_failures()
+        data = dict(
+            BENCH_SELLER_DETAILS,
+            csv_file=SimpleUploadedFile('invoices.csv', csv_file.getvalue(), content_type='text/csv'),
+            user_id='bulk-job-test',
+            invoice_type='user',
+            create_as_draft='true',
+            **data
+        )
+        return self.client.post('/api/invoices/bulk-upload/', data)
+
+    def test_job_runs_in_background(self):
+        response = self._upload()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'queued')
+        self.assertEqual(response.data['total_rows'], 7)
+        status_url = f"/api/bulk-upload-jobs/{response.data['job_id']}/"
+
+        run_bulk_upload_worker(once=True)
+
+        job = self.client.get(status_url).data
+        self.assertEqual(job['status'], 'completed')
+        self.assertEqual((job['rows_processed'], job['successful'], job['failed']), (7, 5, 2))
+        self.assertEqual(job['eta_seconds'], 0)
+        self.assertEqual(Invoice.objects.filter(bulk_batch_id=job['batch_id']).count(), 5)
+
+        page = self.client.get(f'{status_url}results/').data
+        self.assertEqual(page['count'], 7)
+        self.assertEqual([r['row'] for r in page['results']], [2, 3, 4, 5])
+        self.assertTrue(page['results'][0]['download_url'].startswith('http://testserver/api/invoices/'))
+
+        failures = self.client.get(f'{status_url}results/?outcome=failure').data
+        self.assertEqual([r['row'] for r in failures['results']], [3, 6])
+        self._assert_failure_report(job['failure_report_url'], [3, 6])
+        # Named after the job's batch, not a blank id
+        report_name = BulkUploadJob.objects.get(pk=response.data['job_id']).failure_report.name
+        self.assertEqual(report_name, f"bulk_uploads/failures/{job['batch_id']}.csv")
+
+    def test_dry_run_streams_row_results_without_writing(self):
+        import json
+
+        response = self._upload(dry_run='true')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+        rows, summary = lines[:-1], lines[-1]['summary']
+        self.assertEqual([row['row'] for row in rows], list(range(2, 9)))
+        self.assertEqual([row['row'] for row in rows if not row['valid']], [3, 6])
+        self.assertEqual((summary['total_rows'], summary['valid'], summary['invalid']), (7, 5, 2))
+        self.assertFalse(Invoice.objects.exists())
+        self.assertFalse(InvoiceNumberSequence.objects.exists())
+
+        # Same prices and errors as a real run
+        with transaction.atomic():
+            result = BulkInvoiceProcessor(
+                csv_file=make_csv_with_failures(),
+                user_id='bulk-job-test',
+                invoice_type='user',
+                seller_details=BENCH_SELLER_DETAILS,
+                create_as_draft=True,
+            ).process()
+            transaction.set_rollback(True)
+        self.assertEqual([row['total'] for row in rows if row['valid']], [s['total'] for s in result['successes']])
+        self.assertEqual([row['errors'] for row in rows if not row['valid']], [f['errors'] for f in result['failures']])
+
+    def test_stream_writes_row_results_then_summary(self):
+        import json
+
+        response = self._upload(stream='true')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+        rows, summary = lines[:-1], lines[-1]['summary']
+        self.assertEqual([row['row'] for row in rows], list(range(2, 9)))
+        self.assertEqual([row['row'] for row in rows if row['outcome'] == 'failure'], [3, 6])
+        self.assertTrue(all(row['download_url'] for row in rows if row['outcome'] == 'success'))
+        self.assertEqual(summary['summary']['successful'], 5)
+        self.assertEqual(summary['message'], 'Processed 7 rows. 5 successful, 2 failed.')
+        self.assertEqual(Invoice.objects.filter(bulk_batch_id=summary['batch_id']).count(), 5)
+        self.assertFalse(BulkUploadJob.objects.exists())
+
+    def test_stream_ends_with_error_line_when_a_batch_fails(self):
+        import json
+        from django.conf import settings
+        from unittest import mock
+
+        process_chunk = BulkInvoiceProcessor._process_chunk
+        calls = []
+
+        def fail_second_batch(processor, chunk):
+            calls.append(chunk)
+            if len(calls) == 2:
+                raise RuntimeError('database went away')
+            return process_chunk(processor, chunk)
+
+        with mock.patch.dict(settings.INVOICE_SETTINGS, {'BULK_UPLOAD_BATCH_SIZE': 4}), \
+                mock.patch.object(BulkInvoiceProcessor, '_process_chunk', fail_second_batch):
+            response = self._upload(stream='true')
+            self.assertEqual(response.status_code, 200)
+            lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+        # The first batch's rows, then the error instead of a summary
+        self.assertEqual([line['row'] for line in lines[:-1]], [2, 3, 4, 5])
+        self.assertEqual(lines[-1], {'error': 'database went away'})
+
+    def test_synchronous_upload_still_available(self):
+        response = self._upload(background='false')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['summary']['successful'], 5)
+        self.assertEqual(len(response.data['successes']), 5)
+        self.assertNotIn('failures', response.data)
+        self._assert_failure_report(response.data['failure_report_url'], [3, 6])
+
+    def _assert_failure_report(self, url, rows):
+        """The report holds the failing rows' columns plus their errors"""
+        import csv
+        from urllib.parse import urlparse
+        from django.core.files.storage import default_storage
+
+        name = urlparse(url).path[len(default_storage.base_url):]
+        with default_storage.open(name) as f:
+            report = list(csv.DictReader(io.TextIOWrapper(f, encoding='utf-8')))
+
+        self.assertEqual(list(report[0])[-1], 'errors')
+        self.assertEqual(len(report), len(rows))
+        self.assertEqual(report[0]['pincode'], '40001')
+        self.assertIn('Pincode must be 6 digits', report[0]['errors'])
+        self.assertIn('Product fields must have same count', report[1]['errors'])
+
+
+class BulkUploadIdempotencyTests(TestCase):
+    """Row fingerprints stop re-uploads from duplicating invoices; jobs resume from their checkpoint"""
+
+    def _process(self, csv_file, **kwargs):
+        options = dict(
+            user_id='idempotency-test',
+            invoice_type='user',
+            seller_details=BENCH_SELLER_DETAILS,
+            create_as_draft=True,
+            batch_size=3,
+        )
+        options.update(kwargs)
+        return BulkInvoiceProcessor(csv_file=csv_file, **options).process()
+
+    def test_reupload_skips_created_rows(self):
+        first = self._process(make_csv_with_failures())
+        second = self._process(make_csv_with_failures(), bulk_insert=False)
+
+        self.assertEqual((second['successful'], second['failed'], second['already_created']), (0, 2, 5))
+        self.assertEqual(
+            [(s['row'], s['invoice_number']) for s in second['skipped']],
+            [(s['row'], s['invoice_number']) for s in first['successes']]
+        )
+        self.assertEqual(Invoice.objects.filter(user_id='idempotency-test').count(), 5)
+
+    def _assert_new_invoices(self, **options):
+        """A re-upload with these options creates every row again"""
+        self._process(make_bulk_csv(3))
+        second = self._process(make_bulk_csv(3), **options)
+        self.assertEqual((second['successful'], second['already_created']), (3, 0))
+        return Invoice.objects.filter(user_id='idempotency-test')
+
+    def test_drafts_then_real_invoices(self):
+        with scratch_media():
+            invoices = self._assert_new_invoices(create_as_draft=False)
+            self.assertEqual(invoices.filter(is_draft=False).count(), 3)
+            # The real invoices are idempotent among themselves
+            self.assertEqual(self._process(make_bulk_csv(3), create_as_draft=False)['already_created'], 3)
+
+    def test_another_gst_rate(self):
+        invoices = self._assert_new_invoices(gst_rate=12)
+        self.assertEqual(invoices.filter(gst_rate=12).count(), 3)
+        # The same rate written differently is the same upload
+        self.assertEqual(self._process(make_bulk_csv(3), gst_rate='12.00')['already_created'], 3)
+
+    def test_another_invoice_type(self):
+        invoices = self._assert_new_invoices(invoice_type='topmate')
+        self.assertEqual(invoices.filter(invoice_type='topmate').count(), 3)
+
+    def test_another_seller(self):
+        invoices = self._assert_new_invoices(seller_details=dict(BENCH_SELLER_DETAILS, seller_name='Other Seller'))
+        self.assertEqual(invoices.filter(seller_name='Other Seller').count(), 3)
+
+    def test_repeated_rows_are_distinct(self):
+        lines = make_bulk_csv(1).getvalue().decode('utf-8').splitlines()
+        csv_file = io.BytesIO('\n'.join(lines + lines[1:]).encode('utf-8'))
+
+        self.assertEqual(self._process(csv_file)['successful'], 2)
+        row = {'receiver_name': 'A', 'pincode': '560001'}
+        self.assertNotEqual(row_fingerprint('u', row), row_fingerprint('u', row, 1))
+        self.assertNotEqual(row_fingerprint('u', row), row_fingerprint('v', row))
+        self.assertEqual(repeat_fingerprint(row_fingerprint('u', row), 1), row_fingerprint('u', row, 1))
+
+    def test_rows_repeated_across_batches(self):
+        lines = make_bulk_csv(1).getvalue().decode('utf-8').splitlines()
+
+        def csv_file():
+            # One row seven times: rows 2-8, in batches of three
+            return io.BytesIO('\n'.join(lines[:1] + lines[1:] * 7).encode('utf-8'))
+
+        first = self._process(csv_file())
+        self.assertEqual(first['successful'], 7)
+        self.assertEqual(len(set(Invoice.objects.values_list('row_fingerprint', flat=True))), 7)
+
+        # A resumed run numbers the repeats from the rows its upload already created
+        resumed = self._process(csv_file(), batch_id=first['batch_id'], start_after_row=4)
+        self.assertEqual((resumed['successful'], resumed['already_created']), (0, 4))
+
+        second = self._process(csv_file())
+        self.assertEqual((second['successful'], second['already_created']), (0, 7))
+        self.assertEqual(Invoice.objects.count(), 7)
+
+    def test_interrupted_job_resumes_from_checkpoint(self):
+        from unittest import mock
+        from django.conf import settings
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        with scratch_media(), mock.patch.dict(settings.INVOICE_SETTINGS, {'BULK_UPLOAD_BATCH_SIZE': 3}):
+            response = self.client.post('/api/invoices/bulk-upload/', dict(
+                BENCH_SELLER_DETAILS,
+                csv_file=SimpleUploadedFile('invoices.csv', make_csv_with_failures().getvalue()),
+                user_id='idempotency-test',
+                invoice_type='user',
+                create_as_draft='true',
+            ))
+            status_url = f"/api/bulk-upload-jobs/{response.data['job_id']}/"
+
+            # The worker dies after writing rows 5-7 but before their batch is checkpointed
+            finish_pending = BulkInvoiceProcessor._finish_pending
+            calls = []
+
+            def crash_on_second_batch(processor):
+                calls.append(1)
+                if len(calls) == 2:
+                    raise RuntimeError('worker died')
+                finish_pending(processor)
+
+            with mock.patch.object(BulkInvoiceProcessor, '_finish_pending', crash_on_second_batch):
+                run_bulk_upload_worker(once=True)
+
+            job = self.client.get(status_url).data
+            self.assertEqual((job['status'], job['last_committed_row'], job['rows_processed']), ('failed', 4, 3))
+
+            self.assertEqual(self.client.post(f'{status_url}resume/').status_code, 202)
+            run_bulk_upload_worker(once=True)
+
+            job = self.client.get(status_url).data
+            self.assertEqual(job['status'], 'completed')
+            self.assertEqual(
+                (job['rows_processed'], job['successful'], job['failed'], job['already_created']),
+                (7, 3, 2, 2)
+            )
+            self.assertEqual(Invoice.objects.filter(bulk_batch_id=job['batch_id']).count(), 5)
+            rows = self.client.get(f'{status_url}results/').data
+            self.assertEqual(rows['count'], 7)
+            # Row 3 failed before the interruption and is still in the report
+            with BulkUploadJob.objects.get(pk=job['id']).failure_report.open() as report:
+                lines = report.read().decode('utf-8').splitlines()
+            self.assertEqual([line.split(',')[0] for line in lines[1:]], ['Bulk Buyer 1', 'Bulk Buyer 4'])
+
+
+class BulkRowSourceTests(TestCase):
+    """XLSX and JSON Lines uploads run through the same pipeline as CSV"""
+
+    def _rows(self):
+        import csv
+
+        return list(csv.DictReader(io.TextIOWrapper(make_csv_with_failures(), encoding='utf-8')))
+
+    def _jsonl(self):
+        """The failing CSV as JSON Lines, with native arrays for the product columns"""
+        import json
+
+        lines = []
+        for row in self._rows():
+            row['product_descriptions'] = row['product_descriptions'].split(',')
+            row['hsn_sac_codes'] = row['hsn_sac_codes'].split(',')
+            row['quantities'] = [int(q) for q in row['quantities'].split(',')]
+            row['total_values'] = [float(v) for v in row['total_values'].split(',')]
+            lines.append(json.dumps(row))
+        # Blank lines are skipped but still count towards the row (line) numbers
+        return '\n'.join(lines[:3] + [''] + lines[3:]).encode('utf-8')
+
+    def _xlsx(self):
+        """The failing CSV as a workbook, with the pincodes stored as numbers"""
+        from openpyxl import Workbook
+
+        workbook = Workbook()
+        sheet = workbook.active
+        rows = self._rows()
+        sheet.append(list(rows[0]))
+        for row in rows:
+            row['pincode'] = int(row['pincode'])
+            sheet.append(list(row.values()))
+        output = io.BytesIO()
+        workbook.save(output)
+        return output.getvalue()
+
+    def _process(self, name, content):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        with transaction.atomic():
+            result = BulkInvoiceProcessor(
+                csv_file=SimpleUploadedFile(name, content),
+                user_id='row-source-test',
+                invoice_type='user',
+                seller_details=BENCH_SELLER_DETAILS,
+                create_as_draft=True,
+                batch_size=3,
+            ).process()
+            transaction.set_rollback(True)
+        return result
+
+    def _outcomes(self, result):
+        return (
+            [(s['buyer_name'], s['total']) for s in result['successes']],
+            [f['errors'] for f in result['failures']],
+        )
+
+    def test_formats_match_csv(self):
+        expected = self._process('invoices.csv', make_csv_with_failures().getvalue())
+
+        xlsx = self._process('invoices.xlsx', self._xlsx())
+        self.assertEqual(self._outcomes(xlsx), self._outcomes(expected))
+        self.assertEqual([f['row'] for f in xlsx['failures']], [3, 6])
+
+        jsonl = self._process('invoices.jsonl', self._jsonl())
+        self.assertEqual(self._outcomes(jsonl), self._outcomes(expected))
+        self.assertEqual([f['row'] for f in jsonl['failures']], [2, 6])
+        self.assertEqual(jsonl['total_rows'], 7)
+
+    def test_jsonl_arrays_are_not_split_on_commas(self):
+        import json
+
+        row = dict(BulkRowValidatorTests.valid_row, product_descriptions=['Design, print', 'Hosting'],
+                   quantities=[1, 2.5], total_values=[118, '59.00'])
+        result = self._process('invoices.jsonl', json.dumps(row).encode('utf-8'))
+        self.assertEqual(result['successful'], 1)
+        self.assertEqual(result['successes'][0]['total'], 177.0)
+
+        data, errors = validate_csv_row(dict(BulkRowValidatorTests.valid_row, product_descriptions=['Design, print', 'Hosting']))
+        self.assertIsNone(errors)
+        self.assertEqual(data['_parsed_descriptions'], ['Design, print', 'Hosting'])
+
+    def test_malformed_jsonl_lines_fail_on_their_own(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        good = self._jsonl().split(b'\n')
+        content = b'\n'.join([good[0], b'{"receiver_name": "Broken', good[2], b'["not", "an", "object"]', good[4]])
+
+        result = self._process('invoices.jsonl', content)
+        self.assertEqual((result['total_rows'], result['successful'], result['failed']), (5, 3, 2))
+        self.assertEqual([f['row'] for f in result['failures']], [2, 4])
+        self.assertIn('Line 2 is not valid JSON', result['failures'][0]['errors'])
+        self.assertEqual(result['failures'][1]['errors'], 'Line 4 is not a JSON object')
+
+        rows = list(BulkInvoiceProcessor(
+            csv_file=SimpleUploadedFile('invoices.jsonl', content),
+            user_id='row-source-test',
+            invoice_type='user',
+            seller_details=BENCH_SELLER_DETAILS,
+        ).dry_run())
+        self.assertEqual([row['valid'] for row in rows[:-1]], [True, False, True, False, True])
+        self.assertEqual(rows[-1]['summary']['invalid'], 2)
+
+        with scratch_media():
+            response = self.client.post('/api/invoices/bulk-upload/', dict(
+                BENCH_SELLER_DETAILS,
+                csv_file=SimpleUploadedFile('invoices.jsonl', content),
+                user_id='row-source-test',
+                invoice_type='user',
+                create_as_draft='true',
+            ))
+            run_bulk_upload_worker(once=True)
+
+            job = BulkUploadJob.objects.get(pk=response.data['job_id'])
+            self.assertEqual((job.status, job.successful, job.failed), ('completed', 3, 2))
+            with job.failure_report.open() as report:
+                lines = report.read().decode('utf-8').splitlines()
+            self.assertTrue(lines[0].startswith('receiver_name,'))
+            self.assertIn('Line 2 is not valid JSON', lines[1])
+
+    def test_background_jsonl_upload(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        with scratch_media():
+            response = self.client.post('/api/invoices/bulk-upload/', dict(
+                BENCH_SELLER_DETAILS,
+                csv_file=SimpleUploadedFile('invoices.jsonl', self._jsonl()),
+                user_id='row-source-test',
+                invoice_type='user',
+                create_as_draft='true',
+            ))
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.data['total_rows'], 8)
+            run_bulk_upload_worker(once=True)
+
+            job = BulkUploadJob.objects.get(pk=response.data['job_id'])
+            self.assertTrue(job.csv_file.name.endswith('.jsonl'))
+            self.assertEqual((job.status, job.total_rows, job.successful, job.failed), ('completed', 7, 5, 2))
+
+            with job.failure_report.open() as report:
+                lines = report.read().decode('utf-8').splitlines()
+            # Arrays are written back comma-packed, ready to fix and re-upload as CSV
+            self.assertIn('"Service 1,Service 2,Service 3"', lines[1])
+
+    def test_unsupported_extension_is_rejected(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        response = self.client.post('/api/invoices/bulk-upload/', dict(
+            BENCH_SELLER_DETAILS,
+            csv_file=SimpleUploadedFile('invoices.txt', make_csv_with_failures().getvalue()),
+            user_id='row-source-test',
+            invoice_type='user',
+        ))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('csv_file', response.data['errors'])
+
+
+class BulkRowValidatorTests(TestCase):
+    """validate_csv_row accepts, rejects and reports exactly like BulkInvoiceCSVRowSerializer"""
+
+    valid_row = {
+        'receiver_name': 'Asha Rao',
+        'receiver_address': '12 MG Road, Bangalore',
+        'pincode': '560001',
+        'phone': '9876543210',
+        'email': 'asha@example.com',
+        'gstin': '29ABCDE1234F1Z5',
+        'product_descriptions': 'Consulting, Support',
+        'hsn_sac_codes': '998314,998315',
+        'quantities': '1,2.5',
+        'total_values': '118.00,59',
+    }
+
+    cases = [
+        {},
+        {'receiver_name': ''},
+        {'receiver_name': '   '},
+        {'receiver_name': 'x' * 256},
+        {'receiver_name': 'a\x00b'},
+        {'receiver_name': 'a\ud800b'},
+        {'receiver_name': 'x' * 256 + '\x00'},
+        {'receiver_address': ''},
+        {'pincode': ''},
+        {'pincode': '56001'},
+        {'pincode': '5600011'},
+        {'pincode': '56000a'},
+        {'pincode': ' 560001 '},
+        {'phone': ''},
+        {'phone': '1' * 16},
+        {'email': ''},
+        {'email': 'not-an-email'},
+        {'email': 'a@b'},
+        {'gstin': ''},
+        {'gstin': '29ABCDE1234F1Z'},
+        {'gstin': '29abcde1234f1z5'},
+        {'gstin': '29ABCDE1234F1Z55'},
+        {'product_descriptions': ''},
+        {'product_descriptions': ' , '},
+        {'hsn_sac_codes': '998314'},
+        {'quantities': '1'},
+        {'quantities': '0,1'},
+        {'quantities': '-1,1'},
+        {'quantities': 'one,1'},
+        {'quantities': 'NaN,1'},
+        {'total_values': '0,1'},
+        {'total_values': 'abc,1'},
+        {'total_values': 'Infinity,1'},
+        {'pincode': '1', 'email': 'bad', 'quantities': '0,1'},
+        {'extra_column': 'ignored'},
+    ]
+
+    def _serializer(self, row):
+        serializer = BulkInvoiceCSVRowSerializer(data=row)
+        if serializer.is_valid():
+            return dict(serializer.validated_data), None
+        return None, serializer.errors
+
+    def _assert_same(self, row):
+        expected_data, expected_errors = self._serializer(row)
+        data, errors = validate_csv_row(row)
+        self.assertEqual(data, expected_data, row)
+        # The processor reports str(errors), so compare the rendered form too
+        self.assertEqual(str(errors), str(expected_errors), row)
+        self.assertEqual(errors, expected_errors, row)
+
+    def test_matches_serializer(self):
+        for changes in self.cases:
+            self._assert_same(dict(self.valid_row, **changes))
+
+    def test_missing_and_non_string_values(self):
+        for name in ('receiver_name', 'phone', 'gstin', 'quantities'):
+            row = dict(self.valid_row)
+            del row[name]
+            self._assert_same(row)
+        self._assert_same(dict(self.valid_row, gstin=None))
+        self._assert_same(dict(self.valid_row, pincode=None))
+        self._assert_same(dict(self.valid_row, quantities=3))
+
+
+class InvoiceMailerTests(TestCase):
+    """Invoice emails share SMTP connections and survive dropped ones"""
+
+    def _messages(self, count):
+        from django.core.mail import EmailMessage
+
+        return [EmailMessage(f'Invoice {n}', 'body', 'seller@example.com', [f'buyer{n}@example.com'])
+                for n in range(count)]
+
+    def test_chunks_share_a_connection(self):
+        from django.core import mail
+        from .mailer import InvoiceMailer
+
+        with InvoiceMailer(chunk_size=2) as mailer:
+            errors = mailer.send(self._messages(5))
+        self.assertEqual(errors, [None] * 5)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(mailer.connections_opened, 3)
+
+    def test_reconnects_when_the_connection_drops(self):
+        import smtplib
+        from unittest import mock
+        from django.core.mail.backends.locmem import EmailBackend
+        from .mailer import InvoiceMailer
+
+        class DroppingBackend(EmailBackend):
+            drops = 1
+
+            def send_messages(self, messages):
+                if DroppingBackend.drops:
+                    DroppingBackend.drops -= 1
+                    raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+                return super().send_messages(messages)
+
+        rejected = smtplib.SMTPRecipientsRefused({'buyer2@example.com': (550, b'No such user')})
+        with mock.patch('invoices.mailer.get_connection', side_effect=lambda **kwargs: DroppingBackend()):
+            with InvoiceMailer() as mailer:
+                messages = self._messages(3)
+                with mock.patch.object(messages[2], 'message', side_effect=rejected):
+                    errors = mailer.send(messages)
+
+        self.assertEqual(errors[:2], [None, None])
+        self.assertIs(errors[2], rejected)
+        # One reconnect for the dropped connection, none for the refused recipient
+        self.assertEqual(mailer.connections_opened, 2)
+
+    def test_bulk_upload_sends_over_one_connection(self):
+        from django.test.utils import override_settings
+
+        with scratch_media(), local_smtp_server() as server, override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST=server.server_address[0],
+            EMAIL_PORT=server.server_address[1],
+            EMAIL_HOST_USER='',
+            EMAIL_HOST_PASSWORD='',
+            EMAIL_USE_TLS=False,
+        ):
+            result = BulkInvoiceProcessor(
+                csv_file=make_bulk_csv(3),
+                user_id='mailer-test',
+                invoice_type='user',
+                seller_details=BENCH_SELLER_DETAILS,
+                send_email=True,
+            ).process()
+            self.assertEqual([s['email_queued'] for s in result['successes']], [True] * 3)
+            self.assertEqual(server.messages, 0)
+
+            run_notification_worker(once=True)
+
+        self.assertEqual((server.connections, server.messages), (1, 3))
+
+    def test_resends_read_the_stored_pdf_once(self):
+        from unittest import mock
+        from django.db.models.fields.files import FieldFile
+        from .mailer import build_invoice_email
+        from .services import generate_invoice_pdf, get_pdf_cache
+
+        get_pdf_cache().clear()
+        with scratch_media():
+            invoice = make_invoices(1)[0]
+            generate_invoice_pdf(invoice)
+            # Rendering leaves the cache to the processes that send
+            self.assertEqual(len(get_pdf_cache()), 0)
+            with invoice.pdf_file.open('rb') as pdf:
+                pdf_content = pdf.read()
+
+            with mock.patch.object(FieldFile, 'open', autospec=True, side_effect=FieldFile.open) as opened:
+                for _ in range(3):
+                    email = build_invoice_email(invoice, to='someone@example.com')
+                    self.assertEqual(email.attachments[0][1], pdf_content)
+            self.assertEqual(opened.call_count, 1)
+
+    def test_pdf_cache_is_a_bounded_lru(self):
+        from .services import PdfCache
+
+        cache = PdfCache(max_entries=2)
+        cache.put(('INV-1', 'a'), b'one')
+        cache.put(('INV-2', 'b'), b'two')
+        self.assertEqual(cache.get(('INV-1', 'a')), b'one')
+        cache.put(('INV-3', 'c'), b'three')
+        # INV-2 was the least recently used
+        self.assertIsNone(cache.get(('INV-2', 'b')))
+        self.assertEqual(len(cache), 2)
+        # A re-render changes the content hash, so the old bytes are never returned
+        self.assertIsNone(cache.get(('INV-1', 'changed')))
+
+    def test_send_email_action(self):
+        from django.core import mail
+        from django.utils import timezone
+
+        invoice = make_invoices(1)[0]
+        with scratch_media():
+            response = self.client.post(f'/api/invoices/{invoice.id}/send_email/', {'email': 'asha@example.com'})
+            self.assertEqual(response.status_code, 202)
+            # The request only queued the render; the email waits for it
+            invoice.refresh_from_db()
+            self.assertEqual((invoice.pdf_status, bool(invoice.pdf_file)), (PDF_STATUS_PENDING, False))
+            run_notification_worker(once=True)
+            self.assertEqual(self.client.get(response.data['status_url']).data['status'], 'pending')
+            self.assertEqual(mail.outbox, [])
+
+            render_pending_pdfs()
+            NotificationOutbox.objects.update(next_attempt_at=timezone.now())
+            run_notification_worker(once=True)
+
+        self.assertEqual(self.client.get(response.data['status_url']).data['status'], 'sent')
+        self.assertEqual(mail.outbox[0].to, ['asha@example.com'])
+        self.assertEqual(mail.outbox[0].attachments[0][0], f'{invoice.invoice_number}.pdf')
+
+    def test_stale_or_draft_pdf_is_not_sent(self):
+        from .services import generate_invoice_pdf
+
+        invoice = make_invoices(1)[0]
+        with scratch_media():
+            generate_invoice_pdf(invoice)
+            # Edited after the render: the stored PDF no longer matches
+            Invoice.objects.filter(pk=invoice.pk).update(buyer_name='Changed Buyer')
+            response = self.client.post(f'/api/invoices/{invoice.id}/send_email/', {'email': 'asha@example.com'})
+            self.assertEqual(response.status_code, 202)
+            invoice.refresh_from_db()
+            self.assertEqual(invoice.pdf_status, PDF_STATUS_PENDING)
+
+            Invoice.objects.filter(pk=invoice.pk).update(is_draft=True)
+            for action, data in (('send_email', {'email': 'asha@example.com'}), ('share_whatsapp', {'phone': '9876543210'})):
+                response = self.client.post(f'/api/invoices/{invoice.id}/{action}/', data)
+                self.assertEqual(response.status_code, 400)
+
+
+class NotificationOutboxTests(InvoiceTestCase):
+    """Queued emails are delivered by the worker with backoff, dead-lettering and rate limits"""
+
+    def setUp(self):
+        from unittest import mock
+        from django.conf import settings
+        from .services import generate_invoice_pdf
+
+        super().setUp()
+        patcher = mock.patch.dict(settings.INVOICE_SETTINGS, {
+            'NOTIFICATION_MAX_ATTEMPTS': 3,
+            'NOTIFICATION_RETRY_BACKOFF': 30,
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.invoice = make_invoices(1)[0]
+        generate_invoice_pdf(self.invoice)
+
+    def _queue(self):
+        return NotificationOutbox.objects.create(
+            invoice=self.invoice,
+            channel=NotificationOutbox.CHANNEL_EMAIL,
+            recipient='buyer@example.com',
+        )
+
+    def _deliver_failing(self, error):
+        from unittest import mock
+        from .mailer import InvoiceMailer
+
+        with mock.patch.object(InvoiceMailer, 'send_one', return_value=error):
+            return deliver_due_notifications()
+
+    def test_bulk_upload_queues_with_its_invoices(self):
+        from django.core import mail
+
+        result = BulkInvoiceProcessor(
+            csv_file=make_bulk_csv(3),
+            user_id='outbox-test',
+            invoice_type='user',
+            seller_details=BENCH_SELLER_DETAILS,
+            send_email=True,
+        ).process()
+        self.assertEqual(mail.outbox, [])
+
+        url = f"/api/notifications/?batch_id={result['batch_id']}"
+        queued = self.client.get(url).data['results']
+        self.assertEqual([n['status'] for n in queued], ['pending'] * 3)
+
+        run_notification_worker(once=True)
+        self.assertEqual(len(mail.outbox), 3)
+        delivered = self.client.get(url).data['results']
+        self.assertEqual([n['status'] for n in delivered], ['sent'] * 3)
+        self.assertTrue(all(n['delivered_at'] for n in delivered))
+
+    def test_retries_with_backoff_then_dead_letters(self):
+        import smtplib
+        from datetime import timedelta
+        from django.utils import timezone
+
+        notification = self._queue()
+        throttled = smtplib.SMTPDataError(451, b'Too many messages, slow down')
+
+        for attempt, delay in ((1, 30), (2, 60)):
+            before = timezone.now()
+            self.assertEqual(self._deliver_failing(throttled), (0, 1))
+            notification.refresh_from_db()
+            self.assertEqual((notification.status, notification.attempts), ('pending', attempt))
+            self.assertGreaterEqual(notification.next_attempt_at, before + timedelta(seconds=delay))
+            # Not due yet
+            self.assertEqual(self._deliver_failing(throttled), (0, 0))
+            NotificationOutbox.objects.filter(pk=notification.pk).update(next_attempt_at=timezone.now())
+
+        self.assertEqual(self._deliver_failing(throttled), (0, 1))
+        notification.refresh_from_db()
+        self.assertEqual((notification.status, notification.attempts), ('dead', 3))
+        self.assertIn('slow down', notification.last_error)
+
+        # A dead letter can be queued again by hand
+        response = self.client.post(f'/api/notifications/{notification.id}/retry/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.data['status'], response.data['attempts']), ('pending', 0))
+        self.assertEqual(self.client.post(f'/api/notifications/{notification.id}/retry/').status_code, 400)
+
+    def test_permanent_error_is_dead_lettered_at_once(self):
+        import smtplib
+
+        notification = self._queue()
+        refused = smtplib.SMTPRecipientsRefused({'buyer@example.com': (550, b'No such user')})
+        self.assertEqual(self._deliver_failing(refused), (0, 1))
+        notification.refresh_from_db()
+        self.assertEqual((notification.status, notification.attempts), ('dead', 1))
+
+    def test_waits_for_the_pdf_without_using_an_attempt(self):
+        from django.utils import timezone
+
+        Invoice.objects.filter(pk=self.invoice.pk).update(pdf_status=PDF_STATUS_PENDING)
+        notification = self._queue()
+
+        self.assertEqual(deliver_due_notifications(), (0, 0))
+        notification.refresh_from_db()
+        self.assertEqual((notification.status, notification.attempts), ('pending', 0))
+        self.assertGreater(notification.next_attempt_at, timezone.now())
+
+    def test_token_bucket_paces_sends(self):
+        now = [0.0]
+        waits = []
+
+        def sleep(seconds):
+            waits.append(seconds)
+            now[0] += seconds
+
+        bucket = TokenBucket(rate=2, clock=lambda: now[0], sleep=sleep)
+        for _ in range(4):
+            bucket.acquire()
+        # A burst of two, then one token every half second
+        self.assertEqual(waits, [0.5, 0.5])
+
+        now[0] += 10
+        bucket.acquire()
+        self.assertEqual(len(waits), 2)
+
+
+class WhatsAppDispatcherTests(TestCase):
+    """WhatsApp messages go to Twilio concurrently over pooled connections"""
+
+    credentials = {'account_sid': 'ACtest', 'auth_token': 'secret', 'from_': 'whatsapp:+14155238886'}
+
+    def test_results_in_input_order(self):
+        from .notifications import is_permanent
+        from .whatsapp import TwilioAPIError, WhatsAppDispatcher, WhatsAppMessage
+
+        messages = [WhatsAppMessage(f'whatsapp:+91980000000{n}', f'Invoice {n}', None) for n in range(6)]
+        with local_twilio_server(latency=0.01, invalid_numbers={'whatsapp:+919800000003'}) as server:
+            with WhatsAppDispatcher(concurrency=3, base_url=server.base_url, **self.credentials) as dispatcher:
+                results = dispatcher.send(messages)
+
+        error = results.pop(3)
+        self.assertIsInstance(error, TwilioAPIError)
+        self.assertEqual((error.status, error.code), (400, 21211))
+        self.assertTrue(is_permanent(error))
+        self.assertTrue(all(sid.startswith('SM') for sid in results))
+        self.assertEqual(len(set(results)), 5)
+        # Every valid message reached Twilio, once
+        sent_to = {form['To'][0] for form in server.messages}
+        self.assertEqual(sent_to, {m.to for n, m in enumerate(messages) if n != 3})
+        # Kept-alive connections, at most one per thread
+        self.assertLessEqual(server.connections, 3)
+
+    def test_worker_delivers_queued_messages(self):
+        from django.test.utils import override_settings
+        from .services import generate_invoice_pdf
+
+        with scratch_media(), local_twilio_server(invalid_numbers={'whatsapp:+910000000000'}) as server, \
+                override_settings(TWILIO_ACCOUNT_SID='ACtest', TWILIO_AUTH_TOKEN='secret',
+                                  TWILIO_API_BASE_URL=server.base_url):
+            invoice = make_invoices(1)[0]
+            generate_invoice_pdf(invoice)
+            good, bad = (
+                NotificationOutbox.objects.create(
+                    invoice=invoice,
+                    channel=NotificationOutbox.CHANNEL_WHATSAPP,
+                    recipient=phone,
+                    base_url='https://invoices.example.com/',
+                )
+                for phone in ('+919812345678', '910000000000')
+            )
+            run_notification_worker(once=True)
+
+        good.refresh_from_db()
+        bad.refresh_from_db()
+        self.assertEqual(good.status, 'sent')
+        self.assertTrue(good.provider_message_id.startswith('SM'))
+        self.assertEqual((bad.status, bad.attempts), ('dead', 1))
+        self.assertIn('21211', bad.last_error)
+
+        form, = server.messages
+        self.assertEqual(form['To'], ['whatsapp:+919812345678'])
+        self.assertTrue(form['MediaUrl'][0].startswith('https://invoices.example.com/media/'))
+        self.assertIn(invoice.invoice_number, form['Body'][0])
+        self.assertEqual(form['StatusCallback'], ['https://invoices.example.com/api/notifications/twilio-status/'])
+
+
+class DeliveryStatusCallbackTests(TestCase):
+    """Twilio status callbacks are written in batches, acknowledged once written and reported per invoice and batch"""
+
+    url = '/api/notifications/twilio-status/'
+
+    def setUp(self):
+        from unittest import mock
+        from django.conf import settings
+        from django.test.utils import override_settings
+        from .delivery_status import get_status_buffer
+
+        twilio = override_settings(TWILIO_ACCOUNT_SID='ACtest', TWILIO_AUTH_TOKEN='secret')
+        twilio.enable()
+        self.addCleanup(twilio.disable)
+        # The test client waits for each callback, so every callback is its own batch
+        patcher = mock.patch.dict(settings.INVOICE_SETTINGS, {
+            'STATUS_CALLBACK_BATCH_SIZE': 1,
+            'STATUS_CALLBACK_FLUSH_INTERVAL': 60,
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.buffer = get_status_buffer()
+        self.addCleanup(self.buffer.flush)
+
+        self.invoice = make_invoices(1)[0]
+        Invoice.objects.filter(pk=self.invoice.pk).update(bulk_batch_id='batch-1')
+        self.notifications = [
+            NotificationOutbox.objects.create(
+                invoice=self.invoice,
+                channel=NotificationOutbox.CHANNEL_WHATSAPP,
+                recipient=f'+9198000000{n:02d}',
+                status=NotificationOutbox.STATUS_SENT,
+                provider_message_id=f'SM{n:032x}',
+            )
+            for n in range(3)
+        ]
+
+    def _callback(self, sid, message_status, signature=None, **extra):
+        import base64
+        import hashlib
+        import hmac
+        from urllib.parse import urlencode
+
+        params = {'MessageSid': sid, 'MessageStatus': message_status, **extra}
+        if signature is None:
+            payload = 'http://testserver' + self.url + ''.join(f'{k}{v}' for k, v in sorted(params.items()))
+            signature = base64.b64encode(hmac.new(b'secret', payload.encode(), hashlib.sha1).digest()).decode()
+        # Twilio posts form-encoded, not multipart
+        return self.client.post(self.url, urlencode(params), content_type='application/x-www-form-urlencoded',
+                                HTTP_X_TWILIO_SIGNATURE=signature)
+
+    def test_buffered_callbacks_are_written_in_one_batch(self):
+        from unittest import mock
+        from django.conf import settings
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from django.utils import timezone
+        from .delivery_status import DeliveryStatusBuffer, StatusUpdate
+
+        patcher = mock.patch.dict(settings.INVOICE_SETTINGS, {'STATUS_CALLBACK_BATCH_SIZE': 100})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        buffer = DeliveryStatusBuffer()
+        first, second, third = (n.provider_message_id for n in self.notifications)
+        batches = [
+            buffer.add(StatusUpdate(sid, message_status, error_code, timezone.now()))
+            for sid, message_status, error_code in (
+                (first, 'sent', ''),
+                (first, 'delivered', ''),
+                (second, 'read', ''),
+                # Arrives late: must not undo 'read'
+                (second, 'sent', ''),
+                (third, 'undelivered', '63016'),
+            )
+        ]
+
+        # Nothing is written, or acknowledged, before the batch is
+        self.assertFalse(any(batch.wait(0) for batch in batches))
+        self.assertFalse(NotificationOutbox.objects.exclude(provider_status='').exists())
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(buffer.flush(), 3)
+        writes = [q for q in queries.captured_queries if q['sql'].startswith(('UPDATE', 'INSERT'))]
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(all(batch.wait(0) for batch in batches))
+        self.assertFalse(DeliveryStatusCallback.objects.exists())
+
+        states = dict(NotificationOutbox.objects.values_list('provider_message_id', 'provider_status'))
+        self.assertEqual(states, {first: 'delivered', second: 'read', third: 'undelivered'})
+        self.assertEqual(NotificationOutbox.objects.get(provider_message_id=third).provider_error_code, '63016')
+
+        expected = {'whatsapp': {'delivered': 1, 'read': 1, 'undelivered': 1}}
+        for query in (f'invoice={self.invoice.id}', 'batch_id=batch-1'):
+            response = self.client.get(f'/api/notifications/delivery/?{query}')
+            self.assertEqual(response.data, {'total': 3, 'channels': expected})
+        self.assertEqual(self.client.get('/api/notifications/delivery/?batch_id=other').data['total'], 0)
+
+    def test_full_buffer_is_written_straight_away(self):
+        from django.utils import timezone
+        from .delivery_status import DeliveryStatusBuffer, StatusUpdate
+
+        buffer = DeliveryStatusBuffer(batch_size=2, flush_interval=60)
+        first = buffer.add(StatusUpdate(self.notifications[0].provider_message_id, 'delivered', '', timezone.now()))
+        self.assertFalse(first.wait(0))
+        second = buffer.add(StatusUpdate(self.notifications[1].provider_message_id, 'delivered', '', timezone.now()))
+        self.assertTrue(first.wait(0) and second.wait(0))
+        self.assertEqual(NotificationOutbox.objects.filter(provider_status='delivered').count(), 2)
+
+    def test_callbacks_are_acknowledged_once_written(self):
+        sid = self.notifications[0].provider_message_id
+        self.assertEqual(self._callback(sid, 'delivered').status_code, 204)
+        self.assertEqual(NotificationOutbox.objects.get(provider_message_id=sid).provider_status, 'delivered')
+
+        # An earlier state never moves a written message back
+        self.assertEqual(self._callback(sid, 'queued').status_code, 204)
+        self.assertEqual(NotificationOutbox.objects.get(provider_message_id=sid).provider_status, 'delivered')
+
+    def test_unwritten_callbacks_are_not_acknowledged(self):
+        from unittest import mock
+        from django.conf import settings
+
+        # A failed write: Twilio is asked to send the callback again
+        sid = self.notifications[0].provider_message_id
+        with mock.patch('invoices.delivery_status.write_status_updates', side_effect=RuntimeError('database is locked')), \
+                self.assertLogs('invoices.delivery_status', 'ERROR'):
+            self.assertEqual(self._callback(sid, 'delivered').status_code, 503)
+        self.assertEqual(NotificationOutbox.objects.get(provider_message_id=sid).provider_status, '')
+
+        # Neither is one whose batch is not written in time
+        with mock.patch.dict(settings.INVOICE_SETTINGS, {
+            'STATUS_CALLBACK_BATCH_SIZE': 100,
+            'STATUS_CALLBACK_ACK_TIMEOUT': 0,
+        }):
+            self.assertEqual(self._callback(sid, 'delivered').status_code, 503)
+        self.assertEqual(NotificationOutbox.objects.get(provider_message_id=sid).provider_status, '')
+
+    def test_rejects_unsigned_callbacks(self):
+        response = self._callback(self.notifications[0].provider_message_id, 'delivered', signature='forged')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(DeliveryStatusCallback.objects.exists())
+        self.assertEqual(self._callback('', 'delivered').status_code, 400)
+
+    def test_rejects_callbacks_without_credentials(self):
+        from django.test.utils import override_settings
+
+        # Nothing can be verified without the auth token, not even a "valid" signature
+        with override_settings(TWILIO_ACCOUNT_SID='', TWILIO_AUTH_TOKEN=''):
+            response = self._callback(self.notifications[0].provider_message_id, 'delivered')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(DeliveryStatusCallback.objects.exists())
+
+    def test_staged_callbacks_are_applied_by_the_worker(self):
+        from django.utils import timezone
+        from .delivery_status import StatusUpdate, stage_status_updates
+
+        # Left behind by a web process that stopped before its SID was recorded
+        sid = self.notifications[0].provider_message_id
+        stage_status_updates([StatusUpdate(sid, 'delivered', '', timezone.now())])
+        run_notification_worker(once=True)
+        self.assertEqual(NotificationOutbox.objects.get(provider_message_id=sid).provider_status, 'delivered')
+        self.assertFalse(DeliveryStatusCallback.objects.exists())
+
+    def test_callback_before_the_sid_is_recorded_is_kept(self):
+        notification = self.notifications[0]
+        NotificationOutbox.objects.filter(pk=notification.pk).update(provider_message_id='')
+
+        # Acknowledged: it is staged in the same transaction as its batch
+        self.assertEqual(self._callback(notification.provider_message_id, 'delivered').status_code, 204)
+        self.assertEqual(DeliveryStatusCallback.objects.count(), 1)
+
+        NotificationOutbox.objects.filter(pk=notification.pk).update(
+            provider_message_id=notification.provider_message_id
+        )
+        self.assertEqual(self.buffer.flush(), 1)
+        notification.refresh_from_db()
+        self.assertEqual(notification.provider_status, 'delivered')
+
+    def test_unmatched_callbacks_expire(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .delivery_status import StatusUpdate, apply_staged_updates, stage_status_updates
+
+        stage_status_updates([
+            StatusUpdate('SMunknown', 'delivered', '', timezone.now() - timedelta(hours=1)),
+            StatusUpdate('SMlater', 'delivered', '', timezone.now()),
+        ])
+        self.assertEqual(apply_staged_updates(), (0, 1))
+        self.assertEqual(list(DeliveryStatusCallback.objects.values_list('provider_message_id', flat=True)), ['SMlater'])
+
+
+class InvoiceNumberSequenceTests(TestCase):
+    """Block reservation of invoice numbers"""
+
+    def test_blocks_are_contiguous(self):
+        self.assertEqual(list(InvoiceNumberSequence.reserve_numbers('user', 'seq-test', 3)), [1, 2, 3])
+        self.assertEqual(list(InvoiceNumberSequence.reserve_numbers('user', 'seq-test', 2)), [4, 5])
+        # Separate sequences per user and for Topmate
+        self.assertEqual(list(InvoiceNumberSequence.reserve_numbers('user', 'other-user', 1)), [1])
+        self.assertEqual(list(InvoiceNumberSequence.reserve_numbers('topmate', None, 1)), [1])
+
+    def test_rolled_back_block_is_reused(self):
+        InvoiceNumberSequence.reserve_numbers('user', 'seq-test', 2)
+        with transaction.atomic():
+            InvoiceNumberSequence.reserve_numbers('user', 'seq-test', 5)
+            transaction.set_rollback(True)
+        self.assertEqual(list(InvoiceNumberSequence.reserve_numbers('user', 'seq-test', 1)), [3])
+
+    def test_concurrent_first_reservation_of_the_global_sequence(self):
+        from unittest import mock
+        from django.db.models.query import QuerySet
+
+        original_get = QuerySet.get
+        raced = []
+
+        def get(queryset, *args, **kwargs):
+            if queryset.model is InvoiceNumberSequence and not raced:
+                # Another process creates the row between our lookup and our INSERT
+                raced.append(True)
+                InvoiceNumberSequence.objects.bulk_create([
+                    InvoiceNumberSequence(sequence_type='topmate', user_id=None, current_number=7)
+                ])
+                raise InvoiceNumberSequence.DoesNotExist
+            return original_get(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'get', autospec=True, side_effect=get):
+            numbers = InvoiceNumberSequence.reserve_numbers('topmate', None, 2)
+
+        self.assertEqual(raced, [True])
+        self.assertEqual(list(numbers), [8, 9])
+        self.assertEqual(InvoiceNumberSequence.objects.filter(sequence_type='topmate').count(), 1)
+
+    def test_global_sequence_is_unique(self):
+        from django.db import IntegrityError
+
+        InvoiceNumberSequence.objects.create(sequence_type='topmate', user_id=None)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            InvoiceNumberSequence.objects.create(sequence_type='topmate', user_id=None)
+
+    def test_formatted_numbers(self):
+        numbers = InvoiceNumberSequence.reserve_invoice_numbers('topmate', count=2)
+        self.assertEqual(numbers, ['TM-INV-000001', 'TM-INV-000002'])
+
+        sequence = InvoiceNumberSequence.objects.get(sequence_type='topmate', user_id=None)
+        self.assertEqual(sequence.get_next_number(), 3)
+        self.assertEqual(sequence.current_number, 3)
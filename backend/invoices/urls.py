@@ -1,11 +1,13 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import BusinessProfileViewSet, InvoiceViewSet
+from .views import BusinessProfileViewSet, InvoiceViewSet, BulkUploadJobViewSet, NotificationViewSet
 
 # Create router and register viewsets
 router = DefaultRouter()
 router.register(r'business-profiles', BusinessProfileViewSet, basename='businessprofile')
 router.register(r'invoices', InvoiceViewSet, basename='invoice')
+router.register(r'bulk-upload-jobs', BulkUploadJobViewSet, basename='bulkuploadjob')
+router.register(r'notifications', NotificationViewSet, basename='notification')
 
 app_name = 'invoices'
 
@@ -3,18 +3,52 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
 from rest_framework.parsers import MultiPartParser, FormParser
-from django.http import FileResponse, HttpResponse
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from .models import BusinessProfile, Invoice, InvoiceItem
+from django.core.files.storage import default_storage
+from .models import (
+    BusinessProfile,
+    Invoice,
+    InvoiceItem,
+    BulkUploadJob,
+    NotificationOutbox,
+    PDF_STATUS_PENDING,
+    PDF_STATUS_RENDERING,
+    PDF_STATUS_READY,
+    PDF_STATUS_FAILED,
+)
 from .serializers import (
     BusinessProfileSerializer,
     InvoiceSerializer,
     InvoiceCreateSerializer,
-    InvoiceListSerializer
+    InvoiceListSerializer,
+    NotificationOutboxSerializer
 )
 import json
 
 
+def ndjson_response(lines):
+    """
+    Stream an iterable of JSON-serialisable objects as newline-delimited JSON
+    The 200 goes out before the lines are produced, so an error raised while
+    streaming ends the body with an {"error": ...} line instead of cutting it
+    short; a stream without a summary line is incomplete.
+    """
+    response = StreamingHttpResponse(_ndjson_lines(lines), content_type='application/x-ndjson')
+    # Stop proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _ndjson_lines(lines):
+    try:
+        for line in lines:
+            yield json.dumps(line) + '\n'
+    except Exception as e:
+        print(f"Error while streaming response: {e}")
+        yield json.dumps({'error': str(e)}) + '\n'
+
+
 class BusinessProfileViewSet(viewsets.ModelViewSet):
     """
     ViewSet for managing user business profiles
@@ -103,6 +137,10 @@ class InvoiceViewSet(viewsets.ModelViewSet):
 
         invoice = serializer.save()
 
+        # Render the PDF in the background so the first download is ready
+        from .pdf_queue import queue_invoice_pdf
+        queue_invoice_pdf(invoice)
+
         # Return full invoice data
         response_serializer = InvoiceSerializer(invoice)
         return Response(
@@ -110,23 +148,76 @@ class InvoiceViewSet(viewsets.ModelViewSet):
             status=status.HTTP_201_CREATED
         )
 
+    def perform_update(self, serializer):
+        """Queue a fresh PDF render whenever the invoice is edited"""
+        from .pdf_queue import queue_invoice_pdf
+
+        invoice = serializer.save()
+        queue_invoice_pdf(invoice)
+
+    def _pdf_pending_response(self, invoice):
+        """202 telling the client to come back once the background render is done"""
+        from django.conf import settings
+
+        retry_after = settings.INVOICE_SETTINGS.get('PDF_RETRY_AFTER', 2)
+        response = Response({
+            'message': 'PDF is being generated, retry shortly',
+            'pdf_status': invoice.pdf_status,
+            'retry_after': retry_after,
+        }, status=status.HTTP_202_ACCEPTED)
+        response['Retry-After'] = str(retry_after)
+        return response
+
     @action(detail=True, methods=['get'])
     def download_pdf(self, request, pk=None):
-        """Download invoice as PDF"""
+        """
+        Download invoice as PDF
+
+        PDFs are rendered by the background worker (run_pdf_worker). While a
+        render is pending or in progress this returns 202 with a Retry-After
+        header instead of the file.
+
+        Query params:
+        - stream: Boolean (default: False) - Render straight into a chunked
+          response instead of waiting for the background worker (always
+          the case for drafts)
+        - persist: Boolean (default: True) - With stream=true, also store the
+          rendered PDF once it has been sent
+        """
         invoice = self.get_object()
 
-        # Check if PDF exists
-        if not invoice.pdf_file:
-            # Generate PDF if not exists
-            from .services import generate_invoice_pdf
+        from .pdf_queue import queue_invoice_pdf
+        from .services import is_pdf_current, stream_invoice_pdf
+
+        stream = request.query_params.get('stream', 'false').lower() == 'true'
+        # Drafts are never picked up by the background worker, so a draft
+        # preview is always rendered into the response
+        if (stream or invoice.is_draft) and not is_pdf_current(invoice):
+            persist = request.query_params.get('persist', 'true').lower() == 'true'
             try:
-                generate_invoice_pdf(invoice)
+                content_length, chunks = stream_invoice_pdf(invoice, persist=persist)
             except Exception as e:
                 return Response(
                     {'error': f'Failed to generate PDF: {str(e)}'},
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR
                 )
 
+            response = StreamingHttpResponse(chunks, content_type='application/pdf')
+            response['Content-Length'] = content_length
+            response['Content-Disposition'] = f'attachment; filename="{invoice.invoice_number}.pdf"'
+            return response
+
+        # Missing or stale PDFs are left to the background worker
+        if not is_pdf_current(invoice):
+            if invoice.pdf_status == PDF_STATUS_FAILED:
+                return Response(
+                    {'error': f'Failed to generate PDF: {invoice.pdf_error}', 'pdf_status': invoice.pdf_status},
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
+            if invoice.pdf_status not in (PDF_STATUS_PENDING, PDF_STATUS_RENDERING):
+                queue_invoice_pdf(invoice)
+            return self._pdf_pending_response(invoice)
+
         # Return PDF file
         try:
             response = FileResponse(
@@ -143,26 +234,44 @@ class InvoiceViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['post'])
     def generate_pdf(self, request, pk=None):
-        """Generate/regenerate PDF for invoice"""
+        """
+        Queue generation/regeneration of the invoice PDF
+        Rendering is skipped if the stored PDF matches the invoice content,
+        pass force=true to re-render anyway. Also retries failed renders.
+        """
         invoice = self.get_object()
+        force = str(request.data.get('force', '')).lower() == 'true'
 
-        from .services import generate_invoice_pdf
-        try:
-            pdf_path = generate_invoice_pdf(invoice)
+        from .pdf_queue import queue_invoice_pdf
+        from .services import is_pdf_current
+
+        if not force and is_pdf_current(invoice):
             return Response({
-                'message': 'PDF generated successfully',
+                'message': 'PDF is up to date',
+                'pdf_status': invoice.pdf_status,
                 'pdf_url': invoice.pdf_url,
                 'pdf_file': invoice.pdf_file.url if invoice.pdf_file else None
             })
-        except Exception as e:
+
+        if invoice.is_draft:
             return Response(
-                {'error': f'Failed to generate PDF: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {'error': 'Draft PDFs are rendered on download; finalize the invoice to queue it'},
+                status=status.HTTP_400_BAD_REQUEST
             )
 
+        if force or invoice.pdf_status not in (PDF_STATUS_PENDING, PDF_STATUS_RENDERING):
+            queue_invoice_pdf(invoice, force=force)
+        return self._pdf_pending_response(invoice)
+
     @action(detail=True, methods=['post'])
     def send_email(self, request, pk=None):
-        """Send invoice PDF via email"""
+        """
+        Queue the invoice PDF for delivery by email
+
+        A missing or stale PDF is queued for the background worker and the
+        email waits for it. Returns 202; the notification worker (python manage.py run_notification_worker)
+        sends it, retrying with backoff. Poll status_url for the outcome.
+        """
         invoice = self.get_object()
         email = request.data.get('email')
 
@@ -172,68 +281,26 @@ class InvoiceViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Generate PDF if not exists
-        if not invoice.pdf_file:
-            from .services import generate_invoice_pdf
-            try:
-                generate_invoice_pdf(invoice)
-            except Exception as e:
-                return Response(
-                    {'error': f'Failed to generate PDF: {str(e)}'},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-
-        # Send email with PDF attachment
-        from django.core.mail import EmailMessage
-        from django.conf import settings
-
-        try:
-            subject = f'Invoice {invoice.invoice_number} - Rs.{invoice.total}'
-            body = f"""Dear {invoice.buyer_name},
-
-Please find attached your invoice {invoice.invoice_number}.
-
-Invoice Details:
-- Invoice Number: {invoice.invoice_number}
-- Date: {invoice.invoice_date.strftime('%d/%m/%Y')}
-- Total Amount: Rs.{invoice.total}
-
-Thank you for your business!
-
-Best regards,
-{invoice.seller_name}"""
-
-            email_message = EmailMessage(
-                subject=subject,
-                body=body,
-                from_email=settings.DEFAULT_FROM_EMAIL if hasattr(settings, 'DEFAULT_FROM_EMAIL') else 'noreply@invoice.com',
-                to=[email],
-            )
-
-            # Attach PDF
-            invoice.pdf_file.open('rb')
-            email_message.attach(
-                f'{invoice.invoice_number}.pdf',
-                invoice.pdf_file.read(),
-                'application/pdf'
-            )
-            invoice.pdf_file.close()
+        # The notification waits for the background render
+        error_response = self._queue_pdf_for_delivery(invoice)
+        if error_response is not None:
+            return error_response
 
-            email_message.send(fail_silently=False)
+        from .notifications import build_notifications, queue_notifications
 
-            return Response({
-                'message': f'Invoice sent successfully to {email}',
-                'invoice_number': invoice.invoice_number
-            })
-        except Exception as e:
-            return Response(
-                {'error': f'Failed to send email: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+        notification, = queue_notifications(build_notifications(invoice, email=email))
+        return self._notification_queued_response(
+            notification, request, f'Invoice queued for delivery to {email}'
+        )
 
     @action(detail=True, methods=['post'])
     def share_whatsapp(self, request, pk=None):
-        """Send invoice PDF via WhatsApp using Twilio"""
+        """
+        Queue the invoice PDF for delivery over WhatsApp (Twilio)
+
+        Returns 202 like send_email. Without Twilio credentials nothing is queued;
+        a wa.me link carrying the invoice details is returned instead.
+        """
         invoice = self.get_object()
         phone = request.data.get('phone')
 
@@ -243,91 +310,67 @@ Best regards,
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Generate PDF if not exists
-        if not invoice.pdf_file:
-            from .services import generate_invoice_pdf
-            try:
-                generate_invoice_pdf(invoice)
-            except Exception as e:
-                return Response(
-                    {'error': f'Failed to generate PDF: {str(e)}'},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
+        # The notification waits for the background render
+        error_response = self._queue_pdf_for_delivery(invoice)
+        if error_response is not None:
+            return error_response
 
-        from django.conf import settings
+        from .notifications import build_notifications, queue_notifications, whatsapp_configured, whatsapp_link
 
         # Check if Twilio is configured
-        if not settings.TWILIO_ACCOUNT_SID or not settings.TWILIO_AUTH_TOKEN:
-            # Fallback to wa.me link with PDF URL
-            pdf_url = request.build_absolute_uri(invoice.pdf_file.url)
-            message = f"""Hello {invoice.buyer_name},
-
-Here is your invoice:
-
-*Invoice #{invoice.invoice_number}*
-Date: {invoice.invoice_date.strftime('%d/%m/%Y')}
-Amount: ₹{invoice.total}
-
-Download PDF: {pdf_url}
-
-Thank you for your business!
-- {invoice.seller_name}"""
-
-            import urllib.parse
-            encoded_message = urllib.parse.quote(message)
-            whatsapp_link = f"https://wa.me/{phone}?text={encoded_message}"
-
+        if not whatsapp_configured():
+            # Fallback to wa.me link; until the render is done, link the
+            # download endpoint (it answers 202 until the file is ready)
+            from django.urls import reverse
+            if invoice.pdf_status == PDF_STATUS_READY:
+                pdf_url = request.build_absolute_uri(invoice.pdf_file.url)
+            else:
+                pdf_url = request.build_absolute_uri(reverse('invoices:invoice-download-pdf', args=[invoice.pk]))
+            message, link = whatsapp_link(invoice, phone, pdf_url)
             return Response({
-                'whatsapp_link': whatsapp_link,
+                'whatsapp_link': link,
                 'message': message,
                 'pdf_url': pdf_url,
                 'note': 'Twilio not configured. Using fallback method. Configure Twilio to send PDF directly.'
             })
 
-        # Send via Twilio WhatsApp API with PDF attachment
-        try:
-            from twilio.rest import Client
-
-            # Initialize Twilio client
-            client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
-
-            # Get the full public URL to the PDF file
-            pdf_url = request.build_absolute_uri(invoice.pdf_file.url)
-
-            # Format phone number for WhatsApp
-            to_whatsapp = f"whatsapp:+{phone.lstrip('+')}"
-
-            # Create message body
-            message_body = f"""Hello {invoice.buyer_name},
-
-Your invoice is ready!
-
-Invoice #: {invoice.invoice_number}
-Date: {invoice.invoice_date.strftime('%d/%m/%Y')}
-Amount: ₹{invoice.total}
-
-Thank you for your business!
-- {invoice.seller_name}"""
+        notification, = queue_notifications(
+            build_notifications(invoice, phone=phone, base_url=request.build_absolute_uri('/'))
+        )
+        return self._notification_queued_response(
+            notification, request, 'Invoice queued for delivery via WhatsApp'
+        )
 
-            # Send WhatsApp message with PDF attachment
-            message = client.messages.create(
-                from_=settings.TWILIO_WHATSAPP_FROM,
-                body=message_body,
-                to=to_whatsapp,
-                media_url=[pdf_url]  # Attach PDF
-            )
+    def _queue_pdf_for_delivery(self, invoice):
+        """
+        Queue a render unless the stored PDF is current or one is already
+        under way (deliver_due_notifications waits for it)
+        Returns:
+            Response: error for invoices that cannot be sent, else None
+        """
+        from .pdf_queue import queue_invoice_pdf
+        from .services import is_pdf_current
 
-            return Response({
-                'message': 'Invoice sent successfully via WhatsApp',
-                'invoice_number': invoice.invoice_number,
-                'whatsapp_sid': message.sid,
-                'status': message.status
-            })
-        except Exception as e:
+        if invoice.is_draft:
             return Response(
-                {'error': f'Failed to send WhatsApp message: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {'error': 'Draft invoices cannot be sent; finalize the invoice first'},
+                status=status.HTTP_400_BAD_REQUEST
             )
+        if invoice.pdf_status in (PDF_STATUS_PENDING, PDF_STATUS_RENDERING):
+            return None
+        if invoice.pdf_status != PDF_STATUS_READY or not is_pdf_current(invoice):
+            queue_invoice_pdf(invoice)
+        return None
+
+    def _notification_queued_response(self, notification, request, message):
+        """202 pointing at a queued notification"""
+        return Response({
+            'message': message,
+            'invoice_number': notification.invoice.invoice_number,
+            'notification_id': notification.id,
+            'status': notification.status,
+            'status_url': request.build_absolute_uri(f"/api/notifications/{notification.id}/"),
+        }, status=status.HTTP_202_ACCEPTED)
 
     @action(detail=True, methods=['post'])
     def finalize(self, request, pk=None):
@@ -343,12 +386,9 @@ Thank you for your business!
         invoice.is_draft = False
         invoice.save()
 
-        # Generate PDF
-        from .services import generate_invoice_pdf
-        try:
-            generate_invoice_pdf(invoice)
-        except Exception as e:
-            pass  # PDF generation failure shouldn't block finalization
+        # Render in the background; failures are recorded in pdf_status/pdf_error
+        from .pdf_queue import queue_invoice_pdf
+        queue_invoice_pdf(invoice)
 
         serializer = self.get_serializer(invoice)
         return Response(serializer.data)
@@ -375,6 +415,130 @@ Thank you for your business!
 
         return Response(summary)
 
+    def _get_export_invoices(self, request):
+        """
+        Resolve the invoices for a multi-invoice export from invoice_ids or batch_id
+        Returns:
+            tuple: (queryset, base filename, error Response or None)
+        """
+        params = request.data if request.method == 'POST' else request.query_params
+        invoice_ids = params.get('invoice_ids')
+        batch_id = params.get('batch_id')
+
+        if invoice_ids:
+            if isinstance(invoice_ids, str):
+                invoice_ids = [i.strip() for i in invoice_ids.split(',') if i.strip()]
+            try:
+                invoice_ids = [int(i) for i in invoice_ids]
+            except (TypeError, ValueError):
+                return None, None, Response(
+                    {'error': 'invoice_ids must be a list of integers'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            invoices = Invoice.objects.filter(id__in=invoice_ids)
+            filename = 'invoices'
+        elif batch_id:
+            invoices = Invoice.objects.filter(bulk_batch_id=batch_id)
+            filename = f'invoices-{batch_id}'
+        else:
+            return None, None, Response(
+                {'error': 'invoice_ids or batch_id is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        invoices = invoices.filter(is_draft=False).order_by('id')
+        if not invoices.exists():
+            return None, None, Response(
+                {'error': 'No finalized invoices found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        return invoices, filename, None
+
+    @action(detail=False, methods=['get', 'post'], url_path='download-zip', url_name='download-zip')
+    def download_zip(self, request):
+        """
+        Download many invoice PDFs as a single streamed ZIP
+
+        GET/POST /api/invoices/download-zip/
+
+        Params (query string or body):
+        - invoice_ids: List or comma-separated string of invoice IDs
+        - batch_id: Bulk upload batch ID (alternative to invoice_ids)
+
+        PDFs that are missing or stale are rendered while the ZIP streams.
+        """
+        from .services import stream_invoice_pdf_zip
+
+        invoices, filename, error = self._get_export_invoices(request)
+        if error:
+            return error
+
+        response = StreamingHttpResponse(
+            stream_invoice_pdf_zip(invoices.iterator(chunk_size=200)),
+            content_type='application/zip'
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}.zip"'
+        return response
+
+    @action(detail=False, methods=['get', 'post'], url_path='merged-pdf', url_name='merged-pdf')
+    def merged_pdf(self, request):
+        """
+        Download many invoices merged into one printable PDF
+
+        GET/POST /api/invoices/merged-pdf/
+
+        Params (query string or body):
+        - invoice_ids: List or comma-separated string of invoice IDs
+        - batch_id: Bulk upload batch ID (alternative to invoice_ids)
+
+        At most INVOICE_SETTINGS['MERGED_PDF_MAX_INVOICES'] invoices per request.
+        """
+        import tempfile
+        from django.conf import settings
+        from .services import render_merged_invoice_pdf, MERGED_PDF_SPOOL_SIZE
+
+        invoices, filename, error = self._get_export_invoices(request)
+        if error:
+            return error
+
+        # The whole document is assembled before the first byte is sent
+        max_invoices = settings.INVOICE_SETTINGS.get('MERGED_PDF_MAX_INVOICES', 500)
+        if max_invoices and invoices.count() > max_invoices:
+            return Response(
+                {'error': f'At most {max_invoices} invoices can be merged into one PDF, '
+                          f'use download-zip for larger exports'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Sent from a spooled file, so the rendered bytes are not held for
+        # the whole download
+        pdf_file = tempfile.SpooledTemporaryFile(max_size=MERGED_PDF_SPOOL_SIZE)
+        try:
+            render_merged_invoice_pdf(invoices.prefetch_related('items').iterator(chunk_size=200), pdf_file)
+        except Exception as e:
+            pdf_file.close()
+            return Response(
+                {'error': f'Failed to generate PDF: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        pdf_file.seek(0)
+        # FileResponse sets Content-Length from the file and closes it when done
+        response = FileResponse(pdf_file, content_type='application/pdf')
+        response['Content-Disposition'] = f'attachment; filename="{filename}.pdf"'
+        return response
+
+    @action(detail=False, methods=['get'], url_path='render-stats', url_name='render-stats')
+    def render_stats(self, request):
+        """Per-engine PDF render latency counters for this server process"""
+        from .renderers import get_render_stats, get_wkhtmltopdf_path
+
+        return Response({
+            'wkhtmltopdf_available': get_wkhtmltopdf_path() is not None,
+            'engines': get_render_stats(),
+        })
+
     @action(detail=False, methods=['post'], url_path='bulk-upload', url_name='bulk-upload')
     def bulk_upload(self, request):
         """
@@ -383,18 +547,38 @@ Thank you for your business!
         POST /api/invoices/bulk-upload/
 
         Form data:
-        - csv_file: CSV file
+        - csv_file: CSV, XLSX (first worksheet) or JSON Lines (.jsonl) file with the
+          same columns; in JSON Lines the product columns may be arrays instead of
+          comma-separated strings
         - invoice_type: 'topmate' or 'user'
         - user_id: User ID
         - create_as_draft: Boolean (default: False)
         - send_email: Boolean (default: False) - Send invoice PDFs via email to receivers
         - send_whatsapp: Boolean (default: False) - Send invoice PDFs via WhatsApp to receivers
         - seller_* fields: Required if invoice_type='user'
+        - background: Boolean (default: True) - Queue the upload and return 202 with a job ID;
+          false processes it inside the request and returns every result
+        - dry_run: Boolean (default: False) - Only validate and price the rows; nothing is
+          written. Streams application/x-ndjson: one line per row, then a summary line
+        - stream: Boolean (default: False) - Process inside the request but stream
+          application/x-ndjson: each row's result (tagged with 'outcome') as its batch
+          completes, then a summary line. Per-row results are not held in memory
+
+        Emails and WhatsApp messages are queued in the notification outbox with their
+        invoices and delivered by `python manage.py run_notification_worker`; rows report
+        email_queued/whatsapp_queued.
+
+        Failing rows are not returned in full: failure_report_url links to a CSV of them
+        (the uploaded columns plus an errors column) that can be fixed and re-uploaded.
 
         Note: send_email and send_whatsapp cannot be used with create_as_draft=true
+
+        Background uploads are run by `python manage.py run_bulk_upload_worker`; poll
+        status_url for progress and page through results_url for per-row outcomes.
         """
         from .bulk_upload_serializers import BulkInvoiceUploadSerializer
         from .bulk_upload_service import BulkInvoiceProcessor
+        from .bulk_jobs import queue_bulk_upload
 
         # Set parser classes for this request
         request.parsers = [MultiPartParser(), FormParser()]
@@ -420,6 +604,46 @@ Thank you for your business!
             'seller_email': validated_data.get('seller_email', ''),
         }
 
+        if validated_data['dry_run']:
+            processor = BulkInvoiceProcessor(
+                csv_file=validated_data['csv_file'],
+                user_id=validated_data['user_id'],
+                invoice_type=validated_data['invoice_type'],
+                seller_details=seller_details,
+                create_as_draft=validated_data['create_as_draft'],
+                gst_rate=validated_data.get('gst_rate', 18.00),
+            )
+            try:
+                lines = processor.dry_run()
+            except ValueError as e:
+                return Response(
+                    {'error': f'Failed to process CSV: {str(e)}'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            return ndjson_response(lines)
+
+        if validated_data['background'] and not validated_data['stream']:
+            job = queue_bulk_upload(
+                csv_file=validated_data['csv_file'],
+                user_id=validated_data['user_id'],
+                invoice_type=validated_data['invoice_type'],
+                seller_details=seller_details,
+                create_as_draft=validated_data['create_as_draft'],
+                send_email=validated_data.get('send_email', False),
+                send_whatsapp=validated_data.get('send_whatsapp', False),
+                gst_rate=validated_data.get('gst_rate', 18.00),
+                base_url=request.build_absolute_uri('/'),
+            )
+            status_url = request.build_absolute_uri(f"/api/bulk-upload-jobs/{job.id}/")
+            return Response({
+                'message': f"Upload queued as job {job.id}.",
+                'job_id': job.id,
+                'status': job.status,
+                'total_rows': job.total_rows,
+                'status_url': status_url,
+                'results_url': f"{status_url}results/",
+            }, status=status.HTTP_202_ACCEPTED)
+
         try:
             processor = BulkInvoiceProcessor(
                 csv_file=validated_data['csv_file'],
@@ -430,53 +654,280 @@ Thank you for your business!
                 send_email=validated_data.get('send_email', False),
                 send_whatsapp=validated_data.get('send_whatsapp', False),
                 gst_rate=validated_data.get('gst_rate', 18.00),
-                request=request
+                request=request,
+                # Failing rows are written to a downloadable CSV, not returned inline
+                failure_report=True
             )
 
+            if validated_data['stream']:
+                lines = processor.stream()
+                return ndjson_response(self._stream_bulk_upload(lines, request, validated_data))
+
             result = processor.process()
 
             # Build response with download links and sending statistics
-            email_sent_count = 0
-            whatsapp_sent_count = 0
-
-            for success in result['successes']:
-                invoice_id = success['invoice_id']
-                success['download_url'] = request.build_absolute_uri(
-                    f"/api/invoices/{invoice_id}/download_pdf/"
-                )
+            for skipped in result['skipped']:
+                self._add_download_url(skipped, request)
 
-                # Count successful sends
-                if success.get('email_sent'):
-                    email_sent_count += 1
-                if success.get('whatsapp_sent'):
-                    whatsapp_sent_count += 1
+            email_queued_count = 0
+            whatsapp_queued_count = 0
 
-            # Build summary message
-            message_parts = [
-                f"Processed {result['total_rows']} rows. "
-                f"{result['successful']} successful, {result['failed']} failed."
-            ]
+            for success in result['successes']:
+                self._add_download_url(success, request)
 
-            if validated_data.get('send_email'):
-                message_parts.append(f"{email_sent_count} emails sent.")
-            if validated_data.get('send_whatsapp'):
-                message_parts.append(f"{whatsapp_sent_count} WhatsApp messages sent.")
+                # Count queued sends
+                if success.get('email_queued'):
+                    email_queued_count += 1
+                if success.get('whatsapp_queued'):
+                    whatsapp_queued_count += 1
 
-            return Response({
-                'message': ' '.join(message_parts),
-                'summary': {
-                    'total_rows': result['total_rows'],
-                    'successful': result['successful'],
-                    'failed': result['failed'],
-                    'emails_sent': email_sent_count if validated_data.get('send_email') else None,
-                    'whatsapp_sent': whatsapp_sent_count if validated_data.get('send_whatsapp') else None
-                },
-                'successes': result['successes'],
-                'failures': result['failures']
-            }, status=status.HTTP_200_OK if result['successful'] > 0 else status.HTTP_400_BAD_REQUEST)
+            return Response(dict(
+                self._bulk_upload_summary(result, email_queued_count, whatsapp_queued_count, request, validated_data),
+                successes=result['successes'],
+                already_created=result['skipped']
+            ), status=status.HTTP_200_OK if result['successful'] or result['already_created'] else status.HTTP_400_BAD_REQUEST)
 
         except Exception as e:
             return Response(
                 {'error': f'Failed to process CSV: {str(e)}'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+    def _stream_bulk_upload(self, lines, request, validated_data):
+        """Add download links to streamed row results and turn the final line into the upload summary"""
+        email_queued_count = 0
+        whatsapp_queued_count = 0
+        for line in lines:
+            if 'summary' in line:
+                yield {'summary': self._bulk_upload_summary(
+                    line['summary'], email_queued_count, whatsapp_queued_count, request, validated_data
+                )}
+                continue
+            if line['outcome'] != 'failure':
+                self._add_download_url(line, request)
+            if line.get('email_queued'):
+                email_queued_count += 1
+            if line.get('whatsapp_queued'):
+                whatsapp_queued_count += 1
+            yield line
+
+    def _add_download_url(self, result, request):
+        """Link a bulk upload result to its invoice's PDF"""
+        result['download_url'] = request.build_absolute_uri(
+            f"/api/invoices/{result['invoice_id']}/download_pdf/"
+        )
+
+    def _bulk_upload_summary(self, result, email_queued_count, whatsapp_queued_count, request, validated_data):
+        """Message, ZIP link and counts for a finished bulk upload"""
+        # Build summary message
+        message_parts = [
+            f"Processed {result['total_rows']} rows. "
+            f"{result['successful']} successful, {result['failed']} failed."
+        ]
+
+        if result['already_created']:
+            message_parts.append(f"{result['already_created']} already created by an earlier upload.")
+
+        if validated_data.get('send_email'):
+            message_parts.append(f"{email_queued_count} emails queued.")
+        if validated_data.get('send_whatsapp'):
+            message_parts.append(f"{whatsapp_queued_count} WhatsApp messages queued.")
+
+        return {
+            'message': ' '.join(message_parts),
+            'batch_id': result['batch_id'],
+            'zip_download_url': request.build_absolute_uri(
+                f"/api/invoices/download-zip/?batch_id={result['batch_id']}"
+            ) if result['successful'] > 0 and not validated_data['create_as_draft'] else None,
+            'failure_report_url': request.build_absolute_uri(
+                default_storage.url(result['failure_report'])
+            ) if result['failure_report'] else None,
+            'summary': {
+                'total_rows': result['total_rows'],
+                'successful': result['successful'],
+                'failed': result['failed'],
+                'already_created': result['already_created'],
+                'emails_queued': email_queued_count if validated_data.get('send_email') else None,
+                'whatsapp_queued': whatsapp_queued_count if validated_data.get('send_whatsapp') else None
+            },
+        }
+
+
+class BulkUploadJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Progress and per-row results of background bulk uploads
+    """
+    permission_classes = [AllowAny]  # For development
+
+    def get_serializer_class(self):
+        from .bulk_upload_serializers import BulkUploadJobSerializer
+        return BulkUploadJobSerializer
+
+    def get_queryset(self):
+        """Filter jobs by user_id and status"""
+        queryset = BulkUploadJob.objects.all()
+
+        user_id = self.request.query_params.get('user_id')
+        if user_id:
+            queryset = queryset.filter(user_id=user_id)
+
+        job_status = self.request.query_params.get('status')
+        if job_status:
+            queryset = queryset.filter(status=job_status)
+
+        return queryset
+
+    @action(detail=True, methods=['post'])
+    def resume(self, request, pk=None):
+        """
+        Queue a failed job again, continuing after its last committed row
+
+        POST /api/bulk-upload-jobs/{id}/resume/
+        """
+        from .bulk_jobs import resume_job
+
+        job = self.get_object()
+        if not resume_job(job):
+            return Response(
+                {'error': f'Only failed jobs can be resumed (job is {job.status})'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['get'])
+    def results(self, request, pk=None):
+        """
+        Per-row outcomes recorded so far, in CSV row order
+
+        GET /api/bulk-upload-jobs/{id}/results/?outcome=success|failure&page=N
+        Each entry is shaped like the synchronous upload's successes/failures entries.
+        """
+        from django.conf import settings
+        from rest_framework.pagination import PageNumberPagination
+
+        job = self.get_object()
+        queryset = job.results.all()
+
+        outcome = request.query_params.get('outcome')
+        if outcome == 'success':
+            queryset = queryset.filter(success=True)
+        elif outcome == 'failure':
+            queryset = queryset.filter(success=False)
+        elif outcome:
+            return Response(
+                {'error': "outcome must be 'success' or 'failure'"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        paginator = PageNumberPagination()
+        paginator.page_size = settings.INVOICE_SETTINGS.get('BULK_UPLOAD_RESULTS_PAGE_SIZE', 100)
+        page = paginator.paginate_queryset(queryset.values_list('data', flat=True), request, view=self)
+        return paginator.get_paginated_response(page)
+
+
+class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Delivery state of queued emails and WhatsApp messages
+    """
+    permission_classes = [AllowAny]  # For development
+    serializer_class = NotificationOutboxSerializer
+
+    def get_queryset(self):
+        """Filter notifications by invoice, bulk upload batch, channel and status"""
+        queryset = NotificationOutbox.objects.select_related('invoice')
+
+        invoice_id = self.request.query_params.get('invoice')
+        if invoice_id:
+            queryset = queryset.filter(invoice_id=invoice_id)
+
+        batch_id = self.request.query_params.get('batch_id')
+        if batch_id:
+            queryset = queryset.filter(invoice__bulk_batch_id=batch_id)
+
+        channel = self.request.query_params.get('channel')
+        if channel:
+            queryset = queryset.filter(channel=channel)
+
+        notification_status = self.request.query_params.get('status')
+        if notification_status:
+            queryset = queryset.filter(status=notification_status)
+
+        return queryset
+
+    @action(detail=False, methods=['get'])
+    def delivery(self, request):
+        """
+        Delivery state counts for the filtered notifications, e.g. one
+        invoice or one bulk upload batch
+
+        GET /api/notifications/delivery/?invoice={id}
+        GET /api/notifications/delivery/?batch_id={batch_id}
+        Returns: {"total": 3, "channels": {"whatsapp": {"delivered": 2, "failed": 1}}}
+        """
+        from .delivery_status import delivery_summary
+
+        queryset = self.get_queryset()
+        return Response({
+            'total': queryset.count(),
+            'channels': delivery_summary(queryset),
+        })
+
+    @action(detail=False, methods=['post'], url_path='twilio-status', parser_classes=[FormParser])
+    def twilio_status(self, request):
+        """
+        Twilio status callback (set as the StatusCallback of every WhatsApp message)
+
+        POST /api/notifications/twilio-status/
+        Form fields: MessageSid, MessageStatus, ErrorCode (optional)
+        Each callback is written to its notification in a batch and only
+        acknowledged once the batch is committed; otherwise the endpoint
+        answers 503 so Twilio retries it (see delivery_status.py).
+        """
+        from django.conf import settings
+        from django.utils import timezone
+        from .delivery_status import PROVIDER_STATUS_RANK, StatusUpdate, get_status_buffer, valid_twilio_signature
+
+        # Without the auth token no signature can be checked, so nothing is accepted
+        if not settings.TWILIO_AUTH_TOKEN:
+            return Response({'error': 'Twilio is not configured'}, status=status.HTTP_403_FORBIDDEN)
+
+        params = request.POST.dict()
+        if not valid_twilio_signature(request.build_absolute_uri(), params, request.headers.get('X-Twilio-Signature')):
+            return Response({'error': 'Invalid Twilio signature'}, status=status.HTTP_403_FORBIDDEN)
+
+        sid = params.get('MessageSid') or params.get('SmsSid')
+        message_status = params.get('MessageStatus') or params.get('SmsStatus')
+        if not sid or not message_status:
+            return Response(
+                {'error': 'MessageSid and MessageStatus are required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # States we do not track (e.g. 'scheduled') are acknowledged and ignored
+        if message_status in PROVIDER_STATUS_RANK:
+            batch = get_status_buffer().add(
+                StatusUpdate(sid, message_status, params.get('ErrorCode', ''), timezone.now())
+            )
+            if not batch.wait(settings.INVOICE_SETTINGS.get('STATUS_CALLBACK_ACK_TIMEOUT', 10)):
+                return Response(
+                    {'error': 'Status update could not be recorded, retry later'},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE
+                )
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=['post'])
+    def retry(self, request, pk=None):
+        """
+        Queue a dead-lettered notification again
+
+        POST /api/notifications/{id}/retry/
+        """
+        from .notifications import retry_notification
+
+        notification = self.get_object()
+        if not retry_notification(notification):
+            return Response(
+                {'error': f'Only dead-lettered notifications can be retried (notification is {notification.status})'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(self.get_serializer(notification).data, status=status.HTTP_202_ACCEPTED)
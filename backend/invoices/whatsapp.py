@@ -0,0 +1,155 @@
+"""
+WhatsApp delivery through Twilio's Messages API
+Building a twilio.rest.Client per message opens a new HTTPS connection for
+every send, and sending one message at a time leaves the worker waiting on
+Twilio's round trip for each of them. WhatsAppDispatcher keeps one pooled
+HTTP session (connections are kept alive and reused) and posts up to
+WHATSAPP_CONCURRENCY messages at once from a thread pool, returning every
+message's SID or error in input order.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+
+# One outgoing message: WhatsApp number, text, an optional media URL and
+# an optional URL for Twilio's delivery status callbacks
+WhatsAppMessage = namedtuple('WhatsAppMessage', ['to', 'body', 'media_url', 'status_callback'], defaults=(None,))
+
+
+class TwilioAPIError(Exception):
+    """Error reply from the Twilio API (status is the HTTP status, code Twilio's error code)"""
+
+    def __init__(self, status, code=None, message=''):
+        self.status = status
+        self.code = code
+        super().__init__(f"Twilio error {code or status}: {message}")
+
+
+def whatsapp_address(phone):
+    """Twilio 'To' address for a phone number"""
+    return f"whatsapp:+{phone.strip().lstrip('+')}"
+
+
+def whatsapp_message_body(invoice):
+    """Text sent with the invoice PDF"""
+    return f"""Hello {invoice.buyer_name},
+
+Your invoice is ready!
+
+Invoice #: {invoice.invoice_number}
+Date: {invoice.invoice_date.strftime('%d/%m/%Y')}
+Amount: ₹{invoice.total}
+
+Thank you for your business!
+- {invoice.seller_name}"""
+
+
+class WhatsAppDispatcher:
+    """
+    Sends WhatsApp messages concurrently over one pooled HTTP session
+    Use as a context manager, or call close() when done.
+    """
+
+    def __init__(self, concurrency=None, timeout=None, base_url=None,
+                 account_sid=None, auth_token=None, from_=None):
+        """
+        Args:
+            concurrency: messages in flight at once
+                (default INVOICE_SETTINGS['WHATSAPP_CONCURRENCY'])
+            timeout: seconds to wait for each API call
+                (default INVOICE_SETTINGS['WHATSAPP_TIMEOUT'])
+            base_url: Twilio API root (default TWILIO_API_BASE_URL)
+            account_sid, auth_token, from_: Twilio credentials and sender
+                (default the TWILIO_* settings)
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        if concurrency is None:
+            concurrency = settings.INVOICE_SETTINGS.get('WHATSAPP_CONCURRENCY', 8)
+        if timeout is None:
+            timeout = settings.INVOICE_SETTINGS.get('WHATSAPP_TIMEOUT', 10)
+        self.concurrency = max(1, int(concurrency))
+        self.timeout = timeout
+        self.from_ = from_ or settings.TWILIO_WHATSAPP_FROM
+        account_sid = account_sid or settings.TWILIO_ACCOUNT_SID
+        base_url = (base_url or getattr(settings, 'TWILIO_API_BASE_URL', 'https://api.twilio.com')).rstrip('/')
+        self.messages_url = f"{base_url}/2010-04-01/Accounts/{account_sid}/Messages.json"
+
+        # One kept-alive connection per worker thread
+        self.session = requests.Session()
+        self.session.auth = (account_sid, auth_token or settings.TWILIO_AUTH_TOKEN)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='whatsapp')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Wait for messages in flight, then close the pooled connections"""
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    def send_one(self, message):
+        """
+        Send one message on the calling thread
+        Returns:
+            str: Twilio message SID
+        Raises:
+            TwilioAPIError: Twilio rejected the message
+        """
+        data = {'From': self.from_, 'To': message.to, 'Body': message.body}
+        if message.media_url:
+            data['MediaUrl'] = message.media_url
+        if message.status_callback:
+            data['StatusCallback'] = message.status_callback
+        response = self.session.post(self.messages_url, data=data, timeout=self.timeout)
+
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = {}
+        if response.status_code >= 400:
+            raise TwilioAPIError(response.status_code, payload.get('code'),
+                                 payload.get('message') or response.reason)
+        return payload['sid']
+
+    def submit(self, message, limiter=None):
+        """
+        Queue one message on the thread pool
+        Args:
+            limiter: TokenBucket acquired by the sending thread just before
+                the message goes out
+        Returns:
+            Future: resolves to the message SID
+        """
+        return self.executor.submit(self._send_paced, message, limiter)
+
+    def send(self, messages, limiter=None):
+        """
+        Send messages concurrently
+        Returns:
+            list: message SID or the raised exception per message, in input order
+        """
+        futures = [self.submit(message, limiter) for message in messages]
+        return [future_result(future) for future in futures]
+
+    def _send_paced(self, message, limiter):
+        if limiter is not None:
+            limiter.acquire()
+        return self.send_one(message)
+
+
+def future_result(future):
+    """A future's result, or the exception it raised"""
+    try:
+        return future.result()
+    except Exception as e:
+        return e
+
@@ -7,6 +7,7 @@ export default function BulkUploadPage() {
   const [loading, setLoading] = useState(false);
   const [result, setResult] = useState<any>(null);
   const [error, setError] = useState<string | null>(null);
+  const [progress, setProgress] = useState<any>(null);
 
   const [formData, setFormData] = useState({
     invoiceType: 'user',
@@ -43,6 +44,9 @@ export default function BulkUploadPage() {
 
   const handleSubmit = async (e: React.FormEvent) => {
     e.preventDefault();
+    // "Check CSV" only validates the rows; nothing is created
+    const submitter = (e.nativeEvent as SubmitEvent).submitter as HTMLButtonElement | null;
+    const dryRun = submitter?.value === 'dry-run';
 
     if (!file) {
       setError('Please select a CSV file');
@@ -60,6 +64,7 @@ export default function BulkUploadPage() {
     setLoading(true);
     setError(null);
     setResult(null);
+    setProgress(null);
 
     try {
       const formDataToSend = new FormData();
@@ -70,6 +75,9 @@ export default function BulkUploadPage() {
       formDataToSend.append('send_email', formData.sendEmail.toString());
       formDataToSend.append('send_whatsapp', formData.sendWhatsapp.toString());
       formDataToSend.append('gst_rate', formData.gstRate);
+      if (dryRun) {
+        formDataToSend.append('dry_run', 'true');
+      }
 
       if (formData.invoiceType === 'user') {
         formDataToSend.append('seller_name', formData.sellerName);
@@ -86,9 +94,17 @@ export default function BulkUploadPage() {
         body: formDataToSend,
       });
 
+      if (dryRun && response.ok) {
+        setResult(await readDryRun(response));
+        return;
+      }
+
       const data = await response.json();
 
-      if (response.ok) {
+      if (response.status === 202) {
+        // Queued as a background job: poll its progress, then page through the results
+        setResult(await waitForJob(data));
+      } else if (response.ok) {
         setResult(data);
       } else {
         setError(data.error || 'Failed to upload CSV');
@@ -100,6 +116,83 @@ export default function BulkUploadPage() {
     }
   };
 
+  const readDryRun = async (response: Response) => {
+    // One JSON object per line: a result per row, then the summary
+    const failures: any[] = [];
+    let summary: any = null;
+    let buffered = '';
+    const reader = response.body!.getReader();
+    const decoder = new TextDecoder();
+    for (;;) {
+      const { done, value } = await reader.read();
+      buffered += decoder.decode(value, { stream: !done });
+      const lines = buffered.split('\n');
+      buffered = lines.pop() || '';
+      for (const line of lines.filter(Boolean)) {
+        const row = JSON.parse(line);
+        if (row.summary) {
+          summary = row.summary;
+        } else if (!row.valid) {
+          failures.push(row);
+        }
+      }
+      if (done) break;
+    }
+
+    return {
+      message: `Checked ${summary.total_rows} rows: ${summary.valid} valid, ${summary.invalid} invalid. No invoices were created.`,
+      summary: {
+        total_rows: summary.total_rows,
+        successful: summary.valid,
+        failed: summary.invalid,
+        emails_queued: null,
+        whatsapp_queued: null,
+      },
+      successes: [],
+      failures,
+    };
+  };
+
+  const waitForJob = async (job: any) => {
+    let status = job;
+    while (status.status === 'queued' || status.status === 'running') {
+      await new Promise((resolve) => setTimeout(resolve, 2000));
+      status = await (await fetch(job.status_url)).json();
+      setProgress(status);
+    }
+    if (status.status === 'failed') {
+      throw new Error(status.error || 'Bulk upload failed');
+    }
+
+    const successes: any[] = [];
+    const failures: any[] = [];
+    let next = job.results_url;
+    while (next) {
+      const page = await (await fetch(next)).json();
+      for (const row of page.results) {
+        (row.invoice_id ? successes : failures).push(row);
+      }
+      next = page.next;
+    }
+
+    return {
+      message: `Processed ${status.total_rows} rows. ${status.successful} successful, ${status.failed} failed.`,
+      batch_id: status.batch_id,
+      zip_download_url: status.zip_download_url,
+      failure_report_url: status.failure_report_url,
+      summary: {
+        total_rows: status.total_rows,
+        successful: status.successful,
+        failed: status.failed,
+        already_created: status.already_created,
+        emails_queued: formData.sendEmail ? status.emails_queued : null,
+        whatsapp_queued: formData.sendWhatsapp ? status.whatsapp_queued : null,
+      },
+      successes,
+      failures,
+    };
+  };
+
   const downloadSample = () => {
     const csvContent = `receiver_name,receiver_address,pincode,phone,email,gstin,product_descriptions,hsn_sac_codes,quantities,total_values
 "John Doe","123 Main Street, Bangalore","560001","919876543210","john@example.com","29ABCDE1234F1Z5","Website Development, SEO Services","998314, 998316","1, 2","59000, 23600"
@@ -134,11 +227,11 @@ export default function BulkUploadPage() {
             {/* CSV File Upload */}
             <div>
               <label className="block text-sm font-medium text-gray-700 mb-2">
-                CSV File *
+                CSV, Excel (.xlsx) or JSON Lines File *
               </label>
               <input
                 type="file"
-                accept=".csv"
+                accept=".csv,.xlsx,.jsonl,.ndjson"
                 onChange={handleFileChange}
                 className="block w-full text-sm text-gray-900 border border-gray-300 rounded-lg cursor-pointer bg-gray-50 focus:outline-none p-2.5"
               />
@@ -351,12 +444,24 @@ export default function BulkUploadPage() {
 
             {/* Submit Button */}
             <div className="pt-4">
+              <button
+                type="submit"
+                value="dry-run"
+                disabled={loading}
+                className="w-full mb-3 bg-white hover:bg-gray-50 text-blue-600 border border-blue-600 font-semibold py-3 px-6 rounded-lg disabled:opacity-50 disabled:cursor-not-allowed transition-colors"
+              >
+                Check CSV (no invoices created)
+              </button>
               <button
                 type="submit"
                 disabled={loading}
                 className="w-full bg-blue-600 hover:bg-blue-700 text-white font-semibold py-3 px-6 rounded-lg disabled:opacity-50 disabled:cursor-not-allowed transition-colors"
               >
-                {loading ? 'Processing...' : 'Upload & Generate Invoices'}
+                {loading
+                  ? progress
+                    ? `Processing... ${progress.rows_processed}/${progress.total_rows ?? '?'} rows`
+                    : 'Processing...'
+                  : 'Upload & Generate Invoices'}
               </button>
             </div>
           </form>
@@ -383,11 +488,14 @@ export default function BulkUploadPage() {
                   <li>Total Rows: {result.summary.total_rows}</li>
                   <li>✅ Successful: {result.summary.successful}</li>
                   <li>❌ Failed: {result.summary.failed}</li>
-                  {result.summary.emails_sent !== null && (
-                    <li>📧 Emails Sent: {result.summary.emails_sent}</li>
+                  {result.summary.already_created > 0 && (
+                    <li>♻️ Already Created (skipped): {result.summary.already_created}</li>
                   )}
-                  {result.summary.whatsapp_sent !== null && (
-                    <li>📱 WhatsApp Sent: {result.summary.whatsapp_sent}</li>
+                  {result.summary.emails_queued !== null && (
+                    <li>📧 Emails Queued: {result.summary.emails_queued}</li>
+                  )}
+                  {result.summary.whatsapp_queued !== null && (
+                    <li>📱 WhatsApp Queued: {result.summary.whatsapp_queued}</li>
                   )}
                 </ul>
               </div>
@@ -404,8 +512,9 @@ export default function BulkUploadPage() {
                             <p className="font-semibold">{success.buyer_name}</p>
                             <p className="text-gray-600">Invoice: {success.invoice_number}</p>
                             <p className="text-gray-600">Total: Rs. {success.total}</p>
-                            {success.email_sent && <p className="text-green-600">✓ Email Sent</p>}
-                            {success.whatsapp_sent && <p className="text-green-600">✓ WhatsApp Sent</p>}
+                            {success.already_created && <p className="text-gray-600">Already created by an earlier upload</p>}
+                            {success.email_queued && <p className="text-green-600">✓ Email Queued</p>}
+                            {success.whatsapp_queued && <p className="text-green-600">✓ WhatsApp Queued</p>}
                           </div>
                           <a
                             href={success.download_url}
@@ -422,6 +531,15 @@ export default function BulkUploadPage() {
                 </div>
               )}
 
+              {result.failure_report_url && (
+                <a
+                  href={result.failure_report_url}
+                  className="inline-block text-sm text-red-700 underline"
+                >
+                  Download failed rows (CSV)
+                </a>
+              )}
+
               {/* Failures List */}
               {result.failures && result.failures.length > 0 && (
                 <div>
@@ -39,8 +39,8 @@ export default function InvoiceSuccess({
         setLoading(true);
         const response = await onShareWhatsApp(invoice.id!, phone);
 
-        if (response.whatsapp_sid) {
-          alert('✓ Invoice PDF sent directly to WhatsApp!');
+        if (response.notification_id) {
+          alert('✓ Invoice PDF queued for delivery on WhatsApp!');
         } else if (response.whatsapp_link) {
           window.open(response.whatsapp_link, '_blank');
           alert(response.note || 'WhatsApp opened with invoice details');
@@ -62,7 +62,7 @@ export default function InvoiceSuccess({
       try {
         setLoading(true);
         await onShareEmail(invoice.id!, email);
-        alert(`✓ Invoice PDF sent successfully to ${email}!`);
+        alert(`✓ Invoice PDF queued for delivery to ${email}!`);
       } catch (error: any) {
         alert(error.response?.data?.error || 'Failed to send email');
       } finally {
@@ -23,9 +23,20 @@ export const invoiceApi = {
 
   downloadPdf: async (id: number) => {
     const api = await getAxios();
-    const response = await api.get(`/invoices/${id}/download_pdf/`, {
+    let response = await api.get(`/invoices/${id}/download_pdf/`, {
       responseType: 'blob',
     });
+    // 202 means the PDF is still being rendered in the background
+    for (let attempt = 0; response.status === 202 && attempt < 30; attempt++) {
+      const retryAfter = Number(response.headers['retry-after']) || 2;
+      await new Promise((resolve) => setTimeout(resolve, retryAfter * 1000));
+      response = await api.get(`/invoices/${id}/download_pdf/`, {
+        responseType: 'blob',
+      });
+    }
+    if (response.status === 202) {
+      throw new Error('PDF is still being generated, please try again shortly');
+    }
     const url = window.URL.createObjectURL(new Blob([response.data]));
     const link = document.createElement('a');
     link.href = url;
@@ -5,6 +5,9 @@ echo ========================================
 echo.
 
 cd backend
+start "PDF Worker" python manage.py run_pdf_worker
+start "Bulk Upload Worker" python manage.py run_bulk_upload_worker
+start "Notification Worker" python manage.py run_notification_worker
 python manage.py runserver
 
 echo.
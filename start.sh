@@ -10,6 +10,15 @@ cd backend
 python manage.py runserver &
 BACKEND_PID=$!
 echo "Backend started on http://127.0.0.1:8000 (PID: $BACKEND_PID)"
+python manage.py run_pdf_worker &
+WORKER_PID=$!
+echo "PDF worker started (PID: $WORKER_PID)"
+python manage.py run_bulk_upload_worker &
+BULK_WORKER_PID=$!
+echo "Bulk upload worker started (PID: $BULK_WORKER_PID)"
+python manage.py run_notification_worker &
+NOTIFICATION_WORKER_PID=$!
+echo "Notification worker started (PID: $NOTIFICATION_WORKER_PID)"
 echo ""
 
 echo "[2/2] Starting Frontend Server (Next.js with Turbopack)..."
@@ -30,5 +39,5 @@ echo "Press Ctrl+C to stop both servers"
 echo ""
 
 # Wait for user interrupt
-trap "echo ''; echo 'Stopping servers...'; kill $BACKEND_PID $FRONTEND_PID; exit" INT
+trap "echo ''; echo 'Stopping servers...'; kill $BACKEND_PID $WORKER_PID $BULK_WORKER_PID $NOTIFICATION_WORKER_PID $FRONTEND_PID; exit" INT
 wait